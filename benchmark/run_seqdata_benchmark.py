@@ -0,0 +1,148 @@
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+import remixt.seqdataio
+
+
+def create_synthetic_seqdata(num_fragments, alleles_per_fragment=0.1, seed=2014):
+    """ Create synthetic fragment and allele data resembling extracted bam data.
+
+    Args:
+        num_fragments (int): number of fragments
+
+    KwArgs:
+        alleles_per_fragment (float): mean number of alleles per fragment
+        seed (int): random seed
+
+    Returns:
+        tuple: fragment data, allele data
+
+    """
+
+    np.random.seed(seed)
+
+    fragments = pd.DataFrame({'fragment_id': np.arange(num_fragments, dtype=np.int32)})
+    fragments['start'] = np.cumsum(np.random.geometric(0.1, size=num_fragments))
+    fragments['end'] = fragments['start'] + np.random.normal(300, 50, size=num_fragments).clip(50, 1000).astype(int)
+    fragments['mapping_quality'] = np.where(np.random.random(num_fragments) < 0.95, 60, np.random.randint(0, 60, size=num_fragments))
+    fragments['is_duplicate'] = (np.random.random(num_fragments) < 0.05).astype(int)
+
+    num_alleles = int(num_fragments * alleles_per_fragment)
+    alleles = pd.DataFrame({'fragment_id': np.sort(np.random.randint(0, num_fragments, size=num_alleles))})
+    alleles['position'] = fragments['start'].values[alleles['fragment_id'].values] + np.random.randint(0, 100, size=num_alleles)
+    alleles['is_alt'] = np.random.randint(0, 2, size=num_alleles)
+
+    return fragments, alleles
+
+
+def write_legacy_seqdata(seqdata_filename, fragments, alleles, chunksize):
+    """ Write seqdata as pandas tables with zlib level 9, as for earlier versions.
+    """
+
+    with pd.HDFStore(seqdata_filename, 'w', complevel=9, complib='zlib') as store:
+        for start in range(0, len(fragments.index), chunksize):
+            fragments_chunk = fragments.iloc[start:start + chunksize]
+            alleles_chunk = alleles[(alleles['fragment_id'] >= start) & (alleles['fragment_id'] < start + chunksize)]
+            store.append('/fragments/chromosome_1', fragments_chunk)
+            store.append('/alleles/chromosome_1', alleles_chunk)
+
+
+def write_seqdata(seqdata_filename, fragments, alleles, chunksize, complib, complevel):
+    with remixt.seqdataio.Writer(seqdata_filename, complib=complib, complevel=complevel) as writer:
+        for start in range(0, len(fragments.index), chunksize):
+            fragments_chunk = fragments.iloc[start:start + chunksize]
+            alleles_chunk = alleles[(alleles['fragment_id'] >= start) & (alleles['fragment_id'] < start + chunksize)]
+            writer.write('1', fragments_chunk, alleles_chunk)
+
+
+def benchmark_codec(seqdata_filename, fragments, alleles, chunksize, complib, complevel):
+    """ Time writing and reading synthetic seqdata with a compression codec.
+
+    Args:
+        seqdata_filename (str): temporary seqdata filename
+        fragments (pandas.DataFrame): fragment data
+        alleles (pandas.DataFrame): allele data
+        chunksize (int): fragments per write
+        complib (str): compression library, None for legacy pandas tables
+        complevel (int): compression level
+
+    Returns:
+        dict: file size, write and read times
+
+    """
+
+    start_time = time.time()
+    if complib is None:
+        write_legacy_seqdata(seqdata_filename, fragments, alleles, chunksize)
+    else:
+        write_seqdata(seqdata_filename, fragments, alleles, chunksize, complib, complevel)
+    write_time = time.time() - start_time
+
+    start_time = time.time()
+    fragments_test = remixt.seqdataio.read_fragment_data(seqdata_filename, '1', map_qual_threshold=None)
+    alleles_test = remixt.seqdataio.read_allele_data(seqdata_filename, '1')
+    read_time = time.time() - start_time
+
+    assert len(fragments_test.index) == len(fragments.index)
+    assert len(alleles_test.index) == len(alleles.index)
+    assert np.all(fragments_test['start'].values == fragments['start'].values)
+
+    data_size = float(fragments.memory_usage(index=False).sum() + alleles.memory_usage(index=False).sum())
+
+    return {
+        'complib': 'legacy' if complib is None else complib,
+        'complevel': 9 if complib is None else complevel,
+        'file_size': os.path.getsize(seqdata_filename),
+        'write_time': write_time,
+        'read_time': read_time,
+        'write_mb_per_sec': data_size / write_time / 1e6,
+        'read_mb_per_sec': data_size / read_time / 1e6,
+    }
+
+
+if __name__ == '__main__':
+
+    argparser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+
+    argparser.add_argument('table',
+        help='Output Table Filename')
+
+    argparser.add_argument('--num_fragments', type=int, default=10000000,
+        help='Number of synthetic fragments')
+
+    argparser.add_argument('--chunksize', type=int, default=1000000,
+        help='Fragments per write')
+
+    argparser.add_argument('--codecs', nargs='+', default=['zlib:9', 'blosc:lz4:5', 'blosc:zstd:5', 'blosc:zstd:9'],
+        help='Codecs to benchmark as complib:complevel')
+
+    args = vars(argparser.parse_args())
+
+    fragments, alleles = create_synthetic_seqdata(args['num_fragments'])
+
+    codecs = [(None, None)]
+    for codec in args['codecs']:
+        complib, complevel = codec.rsplit(':', 1)
+        codecs.append((complib, int(complevel)))
+
+    temp_dir = tempfile.mkdtemp()
+
+    try:
+        results = list()
+        for complib, complevel in codecs:
+            seqdata_filename = os.path.join(temp_dir, 'seqdata.h5')
+            results.append(benchmark_codec(seqdata_filename, fragments, alleles, args['chunksize'], complib, complevel))
+            os.remove(seqdata_filename)
+            print(results[-1])
+
+    finally:
+        shutil.rmtree(temp_dir)
+
+    results = pd.DataFrame(results)
+    results.to_csv(args['table'], sep='\t', index=False)
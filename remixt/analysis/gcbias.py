@@ -9,19 +9,20 @@ import remixt.seqdataio
 import remixt.utils
 
 
-def sample_gc(gc_samples_filename, seqdata_filename, fragment_length, config, ref_data_dir):
+def sample_gc_positions(config, ref_data_dir):
+    """ Sample genomic positions uniformly from the genome for gc bias estimation
+
+    Args:
+        config (dict): relevant parameters
+        ref_data_dir (str): reference data directory
+
+    Returns:
+        pandas.DataFrame: sampled positions with columns 'chromosome', 'position'
+
+    """
 
-    chromosomes = remixt.config.get_chromosomes(config, ref_data_dir)
     chromosome_lengths = remixt.config.get_chromosome_lengths(config, ref_data_dir)
     num_samples = remixt.config.get_param(config, 'sample_gc_num_positions')
-    position_offset = remixt.config.get_param(config, 'gc_position_offset')
-    genome_fasta = remixt.config.get_filename(config, ref_data_dir, 'genome_fasta')
-    mappability_filename = remixt.config.get_filename(config, ref_data_dir, 'mappability')
-    filter_duplicates = remixt.config.get_param(config, 'filter_duplicates')
-    map_qual_threshold = remixt.config.get_param(config, 'map_qual_threshold')
-
-    fragment_length = int(fragment_length)
-    gc_window = fragment_length - 2 * position_offset
 
     chrom_info = pd.DataFrame({'chrom_length':chromosome_lengths})
     chrom_info['chrom_end'] = chrom_info['chrom_length'].cumsum()
@@ -31,9 +32,60 @@ def sample_gc(gc_samples_filename, seqdata_filename, fragment_length, config, re
     genome_length = chrom_info['chrom_length'].sum()
     sample_pos = np.sort(np.random.randint(0, genome_length, num_samples))
 
+    # Calculate position in non-concatenated genome
+    sample_chrom_idx = np.searchsorted(chrom_info['chrom_end'].values, sample_pos, side='right')
+    sample_chrom = chrom_info.index.values[sample_chrom_idx]
+    sample_chrom_pos = sample_pos - chrom_info['chrom_start'].values[sample_chrom_idx]
+
+    return pd.DataFrame({
+        'chromosome':sample_chrom,
+        'position':sample_chrom_pos,
+    })
+
+
+def write_gc_positions(gc_positions_filename, config, ref_data_dir):
+    """ Write positions sampled for gc bias estimation
+
+    Args:
+        gc_positions_filename (str): output TSV chromosome, position file
+        config (dict): relevant parameters
+        ref_data_dir (str): reference data directory
+
+    """
+
+    gc_positions = sample_gc_positions(config, ref_data_dir)
+    gc_positions.to_csv(gc_positions_filename, sep='\t', index=False, columns=['chromosome', 'position'])
+
+
+def calculate_gc_percent(gc_samples, fragment_length, config, ref_data_dir):
+    """ Calculate gc content of fragments starting at sampled positions
+
+    Args:
+        gc_samples (pandas.DataFrame): sampled positions
+        fragment_length (int): length of fragments for which gc content is calculated
+        config (dict): relevant parameters
+        ref_data_dir (str): reference data directory
+
+    Returns:
+        pandas.DataFrame: sampled positions with additional column 'gc_percent'
+
+    Input gc samples should have columns 'chromosome', 'position'.  Positions that
+    are unmappable or too close to the end of the chromosome are removed.
+
+    """
+
+    chromosomes = remixt.config.get_chromosomes(config, ref_data_dir)
+    position_offset = remixt.config.get_param(config, 'gc_position_offset')
+    genome_fasta = remixt.config.get_filename(config, ref_data_dir, 'genome_fasta')
+    mappability_filename = remixt.config.get_filename(config, ref_data_dir, 'mappability')
+    map_qual_threshold = remixt.config.get_param(config, 'map_qual_threshold')
+
+    fragment_length = int(fragment_length)
+    gc_window = fragment_length - 2 * position_offset
+
     # Calculate GC/mappability for each position
-    sample_gc_count = np.zeros(sample_pos.shape)
-    sample_mappability = np.ones(sample_pos.shape)
+    sample_gc_count = np.zeros(gc_samples.shape[0])
+    sample_mappability = np.ones(gc_samples.shape[0])
     for chrom_id, sequence in remixt.utils.read_sequences(genome_fasta):
 
         # Ignore extraneous chromosomes
@@ -43,9 +95,6 @@ def sample_gc(gc_samples_filename, seqdata_filename, fragment_length, config, re
         # Read indicator of mappability based on threshold
         mappability = read_mappability_indicator(mappability_filename, chrom_id, len(sequence), map_qual_threshold)
 
-        # Start and end of current chromosome in concatenated genome
-        chrom_start, chrom_end = chrom_info.loc[chrom_id, ['chrom_start', 'chrom_end']].values
-
         # Calculate gc count within sliding window
         sequence = np.array(list(sequence.upper()))
         gc = ((sequence == 'G') | (sequence == 'C'))
@@ -56,10 +105,10 @@ def sample_gc(gc_samples_filename, seqdata_filename, fragment_length, config, re
         gc_count = np.concatenate([gc_count, np.ones(fragment_length) * np.nan])
 
         # Calculate filter of positions in this chromosome
-        chrom_sample_idx = (sample_pos >= chrom_start) & (sample_pos < chrom_end)
+        chrom_sample_idx = (gc_samples['chromosome'].values == chrom_id)
 
         # Calculate positions within this chromosome
-        sample_chrom_pos = sample_pos[chrom_sample_idx] - chrom_start
+        sample_chrom_pos = gc_samples['position'].values[chrom_sample_idx]
 
         # Set the mappability indicator of the start positions of each read
         sample_mappability[chrom_sample_idx] *= mappability[sample_chrom_pos]
@@ -72,61 +121,96 @@ def sample_gc(gc_samples_filename, seqdata_filename, fragment_length, config, re
 
     # Filter unmappable positions and nan gc count values
     sample_filter = ((sample_mappability > 0) & (~np.isnan(sample_gc_count)))
-    sample_pos = sample_pos[sample_filter]
-    sample_gc_count = sample_gc_count[sample_filter]
+    gc_samples = gc_samples[sample_filter].copy()
+    gc_samples['gc_percent'] = sample_gc_count[sample_filter] / float(gc_window)
+
+    return gc_samples
+
+
+def count_fragment_starts(seqdata_filename, gc_samples, config):
+    """ Count fragments starting at sampled positions
+
+    Args:
+        seqdata_filename (str): input sequence data file
+        gc_samples (pandas.DataFrame): sampled positions
+        config (dict): relevant parameters
 
-    sample_gc_percent = sample_gc_count / float(gc_window)
+    Returns:
+        numpy.array: number of fragments starting at each sampled position
 
-    # Count number of reads at each position
-    sample_read_count = np.zeros(sample_pos.shape, dtype=int)
+    Input gc samples should have columns 'chromosome', 'position'.
+
+    """
+
+    filter_duplicates = remixt.config.get_param(config, 'filter_duplicates')
+    map_qual_threshold = remixt.config.get_param(config, 'map_qual_threshold')
+
+    sample_read_count = np.zeros(gc_samples.shape[0], dtype=int)
     for chrom_id in remixt.seqdataio.read_chromosomes(seqdata_filename):
 
+        chrom_sample_idx = (gc_samples['chromosome'].values == chrom_id)
+
         # Ignore extraneous chromosomes
-        if chrom_id not in chromosomes:
+        if not chrom_sample_idx.any():
             continue
 
+        sample_chrom_pos = gc_samples['position'].values[chrom_sample_idx]
+
         reads_iter = remixt.seqdataio.read_fragment_data(
             seqdata_filename, chrom_id,
             filter_duplicates=filter_duplicates,
             map_qual_threshold=map_qual_threshold,
-            chunksize=1000000)
+            chunksize=1000000,
+            columns=['start', 'end'])
 
         for chrom_reads in reads_iter:
 
-            # Calculate read start in concatenated genome
-            chrom_reads['start'] += chrom_info.loc[chrom_id, 'chrom_start']
-
             # Add reads at each start
-            sample_read_count += (
+            sample_read_count[chrom_sample_idx] += (
                 chrom_reads
                 .groupby('start')['end']
                 .count()
-                .reindex(sample_pos)
+                .reindex(sample_chrom_pos)
                 .fillna(0)
                 .astype(int)
                 .values
             )
 
-    # Calculate position in non-concatenated genome
-    sample_chrom_idx = np.searchsorted(chrom_info['chrom_end'].values, sample_pos, side='right')
-    sample_chrom = chrom_info.index.values[sample_chrom_idx]
-    sample_chrom_pos = sample_pos - chrom_info['chrom_start'].values[sample_chrom_idx]
+    return sample_read_count
+
 
+def _write_gc_samples(gc_samples_filename, gc_samples):
     # Output chromosome, position, gc percent, read count
-    gc_sample_data = pd.DataFrame({
-        'chromosome':sample_chrom,
-        'position':sample_chrom_pos,
-        'gc_percent':sample_gc_percent,
-        'read_count':sample_read_count,
-    })
-    gc_sample_data = gc_sample_data[[
-        'chromosome',
-        'position',
-        'gc_percent',
-        'read_count'
-    ]]
-
-    gc_sample_data.to_csv(gc_samples_filename, sep='\t', header=False, index=False)
+    gc_samples.to_csv(
+        gc_samples_filename, sep='\t', header=False, index=False,
+        columns=['chromosome', 'position', 'gc_percent', 'read_count'])
+
+
+def sample_gc(gc_samples_filename, seqdata_filename, fragment_length, config, ref_data_dir):
+
+    gc_samples = sample_gc_positions(config, ref_data_dir)
+    gc_samples = calculate_gc_percent(gc_samples, fragment_length, config, ref_data_dir)
+    gc_samples['read_count'] = count_fragment_starts(seqdata_filename, gc_samples, config)
+
+    _write_gc_samples(gc_samples_filename, gc_samples)
+
+
+def sample_gc_from_counts(gc_samples_filename, gc_counts_filename, fragment_length, config, ref_data_dir):
+    """ Create gc samples from fragment start counts at previously sampled positions
+
+    Args:
+        gc_samples_filename (str): output gc samples file
+        gc_counts_filename (str): input TSV with columns 'chromosome', 'position', 'read_count'
+        fragment_length (int): length of fragments for which gc content is calculated
+        config (dict): relevant parameters
+        ref_data_dir (str): reference data directory
+
+    """
+
+    gc_samples = pd.read_csv(gc_counts_filename, sep='\t', converters={'chromosome': str})
+    gc_samples = calculate_gc_percent(gc_samples, fragment_length, config, ref_data_dir)
+
+    _write_gc_samples(gc_samples_filename, gc_samples)
 
 
 def gc_lowess(gc_samples_filename, gc_dist_filename, gc_table_filename, gc_resolution=100):
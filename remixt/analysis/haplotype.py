@@ -57,10 +57,17 @@ def read_snp_counts(seqdata_filename, chromosome, num_rows=1000000):
 
     Returned dataframe has columns 'position', 'ref_count', 'alt_count'
 
+    Counts recorded in the seqdata file are used if available.
+
     """
 
+    snp_counts = remixt.seqdataio.read_snp_counts(seqdata_filename, chromosome)
+
+    if snp_counts is not None:
+        return snp_counts
+
     snp_counts = list()
-    for alleles_chunk in remixt.seqdataio.read_allele_data(seqdata_filename, chromosome, chunksize=num_rows):
+    for alleles_chunk in remixt.seqdataio.read_allele_data(seqdata_filename, chromosome, chunksize=num_rows, columns=['position', 'is_alt']):
 
         if len(alleles_chunk.index) == 0:
             snp_counts.append(pd.DataFrame(columns=['position', 'ref_count', 'alt_count'], dtype=int))
@@ -364,44 +371,132 @@ def count_allele_reads(seqdata_filename, haps, chromosome, segments, filter_dupl
 
     """
 
+    alleles = read_first_hap_alleles(seqdata_filename, haps, chromosome)
+    allele_fragment_ids = alleles['fragment_id'].values
+
+    # Read fragment data with filtering
+    reads_iter = remixt.seqdataio.read_fragment_data(
+        seqdata_filename, chromosome,
+        filter_duplicates=filter_duplicates,
+        map_qual_threshold=map_qual_threshold,
+        chunksize=1000000,
+        columns=['fragment_id', 'start', 'end'],
+    )
+
+    # Join read start and end into read alleles table by searching the sorted
+    # allele fragment ids, note this join will also remove filtered reads
+    read_alleles = [alleles.iloc[0:0].assign(start=0, end=0)]
+    for reads in reads_iter:
+        if len(allele_fragment_ids) == 0:
+            break
+
+        fragment_ids = reads['fragment_id'].values
+        allele_idx = np.searchsorted(allele_fragment_ids, fragment_ids).clip(0, len(allele_fragment_ids) - 1)
+        is_allele = allele_fragment_ids[allele_idx] == fragment_ids
+        read_alleles.append(alleles.iloc[allele_idx[is_allele]].assign(
+            start=reads['start'].values[is_allele],
+            end=reads['end'].values[is_allele]))
+    alleles = pd.concat(read_alleles, ignore_index=True)
+
+    return count_segment_alleles(alleles, chromosome, segments)
+
+
+def read_first_hap_alleles(seqdata_filename, haps, chromosome, chunksize=1000000):
+    """ Read the haplotype block allele of each read for a given chromosome
+
+    Args:
+        seqdata_filename (str): input sequence data file
+        haps (pandas.DataFrame): input haplotype data
+        chromosome (str): id of chromosome for which alleles will be read
+
+    KwArgs:
+        chunksize (int): number of alleles to read at a time
+
+    Returns:
+        pandas.DataFrame: haplotype block alleles of reads, ordered by fragment id
+
+    Input haps should have columns as for `count_allele_reads`.  A haplotype/allele label
+    is arbitrarily assigned to each read, the first allele of the read at a snp in a
+    haplotype block in the order the alleles are stored in the seqdata, which is the
+    order alleles are extracted from the bam, consistent with `count_bam_region`.
+
+    """
+
     # Select haps for given chromosome
     haps = haps[haps['chromosome'] == chromosome]
 
-    # Merge haplotype information into read alleles table
+    # Alleles sorted by fragment id across the seqdata have all alleles of a read
+    # in consecutive chunks, and the first allele of each read is selected per chunk
+    fragment_id_sorted = remixt.seqdataio.read_fragment_id_sorted(seqdata_filename, 'alleles', chromosome)
+
+    # Merge haplotype information into read alleles table, recording the order
+    # of alleles in the seqdata as not all versions of pandas preserve the order
+    # of the left table in an inner merge
     alleles = list()
-    for alleles_chunk in remixt.seqdataio.read_allele_data(seqdata_filename, chromosome, chunksize=1000000):
+    allele_offset = 0
+    last_fragment_id = -1
+    for alleles_chunk in remixt.seqdataio.read_allele_data(seqdata_filename, chromosome, chunksize=chunksize):
+        alleles_chunk['allele_order'] = np.arange(allele_offset, allele_offset + len(alleles_chunk.index))
+        allele_offset += len(alleles_chunk.index)
         alleles_chunk = alleles_chunk.merge(haps, left_on=['position', 'is_alt'], right_on=['position', 'allele'], how='inner')
+
+        if fragment_id_sorted:
+            alleles_chunk = _select_first_alleles(alleles_chunk)
+            alleles_chunk = alleles_chunk[alleles_chunk['fragment_id'] > last_fragment_id]
+            if len(alleles_chunk.index) > 0:
+                last_fragment_id = alleles_chunk['fragment_id'].values[-1]
+
         alleles.append(alleles_chunk)
     alleles = pd.concat(alleles, ignore_index=True)
 
-    # Read fragment data with filtering
-    reads = remixt.seqdataio.read_fragment_data(
-        seqdata_filename, chromosome,
-        filter_duplicates=filter_duplicates,
-        map_qual_threshold=map_qual_threshold,
-    )
+    if not fragment_id_sorted:
+        alleles = _select_first_alleles(alleles)
+
+    alleles = alleles.drop('allele_order', axis=1).reset_index(drop=True)
 
-    # Merge read start and end into read alleles table
-    # Note this merge will also remove filtered reads from the allele table
-    alleles = alleles.merge(reads, on='fragment_id')
+    return alleles
+
+
+def _select_first_alleles(alleles):
+    """ Select the first allele of each read in seqdata order, ordered by fragment id
+    """
 
-    # Arbitrarily assign a haplotype/allele label to each read
-    alleles.drop_duplicates('fragment_id', inplace=True)
+    alleles = alleles.sort_values('allele_order', kind='mergesort')
+    _, first_allele_idx = np.unique(alleles['fragment_id'].values, return_index=True)
+
+    return alleles.iloc[first_allele_idx]
+
+
+def count_segment_alleles(alleles, chromosome, segments):
+    """ Count reads for each allele of haplotype blocks within segments
+
+    Args:
+        alleles (pandas.DataFrame): haplotype block alleles of reads
+        chromosome (str): id of chromosome of the alleles and segments
+        segments (pandas.DataFrame): input genomic segments
+
+    Returns:
+        pandas.DataFrame: allele counts, as for `count_allele_reads`
+
+    Input alleles should have columns 'start', 'end', 'hap_label', 'allele_id', with
+    at most one allele for each read.
+
+    """
 
     # Sort in preparation for search, reindex to allow for subsequent merge
     segments = segments.sort_values('start').reset_index(drop=True)
 
     # Annotate segment for start and end of each read
-    alleles['segment_idx'] = remixt.segalg.find_contained_segments(
+    alleles = alleles.assign(segment_idx=remixt.segalg.find_contained_segments(
         segments[['start', 'end']].values,
         alleles[['start', 'end']].values,
-    )
+    ))
 
     # Remove reads not contained within any segment
     alleles = alleles[alleles['segment_idx'] >= 0]
 
     # Drop unecessary columns
-    alleles.drop(['start', 'end'], axis=1, inplace=True)
+    alleles = alleles.drop(['start', 'end'], axis=1)
 
     # Merge segment start end, key for each segment (for given chromosome)
     alleles = alleles.merge(segments[['start', 'end']], left_on='segment_idx', right_index=True)
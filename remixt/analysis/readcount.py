@@ -1,11 +1,27 @@
+import numpy as np
 import pandas as pd
 
 import remixt.config
+import remixt.bamreader
+import remixt.segalg
+import remixt.seqdataio
 import remixt.analysis.segment
 import remixt.analysis.haplotype
+import remixt.analysis.stats
 
 
-def segment_readcount(segment_counts_filename, segment_filename, seqdata_filename, config):
+def create_bin_counts(bin_counts_filename, seqdata_filename, config):
+
+    remixt.analysis.segment.create_bin_counts(
+        bin_counts_filename,
+        seqdata_filename,
+        bin_size=remixt.config.get_param(config, 'segment_count_bin_size'),
+        filter_duplicates=remixt.config.get_param(config, 'filter_duplicates'),
+        map_qual_threshold=remixt.config.get_param(config, 'map_qual_threshold'),
+    )
+
+
+def segment_readcount(segment_counts_filename, segment_filename, seqdata_filename, config, bin_counts_filename=None):
 
     segments = pd.read_csv(segment_filename, sep='\t', converters={'chromosome': str})
 
@@ -17,11 +33,33 @@ def segment_readcount(segment_counts_filename, segment_filename, seqdata_filenam
         seqdata_filename,
         filter_duplicates=filter_duplicates,
         map_qual_threshold=map_qual_threshold,
+        bin_counts_filename=bin_counts_filename,
     )
 
     segment_counts.to_csv(segment_counts_filename, sep='\t', index=False)
 
 
+def multiple_segment_readcount(segment_counts_filenames, segment_filename, seqdata_filenames, config, bin_counts_filenames=None):
+
+    segments = pd.read_csv(segment_filename, sep='\t', converters={'chromosome': str})
+
+    filter_duplicates = remixt.config.get_param(config, 'filter_duplicates')
+    map_qual_threshold = remixt.config.get_param(config, 'map_qual_threshold')
+    processes = remixt.config.get_param(config, 'segment_count_processes')
+
+    segment_counts = remixt.analysis.segment.create_multiple_segment_counts(
+        segments,
+        seqdata_filenames,
+        filter_duplicates=filter_duplicates,
+        map_qual_threshold=map_qual_threshold,
+        bin_counts_filenames=bin_counts_filenames,
+        processes=processes,
+    )
+
+    for sample_id, sample_segment_counts in segment_counts.items():
+        sample_segment_counts.to_csv(segment_counts_filenames[sample_id], sep='\t', index=False)
+
+
 def haplotype_allele_readcount(allele_counts_filename, segment_filename, seqdata_filename, haps_filename, config):
     
     segments = pd.read_csv(segment_filename, sep='\t', converters={'chromosome': str})
@@ -65,4 +103,293 @@ def prepare_readcount_table(segments_filename, alleles_filename, count_filename)
     segment_allele_counts.to_csv(count_filename, sep='\t', index=False)
 
 
+def write_het_snps(het_snps_filename, snp_positions_filename, haps_filename):
+    """ Write the subset of snp positions that are heterozygous
+
+    Args:
+        het_snps_filename (str): output TSV chromosome, position, ref, alt file
+        snp_positions_filename (str): input TSV chromosome, position, ref, alt file
+        haps_filename (str): input haplotype data file
+
+    """
+
+    haps = pd.read_csv(haps_filename, sep='\t', converters={'chromosome': str})
+    haps = haps[['chromosome', 'position']].drop_duplicates()
+
+    snps_iter = pd.read_csv(
+        snp_positions_filename, sep='\t', header=None,
+        names=['chromosome', 'position', 'ref', 'alt'],
+        converters={'chromosome': str}, chunksize=1000000)
+
+    with open(het_snps_filename, 'w') as het_snps_file:
+        for snps in snps_iter:
+            het_snps = snps.merge(haps, on=['chromosome', 'position'])
+            het_snps.to_csv(het_snps_file, sep='\t', header=False, index=False)
+
+
+def count_seqdata(segment_counts_filename, allele_counts_filename, gc_counts_filename, seqdata_filename, segment_filename, haps_filename, gc_positions_filename, config):
+    """ Count reads in segments, alleles and gc sampled positions in a single pass of seqdata
+
+    Args:
+        segment_counts_filename (str): output segment counts, as for `segment_readcount`
+        allele_counts_filename (str): output allele counts, as for `haplotype_allele_readcount`
+        gc_counts_filename (str): output counts of fragments starting at gc sampled positions
+        seqdata_filename (str): input sequence data file
+        segment_filename (str): input segments file
+        haps_filename (str): input haplotype data file
+        gc_positions_filename (str): positions sampled for gc bias estimation
+        config (dict): relevant parameters
+
+    Returns:
+        FragmentStats: fragment length mean and standard deviation
+
+    Each chunk of fragments is read once and counted for each of the outputs, with the
+    same results as `segment_readcount`, `haplotype_allele_readcount`, counting fragment
+    starts for `remixt.analysis.gcbias.sample_gc`, and `remixt.analysis.stats.calculate_fragment_stats`.
+
+    """
+
+    filter_duplicates = remixt.config.get_param(config, 'filter_duplicates')
+    map_qual_threshold = remixt.config.get_param(config, 'map_qual_threshold')
+
+    segments = pd.read_csv(segment_filename, sep='\t', converters={'chromosome': str})
+    haps = pd.read_csv(haps_filename, sep='\t', converters={'chromosome': str})
+    gc_positions = pd.read_csv(gc_positions_filename, sep='\t', converters={'chromosome': str})
+
+    segment_counts = list()
+    allele_counts = list()
+    gc_positions['read_count'] = 0
+    fragment_length_moments = np.zeros(3)
+
+    segment_chromosomes = set(segments['chromosome'].unique())
+    chromosomes = sorted(segment_chromosomes | set(remixt.seqdataio.read_chromosomes(seqdata_filename)))
+
+    for chromosome in chromosomes:
+        chrom_segments = segments[segments['chromosome'] == chromosome].sort_values('start')
+        segment_positions = chrom_segments[['start', 'end']].values
+        segment_readcount = np.zeros(len(chrom_segments.index), dtype=int)
+
+        # Unique sorted gc sampled positions, counts are expanded to all samples
+        gc_idx = np.where(gc_positions['chromosome'].values == chromosome)[0]
+        sample_positions, sample_inverse = np.unique(gc_positions['position'].values[gc_idx], return_inverse=True)
+        sample_read_count = np.zeros(len(sample_positions), dtype=int)
+
+        # Haplotype block allele of each read, ordered by fragment id
+        allele_fragment_ids = np.zeros(0, dtype=int)
+        if chromosome in segment_chromosomes:
+            alleles = remixt.analysis.haplotype.read_first_hap_alleles(seqdata_filename, haps, chromosome)
+            allele_fragment_ids = alleles['fragment_id'].values
+        read_alleles = list()
+
+        reads_iter = remixt.seqdataio.read_fragment_data(
+            seqdata_filename, chromosome,
+            filter_duplicates=filter_duplicates,
+            map_qual_threshold=map_qual_threshold,
+            chunksize=1000000,
+            columns=['fragment_id', 'start', 'end'],
+        )
+
+        for reads in reads_iter:
+            fragment_ids = reads['fragment_id'].values
+            starts = reads['start'].values
+            ends = reads['end'].values
+
+            # Moments of the fragment length distribution
+            lengths = ends - starts
+            fragment_length_moments += (lengths.shape[0], lengths.sum(), (lengths * lengths).sum())
+
+            # Reads contained in each segment
+            if segment_positions.shape[0] > 0:
+                segment_readcount += remixt.segalg.contained_counts(segment_positions, reads[['start', 'end']].values)
+
+            # Reads starting at each sampled position
+            if len(sample_positions) > 0:
+                sample_idx = np.searchsorted(sample_positions, starts).clip(0, len(sample_positions) - 1)
+                is_sample = sample_positions[sample_idx] == starts
+                sample_read_count += np.bincount(sample_idx[is_sample], minlength=len(sample_positions))
+
+            # Start and end of reads with a haplotype block allele
+            if len(allele_fragment_ids) > 0:
+                allele_idx = np.searchsorted(allele_fragment_ids, fragment_ids).clip(0, len(allele_fragment_ids) - 1)
+                is_allele = allele_fragment_ids[allele_idx] == fragment_ids
+                read_alleles.append(alleles.iloc[allele_idx[is_allele]].assign(start=starts[is_allele], end=ends[is_allele]))
+
+        gc_positions.loc[gc_positions.index[gc_idx], 'read_count'] = sample_read_count[sample_inverse]
+
+        if chromosome not in segment_chromosomes:
+            continue
+
+        chrom_segments['readcount'] = segment_readcount
+        segment_counts.append(chrom_segments)
+
+        if len(read_alleles) > 0:
+            read_alleles = pd.concat(read_alleles, ignore_index=True)
+        else:
+            read_alleles = pd.DataFrame(columns=['start', 'end', 'hap_label', 'allele_id'], dtype=int)
+
+        allele_counts.append(remixt.analysis.haplotype.count_segment_alleles(read_alleles, chromosome, chrom_segments))
+
+    # Segment counts in the original segment order
+    segment_counts = pd.concat(segment_counts).sort_index()
+    segment_counts.to_csv(segment_counts_filename, sep='\t', index=False)
+
+    allele_counts = pd.concat(allele_counts, ignore_index=True)
+    allele_counts.to_csv(allele_counts_filename, sep='\t', index=False)
+
+    gc_positions.to_csv(gc_counts_filename, sep='\t', index=False, columns=['chromosome', 'position', 'read_count'])
+
+    return remixt.analysis.stats.calculate_fragment_stats_from_moments(*fragment_length_moments)
+
+
+def count_bam_region(region_counts_filename, bam_filename, het_snps_filename, segment_filename, gc_positions_filename, chromosome, config, start=None, end=None):
+    """ Count reads in segments and alleles of heterozygous snps directly from a bam
+
+    Args:
+        region_counts_filename (str): output pickle of counts for the region
+        bam_filename (str): bam from which to count reads
+        het_snps_filename (str): TSV chromosome, position, ref, alt file of heterozygous snps
+        segment_filename (str): input segments file
+        gc_positions_filename (str): positions sampled for gc bias estimation
+        chromosome (str): chromosome of the region
+        config (dict): relevant parameters
+
+    KwArgs:
+        start (int): start of the region, None for chromosome start
+        end (int): end of the region, None for chromosome end
+
+    Reads are counted as for `create_segment_counts` and `create_allele_counts`, without
+    creating seqdata.  The first heterozygous allele of each read contained in a segment
+    is counted, and the counts of fragments starting at each gc sampled position and
+    the moments of the fragment length distribution are accumulated for bias estimation.
+
+    """
+
+    segments = pd.read_csv(segment_filename, sep='\t', converters={'chromosome': str})
+    segments = segments[segments['chromosome'] == chromosome].sort_values('start')
+
+    gc_positions = pd.read_csv(gc_positions_filename, sep='\t', converters={'chromosome': str})
+    sample_positions = np.unique(gc_positions.loc[gc_positions['chromosome'] == chromosome, 'position'].values)
+
+    reader = remixt.bamreader.AlleleReader(
+        bam_filename,
+        het_snps_filename,
+        chromosome,
+        remixt.config.get_param(config, 'bam_max_fragment_length'),
+        remixt.config.get_param(config, 'bam_max_soft_clipped'),
+        remixt.config.get_param(config, 'bam_check_proper_pair'),
+        start=start,
+        end=end,
+        max_buffered_reads=remixt.config.get_param(config, 'bam_max_buffered_reads'),
+        snp_targeted=remixt.config.get_param(config, 'bam_snp_targeted'),
+        threads=min(remixt.config.get_param(config, 'bam_extract_threads'), remixt.seqdataio.max_extract_threads),
+        prefetch_alignments=remixt.config.get_param(config, 'bam_prefetch_alignments'),
+    )
+
+    reader.CountSegments(
+        segments['start'].values.tolist(),
+        segments['end'].values.tolist(),
+        sample_positions.tolist(),
+        remixt.config.get_param(config, 'filter_duplicates'),
+        remixt.config.get_param(config, 'map_qual_threshold'),
+    )
+
+    while reader.ReadAlignments(remixt.seqdataio.default_batch_alignments):
+        pass
+
+    remixt.seqdataio.check_discarded_reads(reader, remixt.config.get_param(config, 'bam_max_buffered_reads'))
+
+    segments['readcount'] = reader.GetSegmentReadCounts()
+
+    gc_counts = pd.DataFrame({'position': sample_positions, 'read_count': reader.GetSampleReadCounts()})
+    gc_counts['chromosome'] = chromosome
+
+    snp_counts = reader.GetSNPCounts()
+    snp_counts = snp_counts[(snp_counts['ref_count'] > 0) | (snp_counts['alt_count'] > 0)].copy()
+    snp_counts['chromosome'] = chromosome
+
+    region_counts = {
+        'segment_counts': segments[['chromosome', 'start', 'end', 'readcount']],
+        'snp_counts': snp_counts[['chromosome', 'position', 'ref_count', 'alt_count']],
+        'gc_counts': gc_counts[['chromosome', 'position', 'read_count']],
+        'fragment_length_moments': reader.GetFragmentLengthMoments(),
+    }
+
+    pd.to_pickle(region_counts, region_counts_filename)
+
+
+def merge_bam_region_counts(segment_counts_filename, allele_counts_filename, gc_counts_filename, region_counts_filenames, segment_filename, haps_filename):
+    """ Merge counts of regions of a bam into segment and allele count tables
+
+    Args:
+        segment_counts_filename (str): output segment counts, as for `segment_readcount`
+        allele_counts_filename (str): output allele counts, as for `haplotype_allele_readcount`
+        gc_counts_filename (str): output counts of fragments starting at gc sampled positions
+        region_counts_filenames (dict): region counts from `count_bam_region`
+        segment_filename (str): input segments file
+        haps_filename (str): input haplotype data file
+
+    Returns:
+        FragmentStats: fragment length mean and standard deviation
+
+    """
+
+    segment_counts = list()
+    snp_counts = list()
+    gc_counts = list()
+    fragment_length_moments = np.zeros(3)
+
+    for region_counts_filename in region_counts_filenames.values():
+        region_counts = pd.read_pickle(region_counts_filename)
+        segment_counts.append(region_counts['segment_counts'])
+        snp_counts.append(region_counts['snp_counts'])
+        gc_counts.append(region_counts['gc_counts'])
+        fragment_length_moments += np.array(region_counts['fragment_length_moments'], dtype=float)
+
+    # Sum counts of segments spanning multiple regions, in the original segment order
+    segments = pd.read_csv(segment_filename, sep='\t', converters={'chromosome': str})
+    segment_counts = pd.concat(segment_counts, ignore_index=True)
+    segment_counts = segment_counts.groupby(['chromosome', 'start', 'end'])['readcount'].sum()
+    segments['readcount'] = segment_counts.reindex(pd.MultiIndex.from_frame(segments[['chromosome', 'start', 'end']]), fill_value=0).values
+    segments.to_csv(segment_counts_filename, sep='\t', index=False)
+
+    # Allele counts for each haplotype block allele in each segment
+    snp_counts = pd.concat(snp_counts, ignore_index=True).groupby(['chromosome', 'position']).sum()
+    snp_counts.columns = [0, 1]
+    snp_counts = snp_counts.stack().rename('readcount').reset_index().rename(columns={'level_2': 'allele'})
+    snp_counts = snp_counts[snp_counts['readcount'] > 0]
+
+    haps = pd.read_csv(haps_filename, sep='\t', converters={'chromosome': str})
+    snp_counts = snp_counts.merge(haps, on=['chromosome', 'position', 'allele'])
+
+    allele_counts = list()
+    for chromosome, chrom_segments in segments.groupby('chromosome'):
+        chrom_segments = chrom_segments.sort_values('start').reset_index(drop=True)
+        chrom_snp_counts = snp_counts[snp_counts['chromosome'] == chromosome].copy()
+
+        # Snp positions are 1-based
+        chrom_snp_counts['segment_idx'] = remixt.segalg.find_contained_positions(
+            chrom_segments[['start', 'end']].values,
+            chrom_snp_counts['position'].values - 1,
+        )
+        chrom_snp_counts = chrom_snp_counts[chrom_snp_counts['segment_idx'] >= 0]
+        chrom_snp_counts = chrom_snp_counts.merge(chrom_segments[['start', 'end']], left_on='segment_idx', right_index=True)
+
+        allele_counts.append(
+            chrom_snp_counts
+            .groupby(['start', 'end', 'hap_label', 'allele_id'])['readcount']
+            .sum()
+            .reset_index()
+            .assign(chromosome=chromosome)
+        )
+
+    allele_counts = pd.concat(allele_counts, ignore_index=True)
+    allele_counts = allele_counts[['chromosome', 'start', 'end', 'hap_label', 'allele_id', 'readcount']]
+    allele_counts.to_csv(allele_counts_filename, sep='\t', index=False)
+
+    # Fragment start counts at gc sampled positions
+    gc_counts = pd.concat(gc_counts, ignore_index=True)
+    gc_counts = gc_counts.groupby(['chromosome', 'position'], sort=False)['read_count'].sum().reset_index()
+    gc_counts.to_csv(gc_counts_filename, sep='\t', index=False)
+
+    return remixt.analysis.stats.calculate_fragment_stats_from_moments(*fragment_length_moments)
 
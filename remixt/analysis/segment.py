@@ -1,3 +1,4 @@
+import concurrent.futures
 import pandas as pd
 import numpy as np
 
@@ -42,70 +43,280 @@ def create_segments(segment_filename, config, ref_data_dir, breakpoint_filename=
         names=gap_table_columns, converters={'chromosome': str})
     gap_table['chromosome'] = gap_table['chromosome'].apply(lambda a: a[3:])
 
-    changepoints = list()
-
-    # Add regular segments
-    for chromosome in chromosomes:
-        length = chromosome_lengths[chromosome]
-        for position in np.arange(0, length, segment_length, dtype=int):
-            changepoints.append((chromosome, position))
-        changepoints.append((chromosome, length))
-
-    # Add gap boundaries to changepoints
-    for idx in gap_table.index:
-        changepoints.append((gap_table.loc[idx, 'chromosome'], gap_table.loc[idx, 'start']))
-        changepoints.append((gap_table.loc[idx, 'chromosome'], gap_table.loc[idx, 'end']))
+    # Gap boundaries are changepoints
+    changepoints = [
+        gap_table[['chromosome', 'start']].rename(columns={'start': 'position'}),
+        gap_table[['chromosome', 'end']].rename(columns={'end': 'position'}),
+    ]
 
-    # Add breakends to segmentation if provided
+    # Add breakends to changepoints if provided
     if breakpoint_filename is not None:
         breakpoints = pd.read_csv(
             breakpoint_filename, sep='\t',
             converters={'chromosome_1': str, 'chromosome_2': str, 'position_1': int, 'position_2': int}
         )
 
-        for idx, row in breakpoints.iterrows():
-            changepoints.append((row['chromosome_1'], row['position_1']))
-            changepoints.append((row['chromosome_2'], row['position_2']))
+        for side in ('1', '2'):
+            changepoints.append(
+                breakpoints[['chromosome_' + side, 'position_' + side]]
+                .rename(columns={'chromosome_' + side: 'chromosome', 'position_' + side: 'position'}))
+
+    changepoints = pd.concat(changepoints, ignore_index=True)
+    changepoints = dict(list(changepoints.groupby('chromosome')['position']))
 
-    changepoints = pd.DataFrame(changepoints, columns=['chromosome', 'position'])
-    changepoints.sort_values(['chromosome', 'position'], inplace=True)
+    gaps = dict(list(gap_table.groupby('chromosome')))
 
-    # Create segments from changepoints
+    # Create segments from regular segmentation and changepoints, in chromosome list order
     segments = list()
-    for chromosome, chrom_changepoints in changepoints.groupby('chromosome'):
+    for chromosome in chromosomes:
+        length = chromosome_lengths[chromosome]
+
+        # Sorted unique changepoints, without 0 lengthed segments
+        positions = np.unique(np.concatenate([
+            np.arange(0, length, segment_length, dtype=int),
+            [length],
+            changepoints.get(chromosome, pd.Series([], dtype=int)).values,
+        ]))
+
         chrom_segments = pd.DataFrame({
-            'start': chrom_changepoints['position'].values[:-1],
-            'end': chrom_changepoints['position'].values[1:],
+            'chromosome': chromosome,
+            'start': positions[:-1],
+            'end': positions[1:],
         })
-        chrom_segments['chromosome'] = chromosome
+
+        # Remove gap segments, those starting within a gap
+        if chromosome in gaps:
+            chrom_gaps = remixt.segalg.union_intervals(gaps[chromosome][['start', 'end']].values)
+            gap_idx = remixt.segalg.find_contained_positions(chrom_gaps, chrom_segments['start'].values)
+            chrom_segments = chrom_segments[gap_idx < 0]
+
         segments.append(chrom_segments)
-    segments = pd.concat(segments, ignore_index=True)
 
-    # Remove gap segments
-    segments['gap'] = False
-    for idx in gap_table.index:
-        gap_chromosome = gap_table.loc[idx, 'chromosome']
-        gap_start = gap_table.loc[idx, 'start']
-        gap_end = gap_table.loc[idx, 'end']
-        segments.loc[
-            (segments['chromosome'] == gap_chromosome) &
-            (segments['start'] >= gap_start) &
-            (segments['start'] < gap_end),
-            'gap'
-        ] = True
-    segments = segments[~segments['gap']]
-
-    # Remove 0 lengthed segments
-    segments = segments[segments['start'] < segments['end']]
-
-    # Sort segments by placement in chromosome list, and position
-    segments = segments.merge(pd.DataFrame(list(enumerate(chromosomes)), columns=['chromosome_idx', 'chromosome']))
-    segments.sort_values(['chromosome_idx', 'start'], inplace=True)
+    segments = pd.concat(segments, ignore_index=True)
 
     segments.to_csv(segment_filename, sep='\t', index=False, columns=['chromosome', 'start', 'end'])
 
 
-def count_segment_reads(seqdata_filename, chromosome, segments, filter_duplicates=False, map_qual_threshold=1):
+def _add_bin_counts(counts, bins, weights=None):
+    """ Add counts of bin indices to an array of counts, extending the array as required
+    """
+
+    bin_counts = np.bincount(bins, weights=weights).astype(counts.dtype)
+
+    if len(bin_counts) > len(counts):
+        counts = np.concatenate([counts, np.zeros(len(bin_counts) - len(counts), dtype=counts.dtype)])
+
+    counts[:len(bin_counts)] += bin_counts
+
+    return counts
+
+
+def create_bin_counts(bin_counts_filename, seqdata_filename, bin_size=1000, filter_duplicates=False, map_qual_threshold=1, chunksize=1000000):
+    """ Create a cache of read counts in fine bins, from which reads in any segments can be counted
+
+    Args:
+        bin_counts_filename (str): output bin counts file
+        seqdata_filename (str): input sequence data file
+
+    KwArgs:
+        bin_size (int): length of bins
+        filter_duplicates (bool): filter reads marked as duplicate
+        map_qual_threshold (int): filter reads with less than this mapping quality
+        chunksize (int): number of reads to count at a time
+
+    For each chromosome, row i of the bin counts table has the number and summed length of
+    reads starting before bin i as prefix sums, the number of reads starting in and contained
+    in bin i, and the number of reads starting at the first position of bin i.
+
+    """
+
+    with pd.HDFStore(bin_counts_filename, 'w') as store:
+        max_fragment_lengths = dict()
+
+        for chromosome in remixt.seqdataio.read_chromosomes(seqdata_filename):
+            start_count = np.zeros(0, dtype=np.int64)
+            length_sum = np.zeros(0, dtype=np.int64)
+            contained_count = np.zeros(0, dtype=np.int64)
+            boundary_count = np.zeros(0, dtype=np.int64)
+            max_fragment_length = 0
+
+            reads_iter = remixt.seqdataio.read_fragment_data(
+                seqdata_filename, chromosome,
+                filter_duplicates=filter_duplicates,
+                map_qual_threshold=map_qual_threshold,
+                chunksize=chunksize,
+                columns=['start', 'end'],
+            )
+
+            for reads in reads_iter:
+                if len(reads.index) == 0:
+                    continue
+
+                starts = reads['start'].values
+                ends = reads['end'].values
+                bins = starts // bin_size
+
+                start_count = _add_bin_counts(start_count, bins)
+                length_sum = _add_bin_counts(length_sum, bins, weights=ends - starts)
+                contained_count = _add_bin_counts(contained_count, bins[ends <= (bins + 1) * bin_size])
+                boundary_count = _add_bin_counts(boundary_count, bins[starts == bins * bin_size])
+                max_fragment_length = max(max_fragment_length, int((ends - starts).max()))
+
+            num_bins = len(start_count)
+
+            bin_counts = pd.DataFrame({
+                'start_count_prefix': np.concatenate([[0], np.cumsum(start_count)]),
+                'length_sum_prefix': np.concatenate([[0], np.cumsum(length_sum)]),
+                'contained_count': np.concatenate([contained_count, np.zeros(num_bins + 1 - len(contained_count), dtype=np.int64)]),
+                'boundary_count': np.concatenate([boundary_count, np.zeros(num_bins + 1 - len(boundary_count), dtype=np.int64)]),
+            })
+
+            store.put('/bins/chromosome_' + chromosome, bin_counts)
+            max_fragment_lengths[chromosome] = max_fragment_length
+
+        store.put('max_fragment_length', pd.Series(max_fragment_lengths, dtype=np.int64))
+        attrs = store.get_storer('max_fragment_length').attrs
+        attrs.bin_size = bin_size
+        attrs.filter_duplicates = filter_duplicates
+        attrs.map_qual_threshold = map_qual_threshold
+
+
+# Maximum fraction of reads in blocks spanned by windows for which windows are read separately
+sparse_read_fraction = 0.25
+
+
+def _count_binned_segment_reads(bin_counts_filename, seqdata_filename, chromosome, segment_positions, filter_duplicates, map_qual_threshold, chunksize):
+    """ Count reads contained in sorted segments from cached bin counts
+
+    Reads in the bins spanned by a segment are counted using the cached bin counts.  Reads
+    starting in partial bins at the ends of the segment, and reads of the last full bin
+    extending past it, are read from the seqdata to correct the counts exactly.  Segments
+    spanning no full bin are counted from the seqdata.
+
+    Reads are streamed from the seqdata in a single pass, unless the seqdata has a block
+    index and the windows to count from the seqdata span few of its blocks.
+
+    """
+
+    with pd.HDFStore(bin_counts_filename, 'r') as store:
+        attrs = store.get_storer('max_fragment_length').attrs
+        if attrs.filter_duplicates != filter_duplicates or attrs.map_qual_threshold != map_qual_threshold:
+            raise ValueError('bin counts filtering does not match requested filtering')
+
+        bin_size = attrs.bin_size
+        max_fragment_length = store['max_fragment_length'].get(chromosome, 0)
+
+        key = '/bins/chromosome_' + chromosome
+        if key in store:
+            bin_counts = store[key]
+        else:
+            bin_counts = pd.DataFrame({'start_count_prefix': [0], 'contained_count': [0], 'boundary_count': [0]})
+
+    readcount = np.zeros(segment_positions.shape[0], dtype=int)
+
+    if segment_positions.shape[0] == 0:
+        return readcount
+
+    starts = segment_positions[:, 0]
+    ends = segment_positions[:, 1]
+
+    # Extend the bin counts to the end of the last segment
+    num_bins = max(len(bin_counts.index), ends.max() // bin_size + 1)
+    start_count_prefix = bin_counts['start_count_prefix'].reindex(range(num_bins)).ffill().values.astype(int)
+    contained_count = bin_counts['contained_count'].reindex(range(num_bins), fill_value=0).values
+    boundary_count = bin_counts['boundary_count'].reindex(range(num_bins), fill_value=0).values
+
+    # Full bins spanned by each segment, bin counts can be used if all reads starting in a
+    # bin end within the next bin
+    first_bin = -(-starts // bin_size)
+    last_bin = ends // bin_size
+    use_bins = (last_bin > first_bin) & (max_fragment_length <= bin_size)
+
+    # Reads starting at the start of a segment adjacent to the previous segment are not
+    # counted, consistent with `remixt.segalg.contained_counts`
+    previous_adjacent = np.concatenate([[False], ends[:-1] == starts[1:]])
+    exclude_boundary = (starts == first_bin * bin_size) & previous_adjacent
+
+    fb = first_bin[use_bins]
+    lb = last_bin[use_bins]
+    readcount[use_bins] = (
+        start_count_prefix[lb - 1] - start_count_prefix[fb] +
+        contained_count[lb - 1] -
+        boundary_count[fb] * exclude_boundary[use_bins]
+    )
+
+    # Windows of read starts to count from seqdata, with a minimum read end to select
+    # reads of the last full bin not counted using bin counts
+    first_partial = use_bins & (starts < first_bin * bin_size)
+    last_partial = use_bins & (last_bin * bin_size < ends)
+    windows = np.concatenate([
+        np.array([starts[~use_bins], ends[~use_bins], -np.ones((~use_bins).sum(), dtype=int)]).T,
+        np.array([starts[first_partial], first_bin[first_partial] * bin_size, -np.ones(first_partial.sum(), dtype=int)]).T,
+        np.array([(last_bin[last_partial] - 1) * bin_size, last_bin[last_partial] * bin_size, last_bin[last_partial] * bin_size]).T,
+        np.array([last_bin[last_partial] * bin_size, ends[last_partial], -np.ones(last_partial.sum(), dtype=int)]).T,
+    ])
+
+    if len(windows) == 0:
+        return readcount
+
+    windows = windows[np.argsort(windows[:, 0])]
+
+    # Windows are disjoint, nearby windows are grouped into ranges
+    range_breaks = np.where(windows[1:, 0] - windows[:-1, 1] > bin_size)[0] + 1
+    range_starts = np.concatenate([[0], range_breaks])
+    range_ends = np.concatenate([range_breaks, [len(windows)]])
+
+    # Ranges are read separately only if the block index of the seqdata restricts reading
+    # to a small fraction of the reads, otherwise reads are streamed in a single pass
+    block_rows = remixt.seqdataio.count_fragment_block_rows(
+        seqdata_filename, chromosome,
+        np.array([windows[range_starts, 0], windows[range_ends - 1, 1]]).T)
+
+    if block_rows is not None and block_rows[0] < sparse_read_fraction * block_rows[1]:
+        reads_iter = (
+            remixt.seqdataio.read_fragment_data(
+                seqdata_filename, chromosome,
+                filter_duplicates=filter_duplicates,
+                map_qual_threshold=map_qual_threshold,
+                start=windows[range_start, 0],
+                end=windows[range_end - 1, 1],
+                columns=['start', 'end'],
+            ) for range_start, range_end in zip(range_starts, range_ends))
+
+    else:
+        reads_iter = remixt.seqdataio.read_fragment_data(
+            seqdata_filename, chromosome,
+            filter_duplicates=filter_duplicates,
+            map_qual_threshold=map_qual_threshold,
+            chunksize=chunksize,
+            start=windows[0, 0],
+            end=windows[-1, 1],
+            columns=['start', 'end'],
+        )
+
+    for reads in reads_iter:
+        starts = reads['start'].values
+        ends = reads['end'].values
+
+        # Select reads starting in a window and ending after its minimum read end
+        window_idx = np.searchsorted(windows[:, 0], starts, side='right') - 1
+        in_window = window_idx >= 0
+        window_idx = np.maximum(window_idx, 0)
+        selected = (
+            in_window &
+            (starts < windows[window_idx, 1]) &
+            (ends > windows[window_idx, 2])
+        )
+
+        readcount += remixt.segalg.contained_counts(
+            segment_positions,
+            np.array([starts[selected], ends[selected]]).T,
+        )
+
+    return readcount
+
+
+def count_segment_reads(seqdata_filename, chromosome, segments, filter_duplicates=False, map_qual_threshold=1, chunksize=1000000, bin_counts_filename=None):
     """ Count reads falling entirely within segments on a specific chromosome
 
     Args:
@@ -116,6 +327,8 @@ def count_segment_reads(seqdata_filename, chromosome, segments, filter_duplicate
     KwArgs:
         filter_duplicates (bool): filter reads marked as duplicate
         map_qual_threshold (int): filter reads with less than this mapping quality
+        chunksize (int): number of reads to count at a time
+        bin_counts_filename (str): bin counts from `create_bin_counts`, None to count all reads
 
     Returns:
         pandas.DataFrame: output segment data
@@ -125,32 +338,68 @@ def count_segment_reads(seqdata_filename, chromosome, segments, filter_duplicate
     The output segment counts will be in TSV format with an additional 'readcount' column
     for the number of counts per segment.
 
+    Reads are streamed from the seqdata in chunks and counts are accumulated per chunk,
+    thus memory usage is independent of the number of reads on the chromosome.  If bin
+    counts are provided, only reads at the ends of segments are counted from the seqdata.
+
+    """
+
+    # Sort segments in preparation for search, reads need not be sorted
+    segments.sort_values('start', inplace=True)
+
+    segments['readcount'] = _count_sorted_segment_reads(
+        seqdata_filename, chromosome, segments[['start', 'end']].values,
+        filter_duplicates, map_qual_threshold, chunksize, bin_counts_filename)
+
+    # Sort on index to return dataframe in original order
+    segments.sort_index(inplace=True)
+
+    return segments
+
+
+def _count_sorted_segment_reads(seqdata_filename, chromosome, segment_positions, filter_duplicates, map_qual_threshold, chunksize, bin_counts_filename):
+    """ Count reads contained in segments sorted by start, see `count_segment_reads`
     """
 
+    if bin_counts_filename is not None:
+        return _count_binned_segment_reads(
+            bin_counts_filename, seqdata_filename, chromosome, segment_positions,
+            filter_duplicates, map_qual_threshold, chunksize)
+
     # Read fragment data with filtering
-    reads = remixt.seqdataio.read_fragment_data(
+    reads_iter = remixt.seqdataio.read_fragment_data(
         seqdata_filename, chromosome,
         filter_duplicates=filter_duplicates,
         map_qual_threshold=map_qual_threshold,
+        chunksize=chunksize,
+        columns=['start', 'end'],
     )
 
-    # Sort in preparation for search
-    reads.sort_values('start', inplace=True)
-    segments.sort_values('start', inplace=True)
-    
     # Count segment reads
-    segments['readcount'] = remixt.segalg.contained_counts(
-        segments[['start', 'end']].values,
-        reads[['start', 'end']].values
-    )
+    readcount = np.zeros(segment_positions.shape[0], dtype=int)
+    for reads in reads_iter:
+        readcount += remixt.segalg.contained_counts(
+            segment_positions,
+            reads[['start', 'end']].values,
+        )
 
-    # Sort on index to return dataframe in original order
-    segments.sort_index(inplace=True)
+    return readcount
 
-    return segments
 
+def _count_sample_segment_reads(seqdata_filename, chromosome_segment_positions, filter_duplicates, map_qual_threshold, chunksize, bin_counts_filename):
+    """ Count reads contained in sorted segments of each chromosome for one sample
+    """
 
-def create_segment_counts(segments, seqdata_filename, filter_duplicates=False, map_qual_threshold=1):
+    readcounts = list()
+    for chromosome, segment_positions in chromosome_segment_positions:
+        readcounts.append(_count_sorted_segment_reads(
+            seqdata_filename, chromosome, segment_positions,
+            filter_duplicates, map_qual_threshold, chunksize, bin_counts_filename))
+
+    return np.concatenate(readcounts)
+
+
+def create_segment_counts(segments, seqdata_filename, filter_duplicates=False, map_qual_threshold=1, bin_counts_filename=None):
     """ Create a table of read counts for segments
 
     Args:
@@ -160,6 +409,7 @@ def create_segment_counts(segments, seqdata_filename, filter_duplicates=False, m
     KwArgs:
         filter_duplicates (bool): filter reads marked as duplicate
         map_qual_threshold (int): filter reads with less than this mapping quality
+        bin_counts_filename (str): bin counts from `create_bin_counts`, None to count all reads
 
     Returns:
         pandas.DataFrame: output segment data
@@ -180,7 +430,8 @@ def create_segment_counts(segments, seqdata_filename, filter_duplicates=False, m
         counts.append(count_segment_reads(
             seqdata_filename, chrom, segs.copy(),
             filter_duplicates=filter_duplicates,
-            map_qual_threshold=map_qual_threshold))
+            map_qual_threshold=map_qual_threshold,
+            bin_counts_filename=bin_counts_filename))
     counts = pd.concat(counts)
 
     # Sort on index to return dataframe in original order
@@ -189,6 +440,58 @@ def create_segment_counts(segments, seqdata_filename, filter_duplicates=False, m
     return counts
 
 
+def create_multiple_segment_counts(segments, seqdata_filenames, filter_duplicates=False, map_qual_threshold=1, bin_counts_filenames=None, processes=1, chunksize=1000000):
+    """ Create tables of read counts for segments for multiple samples
+
+    Args:
+        segments (pandas.DataFrame): input segment data
+        seqdata_filenames (dict): input sequence data files keyed by sample
+
+    KwArgs:
+        filter_duplicates (bool): filter reads marked as duplicate
+        map_qual_threshold (int): filter reads with less than this mapping quality
+        bin_counts_filenames (dict): bin counts from `create_bin_counts` keyed by sample, None to count all reads
+        processes (int): number of samples to count in parallel worker processes
+        chunksize (int): number of reads to count at a time
+
+    Returns:
+        dict: output segment data keyed by sample, as for `create_segment_counts`
+
+    Input segments should have columns 'chromosome', 'start', 'end'.
+
+    Segments are sorted once and the sorted segment positions of each chromosome
+    are shared by the workers counting each sample.
+
+    """
+
+    segments = segments.sort_values(['chromosome', 'start'])
+
+    chromosome_segment_positions = list()
+    for chrom, segs in segments.groupby('chromosome', sort=False):
+        chromosome_segment_positions.append((chrom, segs[['start', 'end']].values))
+
+    if bin_counts_filenames is None:
+        bin_counts_filenames = dict([(sample_id, None) for sample_id in seqdata_filenames.keys()])
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=processes) as executor:
+        readcount_futures = dict()
+        for sample_id, seqdata_filename in seqdata_filenames.items():
+            readcount_futures[sample_id] = executor.submit(
+                _count_sample_segment_reads,
+                seqdata_filename, chromosome_segment_positions,
+                filter_duplicates, map_qual_threshold, chunksize,
+                bin_counts_filenames[sample_id])
+
+        counts = dict()
+        for sample_id, readcount_future in readcount_futures.items():
+            counts[sample_id] = segments.assign(readcount=readcount_future.result())
+
+            # Sort on index to return dataframe in original order
+            counts[sample_id].sort_index(inplace=True)
+
+    return counts
+
+
 def create_segment_allele_counts(segment_data, allele_data):
     """ Create a table of total and allele specific segment counts
 
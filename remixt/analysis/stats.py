@@ -23,11 +23,24 @@ def calculate_fragment_stats(seqdata_filename, config):
     chromosomes = remixt.seqdataio.read_chromosomes(seqdata_filename)
 
     for chrom in chromosomes:
+        # Use moments recorded when the seqdata was written if available
+        moments = remixt.seqdataio.read_fragment_length_moments(
+            seqdata_filename, chrom,
+            filter_duplicates=filter_duplicates,
+            map_qual_threshold=map_qual_threshold)
+
+        if moments is not None:
+            n += moments[0]
+            sum_x += moments[1]
+            sum_x2 += moments[2]
+            continue
+
         reads_iter = remixt.seqdataio.read_fragment_data(
             seqdata_filename, chrom,
             filter_duplicates=filter_duplicates,
             map_qual_threshold=map_qual_threshold,
-            chunksize=1000000)
+            chunksize=1000000,
+            columns=['start', 'end'])
 
         for chrom_reads in reads_iter:
             length = chrom_reads['end'].values - chrom_reads['start'].values
@@ -36,8 +49,29 @@ def calculate_fragment_stats(seqdata_filename, config):
             sum_x2 += (length * length).sum()
             n += length.shape[0]
 
-    mean = sum_x / n
-    stdev = np.sqrt((sum_x2 / n) - (mean * mean))
+    return calculate_fragment_stats_from_moments(n, sum_x, sum_x2)
+
+
+def calculate_fragment_stats_from_moments(n, sum_x, sum_x2):
+    """ Calculate fragment length mean and standard deviation from moments.
+
+    Args:
+        n (float): number of fragments
+        sum_x (float): sum of fragment lengths
+        sum_x2 (float): sum of squared fragment lengths
+
+    Returns:
+        FragmentStats: fragment length mean and standard deviation
+
+    Raises a ValueError if there are no fragments.
+
+    """
+
+    if n == 0:
+        raise ValueError('no fragments from which to calculate fragment length statistics')
+
+    mean = float(sum_x) / n
+    stdev = np.sqrt(max(float(sum_x2) / n - mean * mean, 0.))
 
     return FragmentStats(mean, stdev)
 
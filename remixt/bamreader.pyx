@@ -11,26 +11,50 @@ from libcpp cimport bool
 from libcpp.vector cimport vector
 
 cdef extern from "BamAlleleReader.h":
-    cdef cppclass FragmentData:
-        int fragmentID
-        int fragmentStart
-        int fragmentEnd
-        int mappingQuality
-        int isDuplicate
-    cdef cppclass AlleleData:
-        int fragmentID
-        int position
-        int isAlt
+    cdef cppclass FragmentTable:
+        vector[int] fragmentID
+        vector[int] fragmentStart
+        vector[int] fragmentEnd
+        vector[int] mappingQuality
+        vector[int] isDuplicate
+    cdef cppclass AlleleTable:
+        vector[int] fragmentID
+        vector[int] position
+        vector[int] isAlt
+    cdef cppclass SegmentCounts:
+        vector[int] readCount
+        vector[int] sampleReadCount
+        vector[int] snpPosition
+        vector[int] snpRefCount
+        vector[int] snpAltCount
+        long long fragmentCount
+        long long fragmentLengthSum
+        long long fragmentLengthSumSquares
     cdef cppclass CAlleleReader "AlleleReader":
         void CAlleleReader(string bamFilename,
             string snpFilename,
             string chromosome,
             int maxFragmentLength,
             int maxSoftClipped,
-            bool checkProperPair) except +
-        bool ReadAlignments(int maxAlignments) except +
-        vector[FragmentData] mFragmentData
-        vector[AlleleData] mAlleleData
+            bool checkProperPair,
+            int regionStart,
+            int regionEnd,
+            int maxBufferedReads,
+            bool snpTargeted,
+            int threads,
+            int prefetchAlignments) except +
+        void CountSegments(vector[int] segmentStarts,
+            vector[int] segmentEnds,
+            vector[int] samplePositions,
+            bool filterDuplicates,
+            int mapQualThreshold) except +
+        bool ReadAlignments(int maxAlignments) nogil except +
+        string GetChromosome()
+        size_t GetTableMemory()
+        size_t GetNumDiscardedReads()
+        FragmentTable mFragmentData
+        AlleleTable mAlleleData
+        SegmentCounts mSegmentCounts
 
 def create_fragment_table(nrows):
     return pd.DataFrame(
@@ -58,38 +82,112 @@ def create_allele_table(nrows):
         ],
     )
 
+cdef class _IntVector:
+    """ Owner of a C++ int vector exposed through the buffer protocol """
+    cdef vector[int] data
+    cdef Py_ssize_t shape[1]
+    cdef Py_ssize_t strides[1]
+    def __getbuffer__(self, Py_buffer *buffer, int flags):
+        self.shape[0] = self.data.size()
+        self.strides[0] = sizeof(int)
+        buffer.buf = <char *>self.data.data()
+        buffer.format = 'i'
+        buffer.internal = NULL
+        buffer.itemsize = sizeof(int)
+        buffer.len = self.shape[0] * sizeof(int)
+        buffer.ndim = 1
+        buffer.obj = self
+        buffer.readonly = 0
+        buffer.shape = self.shape
+        buffer.strides = self.strides
+        buffer.suboffsets = NULL
+    def __releasebuffer__(self, Py_buffer *buffer):
+        pass
+
+cdef _take_int_array(vector[int]& values):
+    """ Take ownership of the contents of a C++ vector as a numpy array without copying """
+    cdef _IntVector owner = _IntVector()
+    owner.data.swap(values)
+    return np.asarray(owner)
+
 cdef class AlleleReader:
     cdef CAlleleReader *thisptr
-    def __cinit__(self, bam_filename, snp_filename, chromosome, max_fragment_length, max_soft_clipped, check_proper_pair):
-        self.thisptr = new CAlleleReader(bam_filename, snp_filename, chromosome, max_fragment_length, max_soft_clipped, check_proper_pair)
+    def __cinit__(self, bam_filename, snp_filename, chromosome, max_fragment_length, max_soft_clipped, check_proper_pair, start=None, end=None, max_buffered_reads=1000000, snp_targeted=True, threads=1, prefetch_alignments=40000):
+        if start is None:
+            start = 0
+        if end is None:
+            end = -1
+        if chromosome is None:
+            chromosome = ''
+        self.thisptr = new CAlleleReader(bam_filename, snp_filename, chromosome, max_fragment_length, max_soft_clipped, check_proper_pair, start, end, max_buffered_reads, snp_targeted, threads, prefetch_alignments)
     def __dealloc__(self):
         del self.thisptr
-    def ReadAlignments(self, max_alignments):
-        return self.thisptr.ReadAlignments(max_alignments)
+    def ReadAlignments(self, int max_alignments):
+        cdef bool result
+        with nogil:
+            result = self.thisptr.ReadAlignments(max_alignments)
+        return result
+    def GetChromosome(self):
+        return self.thisptr.GetChromosome()
+    def GetTableMemory(self):
+        return self.thisptr.GetTableMemory()
+    def GetNumDiscardedReads(self):
+        return self.thisptr.GetNumDiscardedReads()
     def GetFragmentTable(self):
-        data = create_fragment_table(self.thisptr.mFragmentData.size())
-        cdef np.ndarray fragmentID = data['fragment_id'].values
-        cdef np.ndarray fragmentStart = data['start'].values
-        cdef np.ndarray fragmentEnd = data['end'].values
-        cdef np.ndarray mappingQuality = data['mapping_quality'].values
-        cdef np.ndarray isDuplicate = data['is_duplicate'].values
-        cdef int idx
-        for idx in range(self.thisptr.mFragmentData.size()):
-            fragmentID[idx] = self.thisptr.mFragmentData[idx].fragmentID
-            fragmentStart[idx] = self.thisptr.mFragmentData[idx].fragmentStart
-            fragmentEnd[idx] = self.thisptr.mFragmentData[idx].fragmentEnd
-            mappingQuality[idx] = self.thisptr.mFragmentData[idx].mappingQuality
-            isDuplicate[idx] = self.thisptr.mFragmentData[idx].isDuplicate
-        return data
+        return pd.DataFrame(
+            {
+                'fragment_id': _take_int_array(self.thisptr.mFragmentData.fragmentID),
+                'start': _take_int_array(self.thisptr.mFragmentData.fragmentStart),
+                'end': _take_int_array(self.thisptr.mFragmentData.fragmentEnd),
+                'mapping_quality': _take_int_array(self.thisptr.mFragmentData.mappingQuality),
+                'is_duplicate': _take_int_array(self.thisptr.mFragmentData.isDuplicate),
+            },
+            columns=[
+                'fragment_id',
+                'start',
+                'end',
+                'mapping_quality',
+                'is_duplicate',
+            ],
+            copy=False,
+        )
     def GetAlleleTable(self):
-        data = create_allele_table(self.thisptr.mAlleleData.size())
-        cdef np.ndarray fragmentID = data['fragment_id'].values
-        cdef np.ndarray position = data['position'].values
-        cdef np.ndarray isAlt = data['is_alt'].values
-        cdef int idx
-        for idx in range(self.thisptr.mAlleleData.size()):
-            fragmentID[idx] = self.thisptr.mAlleleData[idx].fragmentID
-            position[idx] = self.thisptr.mAlleleData[idx].position
-            isAlt[idx] = self.thisptr.mAlleleData[idx].isAlt
-        return data
-
+        return pd.DataFrame(
+            {
+                'fragment_id': _take_int_array(self.thisptr.mAlleleData.fragmentID),
+                'position': _take_int_array(self.thisptr.mAlleleData.position),
+                'is_alt': _take_int_array(self.thisptr.mAlleleData.isAlt),
+            },
+            columns=[
+                'fragment_id',
+                'position',
+                'is_alt',
+            ],
+            copy=False,
+        )
+    def CountSegments(self, segment_starts, segment_ends, sample_positions, filter_duplicates, map_qual_threshold):
+        self.thisptr.CountSegments(segment_starts, segment_ends, sample_positions, filter_duplicates, map_qual_threshold)
+    def GetSegmentReadCounts(self):
+        return _take_int_array(self.thisptr.mSegmentCounts.readCount)
+    def GetSampleReadCounts(self):
+        return _take_int_array(self.thisptr.mSegmentCounts.sampleReadCount)
+    def GetSNPCounts(self):
+        return pd.DataFrame(
+            {
+                'position': _take_int_array(self.thisptr.mSegmentCounts.snpPosition),
+                'ref_count': _take_int_array(self.thisptr.mSegmentCounts.snpRefCount),
+                'alt_count': _take_int_array(self.thisptr.mSegmentCounts.snpAltCount),
+            },
+            columns=[
+                'position',
+                'ref_count',
+                'alt_count',
+            ],
+            copy=False,
+        )
+    def GetFragmentLengthMoments(self):
+        return (
+            self.thisptr.mSegmentCounts.fragmentCount,
+            self.thisptr.mSegmentCounts.fragmentLengthSum,
+            self.thisptr.mSegmentCounts.fragmentLengthSumSquares,
+        )
@@ -49,6 +49,17 @@ map_qual_threshold                          = 1
 # Filter reads marked as duplicate
 filter_duplicates                           = False
 
+# Bin size of cached read counts from which reads in segments are counted
+segment_count_bin_size                      = 1000
+
+# Worker processes counting reads in segments for multiple samples
+segment_count_processes                     = 4
+
+# Count reads in segments, alleles and gc sampled positions in a single pass of
+# each tumour seqdata file, by default seqdata is read separately for each, with
+# segment counts calculated from bin counts that are reused if segments change
+seqdata_fused_counts                        = False
+
 # Locally installed mappability filename produced by mappability setup script
 mappability_template                        = '{ref_data_dir}/{ucsc_genome_version}.{mappability_length}.bwa.mappability.h5'
 
@@ -64,6 +75,9 @@ phased_chromosome_x                         = 'X_nonPAR'
 # Locally installed snps from thousand genomes
 snp_positions_template                      = '{ref_data_dir}/thousand_genomes_snps.tsv'
 
+# Per chromosome binary index of snps from thousand genomes, for fast loading by the bam reader
+snp_positions_index_template                = '{ref_data_dir}/thousand_genomes_snps.chr{chromosome}.bin'
+
 ###
 # Algorithm parameters
 ###
@@ -81,6 +95,45 @@ bam_max_soft_clipped                        = 8
 # disable for irregular fragment length distribution
 bam_check_proper_pair                       = True
 
+# Length of regions extracted in parallel from each bam chromosome,
+# set to None to extract whole chromosomes
+bam_extract_region_size                     = int(2e7)
+
+# Maximum reads awaiting their mate held in memory during bam extraction,
+# extraction fails if the mate of a read is further away than this many reads
+bam_max_buffered_reads                      = int(1e6)
+
+# Extract alleles by walking the alignment of each read over known snps,
+# disable to extract alleles from a pileup over all reference positions
+bam_snp_targeted                            = True
+
+# Extract all chromosomes in a single sequential pass over the bam rather
+# than seeking to each region, suited to bams on slow or remote storage
+bam_extract_single_pass                     = False
+
+# Threads for each bam extraction job, with more than one thread decompression
+# of the bam runs on a separate thread from pairing and allele extraction, at
+# most 2 threads are used
+bam_extract_threads                         = 2
+
+# Alignments decoded ahead by the decompression thread, approximately 1KB each
+bam_prefetch_alignments                     = 40000
+
+# Memory budget in GB for batches of fragment and allele data and prefetched
+# alignments held in memory by each bam extraction job, batch sizes adapt to
+# the depth of the bam
+bam_extract_max_memory                      = 2
+
+# Compression of seqdata files, any pytables compression library, blosc
+# codecs are considerably faster to write and read than zlib
+seqdata_complib                             = 'blosc:lz4'
+seqdata_complevel                           = 5
+
+# Merge seqdata of regions extracted in parallel by reference rather than
+# copying, region seqdata files are then kept alongside the merged seqdata
+# file, which is only valid together with them
+seqdata_link_regions                        = False
+
 # Heterozygous snp calling
 sequencing_base_call_error                  = 0.01
 het_snp_call_threshold                      = 0.9
@@ -1,11 +1,49 @@
 import os
 import gzip
+import numpy as np
+import pandas as pd
 import pypeliner.commandline
 
 import remixt.config
 import remixt.utils
 
 
+snp_index_dtype = np.dtype([
+    ('position', '<i4'),
+    ('ref', 'S1'),
+    ('alt', 'S1'),
+])
+
+
+def write_snp_positions_index(snp_positions_filename, snp_index_template, chromosomes):
+    """ Write a per chromosome binary index of snp positions.
+
+    Args:
+        snp_positions_filename (str): TSV chromosome, position, ref, alt file listing SNPs
+        snp_index_template (str): template for index filenames with a 'chromosome' field
+        chromosomes (list): chromosomes for which to write an index
+
+    Each index is a packed array of position (int32 little endian), ref and alt (char)
+    sorted by position, as read by the bam reader.
+
+    """
+
+    snps = pd.read_csv(
+        snp_positions_filename, sep='\t', header=None,
+        names=['chromosome', 'position', 'ref', 'alt'],
+        converters={'chromosome': str})
+
+    for chromosome in chromosomes:
+        chrom_snps = snps[snps['chromosome'] == chromosome].sort_values('position')
+
+        snp_index = np.zeros(len(chrom_snps.index), dtype=snp_index_dtype)
+        snp_index['position'] = chrom_snps['position'].values
+        snp_index['ref'] = chrom_snps['ref'].values.astype('S1')
+        snp_index['alt'] = chrom_snps['alt'].values.astype('S1')
+
+        snp_index.tofile(snp_index_template.format(chromosome=chromosome))
+
+
 def create_ref_data(config, ref_data_dir, ref_data_sentinal, bwa_index_genome=False):
     try:
         os.makedirs(ref_data_dir)
@@ -76,6 +114,13 @@ def create_ref_data(config, ref_data_dir, ref_data_sentinal, bwa_index_genome=Fa
                         snp_positions_file.write('\t'.join([chromosome, position, a0, a1]) + '\n')
     auto_sentinal.run(create_snp_positions)
 
+    def create_snp_positions_index():
+        write_snp_positions_index(
+            remixt.config.get_filename(config, ref_data_dir, 'snp_positions'),
+            remixt.config.get_filename(config, ref_data_dir, 'snp_positions_index', chromosome='{chromosome}'),
+            remixt.config.get_chromosomes(config, ref_data_dir))
+    auto_sentinal.run(create_snp_positions_index)
+
     with open(ref_data_sentinal, 'w'):
         pass
 
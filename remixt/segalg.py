@@ -193,6 +193,57 @@ def find_contained_segments(X, Y):
     return idx
 
 
+def union_intervals_unopt(X):
+    """ Merge overlapping intervals into non-overlapping intervals (unopt)
+
+    Args:
+        X (numpy.array): start and end of possibly overlapping intervals with shape (N,2) for N intervals
+
+    Returns:
+        numpy.array: start and end of non-overlapping intervals with shape (M,2) for M intervals
+
+    """
+
+    U = []
+    for x in sorted(X.tolist()):
+        if len(U) > 0 and x[0] <= U[-1][1]:
+            U[-1][1] = max(U[-1][1], x[1])
+        else:
+            U.append(list(x))
+    return np.array(U, dtype=X.dtype).reshape((len(U), 2))
+
+
+def union_intervals(X):
+    """ Merge overlapping intervals into non-overlapping intervals
+
+    Args:
+        X (numpy.array): start and end of possibly overlapping intervals with shape (N,2) for N intervals
+
+    Returns:
+        numpy.array: start and end of non-overlapping intervals with shape (M,2) for M intervals
+
+    Overlapping and adjacent intervals are merged, and the returned intervals are ordered
+    by start position.
+
+    """
+
+    if X.shape[0] == 0:
+        return X.reshape((0, 2))
+
+    X = X[np.argsort(X[:, 0])]
+
+    # Greatest end of all previous intervals
+    max_end = np.maximum.accumulate(X[:, 1])
+
+    # Start new interval if start is beyond the end of all previous intervals
+    new_idx = np.where(np.concatenate([[True], X[1:, 0] > max_end[:-1]]))[0]
+
+    starts = X[new_idx, 0]
+    ends = np.maximum.reduceat(X[:, 1], new_idx)
+
+    return np.array([starts, ends]).T
+
+
 def vrange(starts, lengths):
     """ Create concatenated ranges of integers for multiple start/length
 
@@ -1,5 +1,11 @@
+import collections
+import concurrent.futures
+import functools
+import itertools
+import logging
 import numpy as np
 import pandas as pd
+import tables
 
 import remixt.bamreader
 
@@ -16,58 +22,345 @@ def _get_key(record_type, chromosome):
     return '/{}/chromosome_{}'.format(record_type, chromosome)
 
 
-def _unique_index_append(store, key, data):
-    try:
-        nrows = store.get_storer(key).nrows
-    except (AttributeError, KeyError):
-        nrows = 0
-    data.index = pd.Series(data.index) + nrows
-    if nrows == 0:
-        store.put(key, data, format='table')
-    else:
-        store.append(key, data)
+def _get_empty_data(record_type, columns=None):
+    if columns is None:
+        columns = list(empty_data[record_type].columns)
+    return empty_data[record_type][columns].copy()
+
+
+# Format attribute of columnar seqdata files, files without the attribute are
+# pandas hdf stores written by earlier versions
+columnar_format = 'columnar'
+
+# Format attribute of seqdata files listing the files containing the data of
+# each chromosome, as created by `link_seqdata`
+manifest_format = 'manifest'
+
+# Rows per block of each column, fragment starts are stored as the difference
+# from the previous start, with the absolute start of each block stored separately
+block_size = 65536
 
+# Bits of the fragment flags column
+is_duplicate_flag = 1
 
-def merge_overlapping_seqdata(outfile, infiles, chromosomes):
-    out_store = pd.HDFStore(outfile, 'w', complevel=9, complib='blosc')
+max_fragment_length = np.iinfo(np.uint16).max
+
+# Default compression of seqdata columns, blosc with byte shuffling
+default_complib = 'blosc:lz4'
+default_complevel = 5
+
+fragment_columns = [
+    ('fragment_id', np.int32),
+    ('start_delta', np.int32),
+    ('length', np.uint16),
+    ('mapping_quality', np.uint8),
+    ('flags', np.uint8),
+]
+
+allele_columns = [
+    ('fragment_id', np.int32),
+    ('position', np.int32),
+    ('is_alt', np.uint8),
+]
+
+snp_count_columns = [
+    ('position', np.int32),
+    ('ref_count', np.int32),
+    ('alt_count', np.int32),
+]
+
+
+def _encode_starts(starts, row_offset, previous_start):
+    """ Delta encode fragment starts.
+
+    Args:
+        starts (numpy.array): fragment starts
+        row_offset (int): row of the first start in the column
+        previous_start (int): start preceding the first start in the column
+
+    Returns:
+        tuple: start deltas, absolute start of blocks beginning within starts
+
+    """
+
+    starts = starts.astype(np.int64)
+    deltas = np.diff(starts, prepend=previous_start)
+
+    block_rows = np.flatnonzero((np.arange(row_offset, row_offset + len(starts)) % block_size) == 0)
+    deltas[block_rows] = 0
+
+    return deltas.astype(np.int32), starts[block_rows].astype(np.int32)
+
+
+def _decode_starts(deltas, block_starts):
+    """ Decode delta encoded fragment starts.
+
+    Args:
+        deltas (numpy.array): start deltas beginning at a block boundary
+        block_starts (numpy.array): absolute start of each block of deltas
+
+    Returns:
+        numpy.array: fragment starts
+
+    """
 
-    index_offsets = pd.Series(0, index=chromosomes, dtype=np.int64)
+    block_rows = np.arange(0, len(deltas), block_size)
+    block_lengths = np.diff(np.append(block_rows, len(deltas)))
 
-    for _id, infile in infiles.items():
-        store = pd.HDFStore(infile)
-        tables = store.keys()
+    starts = np.cumsum(deltas, dtype=np.int64)
+    starts += np.repeat(block_starts.astype(np.int64) - starts[block_rows], block_lengths)
 
+    return starts.astype(np.int32)
+
+
+def _merge_sorted_chunks(chunk_iters, key):
+    """ Streaming k-way merge of chunks of data ordered by a key column.
+
+    Args:
+        chunk_iters (list): iterators of pandas.DataFrame chunks
+        key (str): column by which chunks are ordered
+
+    Yields:
+        pandas.DataFrame: merged chunks ordered by key
+
+    Rows of the current chunk of each input with keys up to the smallest
+    maximum key of the current chunks are merged and yielded, and the
+    remaining rows are held until the next chunks are read.  At most one chunk
+    of each input is held in memory.  Inputs need not be strictly ordered,
+    though the output is ordered only to the extent the inputs are.
+
+    """
+
+    chunk_iters = list(chunk_iters)
+    pending = [None] * len(chunk_iters)
+
+    while True:
+        # Read the next non-empty chunk of inputs with no pending rows
+        for idx, chunk_iter in enumerate(chunk_iters):
+            while chunk_iter is not None and (pending[idx] is None or len(pending[idx].index) == 0):
+                pending[idx] = next(chunk_iter, None)
+                if pending[idx] is None:
+                    chunk_iters[idx] = chunk_iter = None
+
+        current = [data for data in pending if data is not None and len(data.index) > 0]
+
+        if len(current) == 0:
+            break
+
+        bound = min([data[key].max() for data in current])
+
+        merged = pd.concat([data[data[key] <= bound] for data in current], ignore_index=True)
+        merged = merged.sort_values(key, kind='mergesort', ignore_index=True)
+
+        pending = [None if data is None else data[data[key] > bound] for data in pending]
+
+        yield merged
+
+
+def merge_overlapping_seqdata(outfile, infiles, chromosomes, complib=default_complib, complevel=default_complevel, chunksize=1000000):
+    """ Merge seqdata files with overlapping chromosomes, such as seqdata of multiple lanes
+
+    Args:
+        outfile(str): seqdata hdf store to write to
+        infiles(dict): seqdata hdf store to read from
+        chromosomes(list): chromosomes to merge
+
+    KwArgs:
+        complib(str): compression library of seqdata columns
+        complevel(int): compression level of seqdata columns
+        chunksize(int): number of rows to read from each input at a time
+
+    Fragments of each chromosome are merged in order of fragment start by a
+    streaming merge of chunks of each input, all read on the calling thread.
+    Fragment ids are offset as they are read, so that fragment ids are unique
+    within each chromosome.  Inputs missing a chromosome are logged and
+    skipped.
+
+    """
+
+    infile_chromosomes = dict([(_id, read_chromosomes(infile)) for _id, infile in infiles.items()])
+    fragment_id_ends = dict([(_id, _get_fragment_id_ends(infile, chunksize=chunksize)) for _id, infile in infiles.items()])
+
+    with Writer(outfile, complib=complib, complevel=complevel) as writer:
         for chromosome in chromosomes:
-            allele_table = '/alleles/chromosome_{}'.format(chromosome)
-            fragment_table = '/fragments/chromosome_{}'.format(chromosome)
+            fragment_id_offsets = collections.OrderedDict()
+            fragment_id_end = 0
 
-            if allele_table not in tables:
-                print("missing table {}".format(allele_table))
-                continue
+            for _id in infiles:
+                if chromosome not in infile_chromosomes[_id]:
+                    logging.warning('missing chromosome {} in {}'.format(chromosome, infiles[_id]))
+                    continue
+
+                fragment_id_offsets[_id] = fragment_id_end
+                fragment_id_end += fragment_id_ends[_id].get(chromosome, 0)
 
-            if fragment_table not in tables:
-                print("missing table {}".format(fragment_table))
+            def read_chunks(_id, record_type):
+                offset_fragment_ids = functools.partial(_offset_fragment_ids, fragment_id_offset=fragment_id_offsets[_id])
+                return read_seq_data(infiles[_id], record_type, chromosome, chunksize=chunksize, post=offset_fragment_ids)
+
+            fragment_chunks = [read_chunks(_id, 'fragments') for _id in fragment_id_offsets]
+            for fragments in _merge_sorted_chunks(fragment_chunks, 'start'):
+                writer.write(chromosome, fragments, _get_empty_data('alleles'))
+
+            for _id in fragment_id_offsets:
+                for alleles in read_chunks(_id, 'alleles'):
+                    writer.write(chromosome, _get_empty_data('fragments'), alleles)
+
+
+Region = collections.namedtuple('Region', [
+    'chromosome',
+    'start',
+    'end',
+])
+
+
+def create_regions(chromosome_lengths, region_size):
+    """ Split chromosomes into fixed size regions for parallel extraction.
+
+    Args:
+        chromosome_lengths (dict): lengths of chromosomes keyed by chromosome
+        region_size (int): length of each region, None for whole chromosomes
+
+    Returns:
+        dict: regions keyed by region id
+
+    The end of the last region of each chromosome is None, extending the
+    region to the end of the chromosome.
+
+    """
+
+    regions = dict()
+
+    for chromosome, length in chromosome_lengths.items():
+        if region_size is None:
+            regions[chromosome] = Region(chromosome, None, None)
+            continue
+
+        starts = list(range(0, length, region_size))
+        ends = starts[1:] + [None]
+
+        for start, end in zip(starts, ends):
+            region_id = '{}_{}'.format(chromosome, start)
+            regions[region_id] = Region(chromosome, start, end)
+
+    return regions
+
+
+# Batch size used for extraction without a memory budget, and bounds on the
+# batch size for extraction within a memory budget
+default_batch_alignments = 10000000
+min_batch_alignments = 100000
+max_batch_alignments = 100000000
+
+# Initial estimate of extracted bytes per alignment, 20 bytes per fragment and
+# 12 bytes per allele, refined from the batches extracted
+initial_bytes_per_alignment = 24.
+
+# Batches in memory at once, one being read, one being written, and the copy
+# made by the hdf5 writer
+batches_in_memory = 3
+
+# Approximate bytes of a decoded bam alignment held by the prefetch thread,
+# including read name, sequence, qualities and tags
+bam_alignment_bytes = 1000.
+
+# Default alignments decoded ahead by the prefetch thread
+default_prefetch_alignments = 40000
+
+# Threads used for bam extraction, the prefetch thread decompressing and
+# decoding the bam, and the calling thread pairing reads and extracting alleles
+max_extract_threads = 2
+
+
+def _read_batches(reader, max_memory=None, prefetch_alignments=0):
+    """ Read batches of fragments and alleles from an allele reader.
+
+    Args:
+        reader(remixt.bamreader.AlleleReader): reader from which to read batches
+
+    KwArgs:
+        max_memory(float): memory budget in GB for extracted batches, None for fixed size batches
+        prefetch_alignments(int): alignments held by the reader's prefetch thread, counted against the budget
+
+    Yields:
+        tuple: chromosome, fragment table, allele table of each non-empty batch
+
+    The next batch is read on a background thread while the caller processes
+    the current batch, overlapping bam parsing with writing of the previous batch.
+
+    Given a memory budget, the number of alignments per batch is calculated from
+    the budget, less the alignments held by the prefetch thread, and the bytes
+    allocated for fragment and allele data per alignment, as measured from previous
+    batches.  Allocated bytes include the unused capacity of the extracted arrays.
+
+    """
+
+    def read_batch(max_alignments):
+        if not reader.ReadAlignments(max_alignments):
+            return None
+        batch_bytes = reader.GetTableMemory()
+        return (reader.GetChromosome(), reader.GetFragmentTable(), reader.GetAlleleTable()), batch_bytes
+
+    batch_memory = None
+    if max_memory is not None:
+        batch_memory = max_memory * 1e9 - prefetch_alignments * bam_alignment_bytes
+
+    def calculate_batch_alignments(bytes_per_alignment):
+        if batch_memory is None:
+            return default_batch_alignments
+        batch_alignments = int(batch_memory / (batches_in_memory * bytes_per_alignment))
+        return min(max(batch_alignments, min_batch_alignments), max_batch_alignments)
+
+    bytes_per_alignment = initial_bytes_per_alignment
+    batch_alignments = calculate_batch_alignments(bytes_per_alignment)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+        next_batch = executor.submit(read_batch, batch_alignments)
+
+        while True:
+            result = next_batch.result()
+
+            if result is None:
+                break
+
+            batch, batch_bytes = result
+
+            # Batches with no fragments or alleles, for instance of only
+            # discordant reads, are skipped and the batch size kept
+            if all([len(table.index) == 0 for table in batch[1:]]):
+                next_batch = executor.submit(read_batch, batch_alignments)
                 continue
 
-            alleles = store[allele_table]
-            fragments = store[fragment_table]
+            # Batches cut short at the end of a chromosome underestimate the
+            # bytes per alignment, allow the estimate to decrease gradually
+            bytes_per_alignment = max(float(batch_bytes) / batch_alignments, 0.5 * bytes_per_alignment)
+            batch_alignments = calculate_batch_alignments(bytes_per_alignment)
 
-            alleles['fragment_id'] = alleles['fragment_id'].astype(np.int64)
-            fragments['fragment_id'] = fragments['fragment_id'].astype(np.int64)
+            next_batch = executor.submit(read_batch, batch_alignments)
 
-            alleles['fragment_id'] += index_offsets[chromosome]
-            fragments['fragment_id'] += index_offsets[chromosome]
+            yield batch
 
-            index_offsets[chromosome] = max(alleles['fragment_id'].max(), fragments['fragment_id'].max()) + 1
 
-            out_store.append('/alleles/chromosome_{}'.format(chromosome), alleles)
-            out_store.append('/fragments/chromosome_{}'.format(chromosome), fragments)
+def check_discarded_reads(reader, max_buffered_reads):
+    """ Raise an error if an allele reader discarded reads.
 
-        store.close()
-    out_store.close()
+    Args:
+        reader(remixt.bamreader.AlleleReader): reader that has read all alignments
+        max_buffered_reads(int): maximum reads held in memory by the reader
+
+    Reads are discarded if their mate is further away in the bam than the maximum
+    buffered reads, the extracted data would be missing these fragments.
+
+    """
 
+    num_discarded = reader.GetNumDiscardedReads()
 
-def create_chromosome_seqdata(seqdata_filename, bam_filename, snp_filename, chromosome, max_fragment_length, max_soft_clipped, check_proper_pair):
+    if num_discarded > 0:
+        raise ValueError('discarded {} reads with mates beyond {} buffered reads, increase max_buffered_reads'.format(
+            num_discarded, max_buffered_reads))
+
+
+def create_chromosome_seqdata(seqdata_filename, bam_filename, snp_filename, chromosome, max_fragment_length, max_soft_clipped, check_proper_pair, start=None, end=None, snp_index_template=None, max_buffered_reads=1000000, snp_targeted=True, threads=1, prefetch_alignments=default_prefetch_alignments, max_memory=None, complib=default_complib, complevel=default_complevel):
     """ Create seqdata from bam for one chromosome.
 
     Args:
@@ -79,8 +372,30 @@ def create_chromosome_seqdata(seqdata_filename, bam_filename, snp_filename, chro
         max_soft_clipped(int): maximum soft clipping for considering a read concordant
         check_proper_pair(boo): check proper pair flag
 
+    KwArgs:
+        start(int): start of the region to extract, None for chromosome start
+        end(int): end of the region to extract, None for chromosome end
+        snp_index_template(str): per chromosome binary snp index filename template, used instead of snp_filename
+        max_buffered_reads(int): maximum reads held in memory awaiting their mate, extraction fails if exceeded
+        snp_targeted(bool): extract alleles by walking each read over known snps rather than a full pileup
+        threads(int): threads for reading the bam, decompression is moved off the main thread if greater than 1, at most 2 are used
+        prefetch_alignments(int): alignments decoded ahead by the decompression thread
+        max_memory(float): memory budget in GB for batches of extracted data and prefetched alignments, None for fixed size batches
+        complib(str): compression library of seqdata columns
+        complevel(int): compression level of seqdata columns
+
+    Fragments are extracted if their start falls within the region, including
+    fragments with a mate beyond the end of the region.  Fragment ids start at 0
+    for each region and are reconciled by `merge_seqdata`.
+
     """
 
+    # Load only this chromosome's snps from the binary index if available
+    if snp_index_template is not None:
+        snp_filename = snp_index_template.format(chromosome=chromosome)
+
+    threads = min(threads, max_extract_threads)
+
     reader = remixt.bamreader.AlleleReader(
         bam_filename,
         snp_filename,
@@ -88,63 +403,411 @@ def create_chromosome_seqdata(seqdata_filename, bam_filename, snp_filename, chro
         max_fragment_length,
         max_soft_clipped,
         check_proper_pair,
+        start=start,
+        end=end,
+        max_buffered_reads=max_buffered_reads,
+        snp_targeted=snp_targeted,
+        threads=threads,
+        prefetch_alignments=prefetch_alignments,
     )
 
-    with pd.HDFStore(seqdata_filename, 'w', complevel=9, complib='zlib') as store:
-        while reader.ReadAlignments(10000000):
-            _unique_index_append(store, _get_key('fragments', chromosome), reader.GetFragmentTable())
-            _unique_index_append(store, _get_key('alleles', chromosome), reader.GetAlleleTable())
+    # Alignments are only prefetched with additional threads
+    if threads <= 1:
+        prefetch_alignments = 0
 
+    with Writer(seqdata_filename, complib=complib, complevel=complevel) as writer:
+        for _, fragments, alleles in _read_batches(reader, max_memory=max_memory, prefetch_alignments=prefetch_alignments):
+            writer.write(chromosome, fragments, alleles)
 
+    check_discarded_reads(reader, max_buffered_reads)
 
-def create_seqdata(seqdata_filename, bam_filename, snp_filename, max_fragment_length, max_soft_clipped, check_proper_pair, tempdir, chromosomes):
 
-    try:
-        os.makedirs(tempdir)
-    except:
-        pass
+def _match_chromosome(bam_chromosome, chromosomes):
+    """ Match a bam chromosome name to a chromosome name, ucsc or ensembl
+    """
+    for chromosome in (bam_chromosome, bam_chromosome[3:] if bam_chromosome.startswith('chr') else 'chr' + bam_chromosome):
+        if chromosome in chromosomes:
+            return chromosome
+    return None
+
+
+def create_seqdata(seqdata_filename, bam_filename, snp_filename, max_fragment_length, max_soft_clipped, check_proper_pair, tempdir, chromosomes, max_buffered_reads=1000000, snp_targeted=True, threads=1, prefetch_alignments=default_prefetch_alignments, max_memory=None, complib=default_complib, complevel=default_complevel):
+    """ Create seqdata from bam in a single pass over all chromosomes.
+
+    Args:
+        seqdata_filename(str): seqdata hdf store to write to
+        bam_filename(str): coordinate sorted bam from which to extract read information
+        snp_filename(str): TSV chromosome, position file listing SNPs
+        max_fragment_length(int): maximum length of fragments generating paired reads
+        max_soft_clipped(int): maximum soft clipping for considering a read concordant
+        check_proper_pair(boo): check proper pair flag
+        tempdir(str): unused, chromosomes are no longer extracted to temporary files
+        chromosomes(list): chromosomes to extract
 
-    all_seqdata = {}
+    KwArgs:
+        max_buffered_reads(int): maximum reads held in memory awaiting their mate, extraction fails if exceeded
+        snp_targeted(bool): extract alleles by walking each read over known snps rather than a full pileup
+        threads(int): threads for reading the bam, decompression is moved off the main thread if greater than 1, at most 2 are used
+        prefetch_alignments(int): alignments decoded ahead by the decompression thread
+        max_memory(float): memory budget in GB for batches of extracted data and prefetched alignments, None for fixed size batches
+        complib(str): compression library of seqdata columns
+        complevel(int): compression level of seqdata columns
+
+    The bam is read sequentially without seeking, and the snps of each
+    chromosome are loaded as the reader reaches that chromosome.  Bam
+    chromosomes not in the list of chromosomes are read but not stored.
 
-    for chrom in chromosomes:
-        chrom_seqdata = os.path.join(tempdir, "{}_seqdata.h5".format(chrom))
-        all_seqdata[chrom] = chrom_seqdata
+    """
 
-        create_chromosome_seqdata(
-            chrom_seqdata, bam_filename, snp_filename,
-            chrom, max_fragment_length, max_soft_clipped,
-            check_proper_pair
-        )
+    threads = min(threads, max_extract_threads)
 
-    merge_seqdata(seqdata_filename, all_seqdata)
+    reader = remixt.bamreader.AlleleReader(
+        bam_filename,
+        snp_filename,
+        None,
+        max_fragment_length,
+        max_soft_clipped,
+        check_proper_pair,
+        max_buffered_reads=max_buffered_reads,
+        snp_targeted=snp_targeted,
+        threads=threads,
+        prefetch_alignments=prefetch_alignments,
+    )
 
+    # Alignments are only prefetched with additional threads
+    if threads <= 1:
+        prefetch_alignments = 0
 
-def merge_seqdata(out_filename, in_filenames):
-    """ Merge seqdata files for non-overlapping sets of chromosomes
+    with Writer(seqdata_filename, complib=complib, complevel=complevel) as writer:
+        for bam_chromosome, fragments, alleles in _read_batches(reader, max_memory=max_memory, prefetch_alignments=prefetch_alignments):
+            chromosome = _match_chromosome(bam_chromosome, chromosomes)
+
+            if chromosome is None:
+                continue
+
+            writer.write(chromosome, fragments, alleles)
+
+    check_discarded_reads(reader, max_buffered_reads)
+
+
+def merge_seqdata(out_filename, in_filenames, regions=None, complib=default_complib, complevel=default_complevel):
+    """ Merge seqdata files for non-overlapping sets of chromosomes or regions
 
     Args:
         out_filename(str): seqdata hdf store to write to
-        out_filename(dict): seqdata hdf store to read from
+        in_filenames(dict): seqdata hdf store to read from
+
+    KwArgs:
+        regions(dict): region of each input keyed as for in_filenames
+        complib(str): compression library of seqdata columns
+        complevel(int): compression level of seqdata columns
+
+    Inputs are merged in region order if regions are provided.  Fragment ids of
+    inputs for the same chromosome are offset to be unique within the chromosome.
+
+    """
+
+    in_keys = list(in_filenames.keys())
+    if regions is not None:
+        in_keys = sorted(in_keys, key=lambda k: (regions[k].chromosome, regions[k].start))
+
+    fragment_id_offsets = collections.defaultdict(int)
+
+    with Writer(out_filename, complib=complib, complevel=complevel) as writer:
+        for in_key in in_keys:
+            in_filename = in_filenames[in_key]
+
+            for chromosome in read_chromosomes(in_filename):
+                fragments = _read_seq_data_full(in_filename, 'fragments', chromosome)
+                alleles = _read_seq_data_full(in_filename, 'alleles', chromosome)
+
+                if len(fragments.index) == 0 and len(alleles.index) == 0:
+                    continue
+
+                fragments['fragment_id'] += fragment_id_offsets[chromosome]
+                alleles['fragment_id'] += fragment_id_offsets[chromosome]
+
+                fragment_id_offsets[chromosome] = max(
+                    fragments['fragment_id'].max() if len(fragments.index) > 0 else -1,
+                    alleles['fragment_id'].max() if len(alleles.index) > 0 else -1) + 1
+
+                writer.write(chromosome, fragments, alleles)
+
+
+class _ManifestPart(tables.IsDescription):
+    chromosome = tables.StringCol(256, pos=0)
+    filename = tables.StringCol(4096, pos=1)
+    fragment_id_offset = tables.Int64Col(pos=2)
+
+
+def _get_fragment_id_ends(seqdata_filename, chunksize=1000000):
+    """ Calculate one more than the maximum fragment id of each chromosome
+
+    Args:
+        seqdata_filename (str): name of seqdata file
+
+    KwArgs:
+        chunksize (int): number of rows to read at a time if fragment ids are read
+
+    Returns:
+        dict: fragment id end keyed by chromosome
+
+    Fragment id ends recorded by the writer are used if available, otherwise
+    fragment ids are read.
+
+    """
+
+    fragment_id_ends = dict()
+
+    for chromosome in read_chromosomes(seqdata_filename):
+        with tables.open_file(seqdata_filename, 'r') as h5file:
+            recorded_ends = list()
+            for record_type in ('fragments', 'alleles'):
+                key = _get_key(record_type, chromosome)
+                if key in h5file:
+                    recorded_ends.append(getattr(h5file.get_node(key)._v_attrs, 'fragment_id_end', None))
+
+        if len(recorded_ends) > 0 and None not in recorded_ends:
+            fragment_id_end = max(recorded_ends)
+
+        else:
+            fragment_id_end = 0
+            for record_type in ('fragments', 'alleles'):
+                for data in read_seq_data(seqdata_filename, record_type, chromosome, chunksize=chunksize, columns=['fragment_id']):
+                    if len(data.index) > 0:
+                        fragment_id_end = max(fragment_id_end, data['fragment_id'].max() + 1)
+
+        if fragment_id_end > 0:
+            fragment_id_ends[chromosome] = int(fragment_id_end)
+
+    return fragment_id_ends
+
+
+def link_seqdata(out_filename, in_filenames, regions=None):
+    """ Merge seqdata files by reference, without copying data
+
+    Args:
+        out_filename(str): seqdata manifest file to write to
+        in_filenames(dict): seqdata hdf store to read from
+
+    KwArgs:
+        regions(dict): region of each input keyed as for in_filenames
+
+    The output lists the input files containing each chromosome, and the offset
+    added to fragment ids of each input when read, as for `merge_seqdata`.  Inputs
+    are referenced relative to the directory of the output and must be kept
+    alongside the output.
 
     """
 
-    with pd.HDFStore(out_filename, 'w', complevel=9, complib='zlib') as out_store:
-        for in_filename in in_filenames.values():
-            with pd.HDFStore(in_filename, 'r') as in_store:
-                for key in in_store.keys():
-                    out_store.put(key, in_store[key], format='table')
+    in_keys = list(in_filenames.keys())
+    if regions is not None:
+        in_keys = sorted(in_keys, key=lambda k: (regions[k].chromosome, regions[k].start))
+
+    out_directory = os.path.dirname(os.path.abspath(out_filename))
+
+    fragment_id_offsets = collections.defaultdict(int)
+
+    with tables.open_file(out_filename, 'w') as h5file:
+        h5file.root._v_attrs.seqdata_format = manifest_format
+
+        manifest = h5file.create_table('/', 'manifest', _ManifestPart)
+
+        for in_key in in_keys:
+            in_filename = in_filenames[in_key]
+
+            if _get_seq_data_format(in_filename) == manifest_format:
+                raise ValueError('unable to link seqdata manifest {}'.format(in_filename))
+
+            relative_filename = os.path.relpath(os.path.abspath(in_filename), out_directory)
+
+            for chromosome, fragment_id_end in _get_fragment_id_ends(in_filename).items():
+                manifest.append([(chromosome, relative_filename, fragment_id_offsets[chromosome])])
+                fragment_id_offsets[chromosome] += fragment_id_end
+
+        manifest.flush()
+
+
+def _count_snp_alleles(allele_data):
+    """ Count reference and alternate alleles at each snp position
+
+    Args:
+        allele_data (pandas.DataFrame): allele data with columns 'position', 'is_alt'
+
+    Returns:
+        pandas.DataFrame: snp counts with columns 'position', 'ref_count', 'alt_count'
+
+    """
+
+    positions, position_idx = np.unique(allele_data['position'].values, return_inverse=True)
+    is_alt = (allele_data['is_alt'].values != 0)
+
+    return pd.DataFrame({
+        'position': positions,
+        'ref_count': np.bincount(position_idx[~is_alt], minlength=len(positions)),
+        'alt_count': np.bincount(position_idx[is_alt], minlength=len(positions)),
+    })
+
+
+def _add_snp_counts(snp_counts_1, snp_counts_2):
+    """ Sum two tables of snp counts, each sorted by position
+    """
+
+    positions_1 = snp_counts_1['position'].values
+    positions_2 = snp_counts_2['position'].values
+
+    # Index of each snp of the second table in the first, and whether it is present
+    idx = np.searchsorted(positions_1, positions_2)
+    present = idx < len(positions_1)
+    present[present] = positions_1[idx[present]] == positions_2[present]
+
+    combined = {'position': np.insert(positions_1, idx[~present], positions_2[~present])}
+    for column in ('ref_count', 'alt_count'):
+        counts = snp_counts_1[column].values.astype(np.int64)
+        counts[idx[present]] += snp_counts_2[column].values[present]
+        combined[column] = np.insert(counts, idx[~present], snp_counts_2[column].values[~present])
+
+    return pd.DataFrame(combined)
+
+
+def _combine_snp_counts(snp_counts):
+    """ Sum snp counts of multiple chunks, sorted by position
+    """
+
+    snp_counts = [a for a in snp_counts if len(a.index) > 0]
+
+    if len(snp_counts) == 0:
+        return pd.DataFrame(columns=['position', 'ref_count', 'alt_count']).astype(int)
+
+    return functools.reduce(_add_snp_counts, snp_counts)
+
+
+def _write_snp_counts(h5file, chromosome, snp_counts, filters):
+    for column, dtype in snp_count_columns:
+        h5file.create_carray(
+            _get_key('snp_counts', chromosome), column,
+            obj=snp_counts[column].values.astype(dtype),
+            filters=filters,
+            createparents=True)
+
+
+def write_snp_counts(seqdata_filename, chunksize=1000000):
+    """ Add counts of reads for each snp to a seqdata file written without them
+
+    Args:
+        seqdata_filename (str): name of seqdata file
+
+    KwArgs:
+        chunksize (int): number of rows to read at a time
+
+    Snp counts are written to each file listed in a seqdata manifest.  Counts
+    cannot be added to pandas seqdata files written by earlier versions.
+
+    """
+
+    seqdata_format = _get_seq_data_format(seqdata_filename)
+
+    if seqdata_format == manifest_format:
+        for part_filename in _read_manifest(seqdata_filename)['filename'].unique():
+            write_snp_counts(part_filename, chunksize=chunksize)
+        return
+
+    if seqdata_format != columnar_format:
+        raise ValueError('unable to add snp counts to pandas seqdata file {}'.format(seqdata_filename))
+
+    snp_counts = dict()
+    for chromosome in read_chromosomes(seqdata_filename):
+        snp_counts[chromosome] = _combine_snp_counts([
+            _count_snp_alleles(alleles) for alleles in
+            read_allele_data(seqdata_filename, chromosome, chunksize=chunksize, columns=['position', 'is_alt'])])
+
+    with tables.open_file(seqdata_filename, 'a') as h5file:
+        if '/snp_counts' in h5file:
+            h5file.remove_node('/snp_counts', recursive=True)
+
+        filters = tables.Filters(
+            complib=str(getattr(h5file.root._v_attrs, 'seqdata_complib', default_complib)),
+            complevel=int(getattr(h5file.root._v_attrs, 'seqdata_complevel', default_complevel)),
+            shuffle=True)
+
+        for chromosome, chromosome_snp_counts in snp_counts.items():
+            if len(chromosome_snp_counts.index) > 0:
+                _write_snp_counts(h5file, chromosome, chromosome_snp_counts, filters)
+
+        h5file.root._v_attrs.snp_counts_recorded = True
 
 
 class Writer(object):
-    def __init__(self, seqdata_filename):
+    def __init__(self, seqdata_filename, complib=default_complib, complevel=default_complevel):
         """ Streaming writer of seq data hdf5 files 
 
         Args:
             seqdata_filename (str): name of seqdata hdf5 file
 
+        KwArgs:
+            complib (str): compression library, any pytables compression library such as 'zlib' or 'blosc:zstd'
+            complevel (int): compression level, 0 to 9
+
+        Each column is stored as a separate chunked and compressed array, with
+        fragment starts delta encoded, fragment lengths in place of ends, and
+        the duplicate flag packed into a flags column.  Each chunk of alleles is
+        sorted by fragment id, and tables with fragment ids sorted across all
+        chunks are marked with the fragment_id_sorted attribute.  The compression
+        of the columns is recorded as file attributes, readers need not know it
+        as hdf5 filters are stored with each array.
+
+        Fragment lengths are stored as 16 bit unsigned integers, fragments
+        longer than 65535 bp cannot be written and raise a ValueError.
+
         """
 
-        self.store = pd.HDFStore(seqdata_filename, 'w', complevel=9, complib='zlib')
+        self.filters = tables.Filters(complevel=complevel, complib=complib, shuffle=True)
+
+        self.h5file = tables.open_file(seqdata_filename, 'w')
+        self.h5file.root._v_attrs.seqdata_format = columnar_format
+        self.h5file.root._v_attrs.seqdata_complib = complib
+        self.h5file.root._v_attrs.seqdata_complevel = complevel
+
+        self.num_fragments = collections.Counter()
+        self.last_start = dict()
+
+        self.block_min_start = collections.defaultdict(list)
+        self.block_max_start = collections.defaultdict(list)
+
+        self.fragment_id_end = collections.Counter()
+
+        self.last_fragment_id = dict()
+        self.fragment_id_unsorted = set()
+
+        self.summary_stats = dict()
+
+        self.snp_counts = collections.defaultdict(list)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _append(self, record_type, chromosome, column, data):
+        key = _get_key(record_type, chromosome)
+        try:
+            array = self.h5file.get_node(key, column)
+        except tables.NoSuchNodeError:
+            array = self.h5file.create_earray(
+                key, column,
+                atom=tables.Atom.from_dtype(data.dtype),
+                shape=(0,),
+                filters=self.filters,
+                chunkshape=(block_size,),
+                createparents=True)
+        array.append(data)
+
+    def _update_fragment_id_sorted(self, record_type, chromosome, fragment_ids):
+        key = (record_type, chromosome)
+        if np.any(np.diff(fragment_ids) < 0) or fragment_ids[0] < self.last_fragment_id.get(key, fragment_ids[0]):
+            self.fragment_id_unsorted.add(key)
+        self.last_fragment_id[key] = fragment_ids[-1]
 
     def write(self, chromosome, fragment_data, allele_data):
         """ Write a chunk of reads and alleles data
@@ -159,60 +822,505 @@ class Writer(object):
 
         Input 'allele_data' dataframe has columns 'position', 'fragment_id', 'is_alt'.
 
+        Raises a ValueError for fragments with end before start or with length
+        greater than 65535, the maximum length stored.
+
         """
 
-        # Add nominal mapping quality
-        if 'mapping_quality' not in fragment_data:
-            fragment_data['mapping_quality'] = 60
+        for data in (fragment_data, allele_data):
+            if len(data.index) > 0:
+                self.fragment_id_end[chromosome] = max(self.fragment_id_end[chromosome], int(data['fragment_id'].max()) + 1)
+
+        if len(fragment_data.index) > 0:
+            self._write_fragments(chromosome, fragment_data)
+            self._update_fragment_id_sorted('fragments', chromosome, fragment_data['fragment_id'].values)
+
+        if len(allele_data.index) > 0:
+            # Sort alleles by fragment id, retaining the order of alleles of each fragment
+            allele_data = allele_data.iloc[np.argsort(allele_data['fragment_id'].values, kind='stable')]
+            self._update_fragment_id_sorted('alleles', chromosome, allele_data['fragment_id'].values)
+
+            for column, dtype in allele_columns:
+                self._append('alleles', chromosome, column, allele_data[column].values.astype(dtype))
+
+            stats = self._get_summary_stats(chromosome)
+            stats['allele_count'] += np.bincount((allele_data['is_alt'].values != 0).astype(int), minlength=2)
+
+            # Sum counts as they are written, bounding memory by the number of snps
+            self.snp_counts[chromosome] = [_combine_snp_counts(self.snp_counts[chromosome] + [_count_snp_alleles(allele_data)])]
+
+    def _get_summary_stats(self, chromosome):
+        if chromosome not in self.summary_stats:
+            self.summary_stats[chromosome] = _create_summary_stats()
+        return self.summary_stats[chromosome]
+
+    def _update_fragment_stats(self, chromosome, lengths, mapping_quality, flags):
+        stats = self._get_summary_stats(chromosome)
+
+        # Index of the is_duplicate, mapping quality cell of each fragment
+        quality_idx = (flags & is_duplicate_flag).astype(int) * 256 + mapping_quality.astype(np.uint8)
+        lengths = lengths.astype(np.int64)
+
+        for name, weights in (('fragment_count', None), ('fragment_length_sum', lengths), ('fragment_length_sum_squares', lengths * lengths)):
+            stats[name] += np.rint(np.bincount(quality_idx, weights=weights, minlength=512)).astype(np.int64).reshape(2, 256)
+
+        length_histogram = np.bincount(lengths)
+        stats['fragment_length_histogram'] = _add_histograms(stats['fragment_length_histogram'], length_histogram)
+
+    def _write_fragments(self, chromosome, fragment_data):
+        starts = fragment_data['start'].values
+        lengths = fragment_data['end'].values - starts
 
-        # Add nominal is_duplicate value
-        if 'is_duplicate' not in fragment_data:
-            fragment_data['is_duplicate'] = 0
+        if np.any(lengths < 0) or np.any(lengths > max_fragment_length):
+            invalid = (lengths < 0) | (lengths > max_fragment_length)
+            raise ValueError('fragment lengths must be between 0 and {}, the maximum stored length, found fragment {} with length {}'.format(
+                max_fragment_length, fragment_data['fragment_id'].values[invalid][0], lengths[invalid][0]))
 
-        fragment_data = fragment_data[['fragment_id', 'start', 'end', 'is_duplicate', 'mapping_quality']]
-        allele_data = allele_data[['position', 'fragment_id', 'is_alt']]
+        start_deltas, block_starts = _encode_starts(
+            starts, self.num_fragments[chromosome], self.last_start.get(chromosome, 0))
 
-        _unique_index_append(self.store, _get_key('fragments', chromosome), fragment_data)
-        _unique_index_append(self.store, _get_key('alleles', chromosome), allele_data)
+        # Add nominal mapping quality and is_duplicate values
+        if 'mapping_quality' in fragment_data:
+            mapping_quality = fragment_data['mapping_quality'].values
+        else:
+            mapping_quality = np.full(len(starts), 60)
+
+        flags = np.zeros(len(starts), dtype=np.uint8)
+        if 'is_duplicate' in fragment_data:
+            flags[fragment_data['is_duplicate'].values != 0] |= is_duplicate_flag
+
+        columns = {
+            'fragment_id': fragment_data['fragment_id'].values,
+            'start_delta': start_deltas,
+            'length': lengths,
+            'mapping_quality': mapping_quality,
+            'flags': flags,
+        }
+
+        for column, dtype in fragment_columns:
+            self._append('fragments', chromosome, column, columns[column].astype(dtype))
+
+        if len(block_starts) > 0:
+            self._append('fragments', chromosome, 'block_start', block_starts)
+
+        self._update_block_index(chromosome, starts)
+        self._update_fragment_stats(chromosome, lengths, mapping_quality, flags)
+
+        self.num_fragments[chromosome] += len(starts)
+        self.last_start[chromosome] = starts[-1]
+
+    def _update_block_index(self, chromosome, starts):
+        rows = np.arange(self.num_fragments[chromosome], self.num_fragments[chromosome] + len(starts))
+        blocks, block_idx = np.unique(rows // block_size, return_index=True)
+
+        min_starts = list(np.minimum.reduceat(starts, block_idx))
+        max_starts = list(np.maximum.reduceat(starts, block_idx))
+
+        # First block may have been started by the previous write
+        if blocks[0] < len(self.block_min_start[chromosome]):
+            self.block_min_start[chromosome][-1] = min(self.block_min_start[chromosome][-1], min_starts.pop(0))
+            self.block_max_start[chromosome][-1] = max(self.block_max_start[chromosome][-1], max_starts.pop(0))
+
+        self.block_min_start[chromosome].extend(min_starts)
+        self.block_max_start[chromosome].extend(max_starts)
+
+    def _write_block_index(self):
+        for chromosome in self.block_min_start:
+            for column, values in (('block_min_start', self.block_min_start[chromosome]), ('block_max_start', self.block_max_start[chromosome])):
+                self.h5file.create_carray(
+                    _get_key('fragments', chromosome), column,
+                    obj=np.array(values, dtype=np.int32),
+                    filters=self.filters)
+
+    def _write_summary_stats(self):
+        for chromosome, stats in self.summary_stats.items():
+            fragments_key = _get_key('fragments', chromosome)
+            alleles_key = _get_key('alleles', chromosome)
+
+            if fragments_key in self.h5file:
+                attrs = self.h5file.get_node(fragments_key)._v_attrs
+                for name in ('fragment_count', 'fragment_length_sum', 'fragment_length_sum_squares'):
+                    setattr(attrs, name, stats[name])
+
+                # Histogram may exceed the size limit of hdf5 attributes
+                self.h5file.create_carray(
+                    fragments_key, 'fragment_length_histogram',
+                    obj=stats['fragment_length_histogram'],
+                    filters=self.filters)
+
+            if alleles_key in self.h5file:
+                self.h5file.get_node(alleles_key)._v_attrs.allele_count = stats['allele_count']
 
     def close(self):
         """ Close seq data file
         
         """
 
-        self.store.close()
+        self._write_block_index()
+        self._write_summary_stats()
+
+        for chromosome, snp_counts in self.snp_counts.items():
+            _write_snp_counts(self.h5file, chromosome, _combine_snp_counts(snp_counts), self.filters)
+        self.h5file.root._v_attrs.snp_counts_recorded = True
+
+        for chromosome, fragment_id_end in self.fragment_id_end.items():
+            for record_type in ('fragments', 'alleles'):
+                key = _get_key(record_type, chromosome)
+                if key in self.h5file:
+                    attrs = self.h5file.get_node(key)._v_attrs
+                    attrs.fragment_id_end = fragment_id_end
+                    attrs.fragment_id_sorted = (record_type, chromosome) not in self.fragment_id_unsorted
+
+        self.h5file.close()
 
 
 _identity = lambda x: x
 
 
-def _read_seq_data_full(seqdata_filename, record_type, chromosome, post=_identity):
-    key = _get_key(record_type, chromosome)
+def _is_columnar(h5file):
+    return getattr(h5file.root._v_attrs, 'seqdata_format', None) == columnar_format
+
+
+def _get_seq_data_format(seqdata_filename):
+    with tables.open_file(seqdata_filename, 'r') as h5file:
+        return getattr(h5file.root._v_attrs, 'seqdata_format', None)
+
+
+def _read_manifest(seqdata_filename):
+    """ Read the parts of a seqdata manifest, with filenames resolved relative to the manifest
+    """
+
+    directory = os.path.dirname(os.path.abspath(seqdata_filename))
+
+    with tables.open_file(seqdata_filename, 'r') as h5file:
+        manifest = h5file.root.manifest.read()
+
+    parts = pd.DataFrame({
+        'chromosome': [a.decode() for a in manifest['chromosome']],
+        'filename': [os.path.join(directory, a.decode()) for a in manifest['filename']],
+        'fragment_id_offset': manifest['fragment_id_offset'],
+    })
+
+    return parts
+
+
+def _get_seq_data_parts(seqdata_filename, chromosome):
+    """ Files containing data for a chromosome, with the offset added to their fragment ids
+    """
+
+    if _get_seq_data_format(seqdata_filename) != manifest_format:
+        return [(seqdata_filename, 0)]
+
+    parts = _read_manifest(seqdata_filename)
+    parts = parts[parts['chromosome'] == chromosome]
+
+    return list(zip(parts['filename'], parts['fragment_id_offset']))
+
+
+def _offset_fragment_ids(data, fragment_id_offset):
+    if fragment_id_offset != 0 and 'fragment_id' in data:
+        data['fragment_id'] += fragment_id_offset
+    return data
+
+
+def _get_columnar_nrows(h5file, record_type, chromosome):
     try:
-        return post(pd.read_hdf(seqdata_filename, key))
-    except KeyError:
-        return empty_data[record_type]
+        return h5file.get_node(_get_key(record_type, chromosome), 'fragment_id').nrows
+    except tables.NoSuchNodeError:
+        return 0
 
 
-def _get_seq_data_nrows(seqdata_filename, key):
-    with pd.HDFStore(seqdata_filename, 'r') as store:
-        try:
-            return store.get_storer(key).nrows
-        except (AttributeError, KeyError):
-            return 0
+FragmentFilter = collections.namedtuple('FragmentFilter', [
+    'filter_duplicates',
+    'map_qual_threshold',
+    'start',
+    'end',
+])
+
+
+def _get_fragment_filter_columns(fragment_filter):
+    """ Columns required to evaluate a fragment filter
+    """
+
+    columns = list()
+    if fragment_filter is None:
+        return columns
+
+    if fragment_filter.filter_duplicates:
+        columns.append('is_duplicate')
+    if fragment_filter.map_qual_threshold is not None:
+        columns.append('mapping_quality')
+    if fragment_filter.start is not None or fragment_filter.end is not None:
+        columns.append('start')
+
+    return columns
+
+
+def _evaluate_fragment_filter(get_column, fragment_filter):
+    """ Evaluate a fragment filter given a function returning column values
+
+    Returns:
+        numpy.array: boolean mask of selected fragments, None if all are selected
+
+    """
+
+    is_selected = None
+
+    def update(column_selected):
+        return column_selected if is_selected is None else is_selected & column_selected
+
+    if fragment_filter is None:
+        return is_selected
+
+    if fragment_filter.filter_duplicates:
+        is_selected = update(get_column('is_duplicate') == 0)
+    if fragment_filter.map_qual_threshold is not None:
+        is_selected = update(get_column('mapping_quality') >= fragment_filter.map_qual_threshold)
+    if fragment_filter.start is not None:
+        is_selected = update(get_column('start') >= fragment_filter.start)
+    if fragment_filter.end is not None:
+        is_selected = update(get_column('start') < fragment_filter.end)
+
+    return is_selected
+
+
+def _read_columnar(h5file, record_type, chromosome, start=0, stop=None, columns=None, fragment_filter=None):
+    """ Read rows of a columnar seqdata table into a dataframe
+
+    Columns required by the fragment filter are decoded first, and the remaining
+    columns are decoded only for the selected rows.
+
+    """
+
+    if columns is None:
+        columns = list(empty_data[record_type].columns)
+
+    nrows = _get_columnar_nrows(h5file, record_type, chromosome)
+    if stop is None or stop > nrows:
+        stop = nrows
+
+    if start >= stop:
+        return _get_empty_data(record_type, columns=columns)
+
+    group = h5file.get_node(_get_key(record_type, chromosome))
+
+    decoded = dict()
+
+    def decode_column(column):
+        if column in decoded:
+            return decoded[column]
+
+        if column == 'start':
+            block_idx = start // block_size
+            block_starts = group.block_start.read(block_idx, (stop - 1) // block_size + 1)
+            values = _decode_starts(group.start_delta.read(block_idx * block_size, stop), block_starts)
+            values = values[start - block_idx * block_size:]
+        elif column == 'end':
+            values = decode_column('start') + group.length.read(start, stop).astype(np.int32)
+        elif column == 'is_duplicate' and record_type == 'fragments':
+            values = group.flags.read(start, stop) & is_duplicate_flag
+        else:
+            values = h5file.get_node(group, column).read(start, stop)
+
+        decoded[column] = values
+        return values
+
+    is_selected = _evaluate_fragment_filter(decode_column, fragment_filter)
+
+    if is_selected is not None and not is_selected.any():
+        return _get_empty_data(record_type, columns=columns)
+
+    data = dict()
+    for column in columns:
+        data[column] = decode_column(column)
+        if is_selected is not None:
+            data[column] = data[column][is_selected]
+
+    return pd.DataFrame(data, columns=columns)
+
+
+def _open_seq_data(seqdata_filename):
+    """ Open a seqdata file, as a pytables file if columnar, otherwise as a pandas store
+    """
+
+    h5file = tables.open_file(seqdata_filename, 'r')
+    if _is_columnar(h5file):
+        return h5file
+    h5file.close()
+
+    return pd.HDFStore(seqdata_filename, 'r')
+
 
+def _get_nrows(handle, record_type, chromosome):
+    if isinstance(handle, tables.File):
+        return _get_columnar_nrows(handle, record_type, chromosome)
+
+    try:
+        return handle.get_storer(_get_key(record_type, chromosome)).nrows
+    except (AttributeError, KeyError):
+        return 0
+
+
+def _read_rows(handle, record_type, chromosome, start=0, stop=None, columns=None, fragment_filter=None):
+    if isinstance(handle, tables.File):
+        return _read_columnar(
+            handle, record_type, chromosome, start=start, stop=stop,
+            columns=columns, fragment_filter=fragment_filter)
+
+    if columns is None:
+        columns = list(empty_data[record_type].columns)
+
+    if _get_nrows(handle, record_type, chromosome) == 0:
+        return _get_empty_data(record_type, columns=columns)
+
+    read_columns = columns + [a for a in _get_fragment_filter_columns(fragment_filter) if a not in columns]
+    data = handle.select(_get_key(record_type, chromosome), start=start, stop=stop, columns=read_columns)
+
+    is_selected = _evaluate_fragment_filter(lambda column: data[column].values, fragment_filter)
+    if is_selected is not None:
+        data = data[is_selected]
+
+    return data[columns]
+
+
+def _get_row_ranges(handle, record_type, chromosome, fragment_filter=None):
+    """ Ranges of rows of blocks that may contain fragments starting in a range
+
+    Args:
+        handle (tables.File or pandas.HDFStore): open seqdata file
+        record_type (str): record type, can be 'alleles' or 'fragments'
+        chromosome (str): select specific chromosome
+
+    KwArgs:
+        fragment_filter (FragmentFilter): filter with range of fragment starts
+
+    Returns:
+        list: tuples of start and stop rows
+
+    All rows are selected for files without a block index.
+
+    """
+
+    nrows = _get_nrows(handle, record_type, chromosome)
 
-def _read_seq_data_chunks(seqdata_filename, record_type, chromosome, chunksize, post=_identity):
-    key = _get_key(record_type, chromosome)
-    nrows = _get_seq_data_nrows(seqdata_filename, key)
     if nrows == 0:
-        yield empty_data[record_type]
-    else:
-        for i in range(nrows//chunksize + 1):
-            yield post(pd.read_hdf(seqdata_filename, key, start=i*chunksize, stop=(i+1)*chunksize))
+        return []
+
+    if fragment_filter is None or not isinstance(handle, tables.File):
+        return [(0, nrows)]
+
+    start, end = fragment_filter.start, fragment_filter.end
+
+    if start is None and end is None:
+        return [(0, nrows)]
+
+    group = handle.get_node(_get_key(record_type, chromosome))
+    if 'block_min_start' not in group:
+        return [(0, nrows)]
+
+    is_selected = np.ones(group.block_min_start.nrows, dtype=bool)
+    if start is not None:
+        is_selected &= (group.block_max_start.read() >= start)
+    if end is not None:
+        is_selected &= (group.block_min_start.read() < end)
+
+    # Merge runs of consecutive selected blocks
+    selected_blocks = np.flatnonzero(is_selected)
+    run_starts = selected_blocks[np.diff(selected_blocks, prepend=-2) != 1]
+    run_ends = selected_blocks[np.diff(selected_blocks, append=-2) != 1] + 1
 
+    return [(block_start * block_size, min(block_end * block_size, nrows)) for block_start, block_end in zip(run_starts, run_ends)]
 
-def read_seq_data(seqdata_filename, record_type, chromosome, chunksize=None, post=_identity):
+
+def count_fragment_block_rows(seqdata_filename, chromosome, ranges):
+    """ Count rows of blocks that may contain fragments starting in ranges
+
+    Args:
+        seqdata_filename (str): name of seqdata file
+        chromosome (str): select specific chromosome
+        ranges (numpy.array): disjoint start, end ranges of fragment starts, sorted by start
+
+    Returns:
+        tuple: number of rows in selected blocks and total number of rows, or None if
+        any file lacks a block index
+
+    """
+
+    selected_rows = 0
+    total_rows = 0
+
+    for part_filename, _ in _get_seq_data_parts(seqdata_filename, chromosome):
+        with _open_seq_data(part_filename) as handle:
+            if not isinstance(handle, tables.File):
+                return None
+
+            nrows = _get_nrows(handle, 'fragments', chromosome)
+            total_rows += nrows
+
+            if nrows == 0:
+                continue
+
+            group = handle.get_node(_get_key('fragments', chromosome))
+            if 'block_min_start' not in group:
+                return None
+
+            block_min_start = group.block_min_start.read()
+            block_max_start = group.block_max_start.read()
+
+        # Ranges are disjoint, thus the last range starting at or before the maximum
+        # start of a block ends after its minimum start if any range does
+        range_idx = np.searchsorted(ranges[:, 0], block_max_start, side='right') - 1
+        is_selected = (range_idx >= 0) & (ranges[np.maximum(range_idx, 0), 1] > block_min_start)
+
+        block_rows = np.minimum(block_size, nrows - np.arange(len(block_min_start)) * block_size)
+        selected_rows += block_rows[is_selected].sum()
+
+    return selected_rows, total_rows
+
+
+def _read_seq_data_full(seqdata_filename, record_type, chromosome, post=_identity, columns=None, fragment_filter=None, fragment_id_offset=0):
+    with _open_seq_data(seqdata_filename) as handle:
+        row_ranges = _get_row_ranges(handle, record_type, chromosome, fragment_filter=fragment_filter)
+
+        if len(row_ranges) == 0:
+            return post(_get_empty_data(record_type, columns=columns))
+
+        data = list()
+        for row_start, row_stop in row_ranges:
+            data.append(_read_rows(
+                handle, record_type, chromosome, start=row_start, stop=row_stop,
+                columns=columns, fragment_filter=fragment_filter))
+        data = data[0] if len(data) == 1 else pd.concat(data)
+
+        return post(_offset_fragment_ids(data, fragment_id_offset))
+
+
+def _read_seq_data_chunks(seqdata_filename, record_type, chromosome, chunksize, post=_identity, columns=None, fragment_filter=None, fragment_id_offset=0):
+    """ Stream chunks of seqdata from a single open handle.
+
+    Chunks are read on the calling thread, as neither PyTables nor most builds
+    of HDF5 are thread safe.
+
+    """
+
+    with _open_seq_data(seqdata_filename) as handle:
+        chunks = list()
+        for row_start, row_stop in _get_row_ranges(handle, record_type, chromosome, fragment_filter=fragment_filter):
+            for chunk_start in range(row_start, row_stop, chunksize):
+                chunks.append((chunk_start, min(chunk_start + chunksize, row_stop)))
+
+        if len(chunks) == 0:
+            yield post(_get_empty_data(record_type, columns=columns))
+            return
+
+        for chunk_start, chunk_stop in chunks:
+            data = _read_rows(
+                handle, record_type, chromosome, start=chunk_start, stop=chunk_stop,
+                columns=columns, fragment_filter=fragment_filter)
+            yield post(_offset_fragment_ids(data, fragment_id_offset))
+
+
+def read_seq_data(seqdata_filename, record_type, chromosome, chunksize=None, post=_identity, columns=None, fragment_filter=None):
     """ Read sequence data from a HDF seqdata file.
 
     Args:
@@ -223,19 +1331,48 @@ def read_seq_data(seqdata_filename, record_type, chromosome, chunksize=None, pos
     KwArgs:
         chunksize (int): number of rows to stream at a time, None for the entire file
         post (callable): post processing function
+        columns (list): columns to read, None for all columns
+        fragment_filter (FragmentFilter): filter applied to fragments as they are read
 
     Yields:
         pandas.DataFrame
 
+    For columnar seqdata files, the columns used by the fragment filter are
+    decoded first and other columns are decoded only for selected fragments.
+    Given a range of fragment starts, only blocks of fragments with starts
+    overlapping the range are read.
+
+    For seqdata manifests, the data of each file listed for the chromosome is
+    read in turn.
+
     """
 
+    if record_type != 'fragments' and fragment_filter is not None:
+        raise ValueError('fragment filter may only be given for fragments')
+
+    parts = _get_seq_data_parts(seqdata_filename, chromosome)
+
+    if len(parts) == 0:
+        data = post(_get_empty_data(record_type, columns=columns))
+        return data if chunksize is None else iter([data])
+
     if chunksize is None:
-        return _read_seq_data_full(seqdata_filename, record_type, chromosome, post=post)
+        data = list()
+        for part_filename, fragment_id_offset in parts:
+            data.append(_read_seq_data_full(
+                part_filename, record_type, chromosome, columns=columns,
+                fragment_filter=fragment_filter, fragment_id_offset=fragment_id_offset))
+        data = data[0] if len(data) == 1 else pd.concat(data, ignore_index=True)
+        return post(data)
+
     else:
-        return _read_seq_data_chunks(seqdata_filename, record_type, chromosome, chunksize, post=post)
+        return itertools.chain.from_iterable(_read_seq_data_chunks(
+            part_filename, record_type, chromosome, chunksize, post=post, columns=columns,
+            fragment_filter=fragment_filter, fragment_id_offset=fragment_id_offset)
+            for part_filename, fragment_id_offset in parts)
 
 
-def read_fragment_data(seqdata_filename, chromosome, filter_duplicates=False, map_qual_threshold=1, chunksize=None):
+def read_fragment_data(seqdata_filename, chromosome, filter_duplicates=False, map_qual_threshold=1, chunksize=None, start=None, end=None, columns=None):
     """ Read fragment data from a HDF seqdata file.
 
     Args:
@@ -246,32 +1383,64 @@ def read_fragment_data(seqdata_filename, chromosome, filter_duplicates=False, ma
         filter_duplicates (bool): filter reads marked as duplicate
         map_qual_threshold (int): filter reads with less than this mapping quality
         chunksize (int): number of rows to stream at a time, None for the entire file
+        start (int): select fragments starting at or after this position, None for chromosome start
+        end (int): select fragments starting before this position, None for chromosome end
+        columns (list): subset of columns to read, None for the default columns
 
     Yields:
         pandas.DataFrame
 
-    Returned dataframe has columns 'fragment_id', 'start', 'end'
+    Returned dataframe has columns 'fragment_id', 'start', 'end' by default, and
+    additionally 'is_duplicate' if filter_duplicates is None and 'mapping_quality'
+    if map_qual_threshold is None.
+
+    """
+
+    if columns is None:
+        columns = ['fragment_id', 'start', 'end']
+        if filter_duplicates is None:
+            columns.append('is_duplicate')
+        if map_qual_threshold is None:
+            columns.append('mapping_quality')
+
+    fragment_filter = FragmentFilter(filter_duplicates, map_qual_threshold, start, end)
+
+    return read_seq_data(seqdata_filename, 'fragments', chromosome, chunksize=chunksize, columns=columns, fragment_filter=fragment_filter)
+
+
+def read_fragment_id_sorted(seqdata_filename, record_type, chromosome):
+    """ Check if records are stored sorted by fragment id.
+
+    Args:
+        seqdata_filename (str): name of seqdata file
+        record_type (str): record type, can be 'alleles' or 'fragments'
+        chromosome (str): select specific chromosome
+
+    Returns:
+        bool: records are sorted by fragment id across the file
+
+    Files without the fragment_id_sorted attribute, written by earlier versions, are
+    assumed to be unsorted.  Parts of a manifest are ordered by fragment id offset, thus
+    records are sorted if sorted within each part.
 
     """
 
-    def filter_reads(reads):
-        # Filter duplicates if necessary
-        if 'is_duplicate' in reads and filter_duplicates is not None:
-            if filter_duplicates:
-                reads = reads[reads['is_duplicate'] == 0]
-            reads.drop(['is_duplicate'], axis=1, inplace=True)
+    for part_filename, _ in _get_seq_data_parts(seqdata_filename, chromosome):
+        with _open_seq_data(part_filename) as handle:
+            if not isinstance(handle, tables.File):
+                return False
 
-        # Filter poor quality reads
-        if 'mapping_quality' in reads and map_qual_threshold is not None:
-            reads = reads[reads['mapping_quality'] >= map_qual_threshold]
-            reads.drop(['mapping_quality'], axis=1, inplace=True)
+            key = _get_key(record_type, chromosome)
+            if key not in handle:
+                continue
 
-        return reads
+            if not getattr(handle.get_node(key)._v_attrs, 'fragment_id_sorted', False):
+                return False
 
-    return read_seq_data(seqdata_filename, 'fragments', chromosome, chunksize=chunksize, post=filter_reads)
+    return True
 
 
-def read_allele_data(seqdata_filename, chromosome, chunksize=None):
+def read_allele_data(seqdata_filename, chromosome, chunksize=None, columns=None):
     """ Read allele data from a HDF seqdata file.
 
     Args:
@@ -280,6 +1449,7 @@ def read_allele_data(seqdata_filename, chromosome, chunksize=None):
 
     KwArgs:
         chunksize (int): number of rows to stream at a time, None for the entire file
+        columns (list): subset of columns to read, None for all columns
 
     Yields:
         pandas.DataFrame
@@ -288,7 +1458,155 @@ def read_allele_data(seqdata_filename, chromosome, chunksize=None):
 
     """
 
-    return read_seq_data(seqdata_filename, 'alleles', chromosome, chunksize=chunksize)
+    return read_seq_data(seqdata_filename, 'alleles', chromosome, chunksize=chunksize, columns=columns)
+
+
+def _create_summary_stats():
+    return {
+        'fragment_count': np.zeros((2, 256), dtype=np.int64),
+        'fragment_length_sum': np.zeros((2, 256), dtype=np.int64),
+        'fragment_length_sum_squares': np.zeros((2, 256), dtype=np.int64),
+        'fragment_length_histogram': np.zeros(0, dtype=np.int64),
+        'allele_count': np.zeros(2, dtype=np.int64),
+    }
+
+
+def _add_histograms(histogram_1, histogram_2):
+    histogram = np.zeros(max(len(histogram_1), len(histogram_2)), dtype=np.int64)
+    histogram[:len(histogram_1)] += histogram_1
+    histogram[:len(histogram_2)] += histogram_2
+    return histogram
+
+
+def _read_file_summary_stats(seqdata_filename, chromosome):
+    stats = _create_summary_stats()
+
+    with tables.open_file(seqdata_filename, 'r') as h5file:
+        if not _is_columnar(h5file):
+            return None
+
+        fragments_key = _get_key('fragments', chromosome)
+        if fragments_key in h5file:
+            group = h5file.get_node(fragments_key)
+            if 'fragment_count' not in group._v_attrs:
+                return None
+            for name in ('fragment_count', 'fragment_length_sum', 'fragment_length_sum_squares'):
+                stats[name] = getattr(group._v_attrs, name)
+            stats['fragment_length_histogram'] = group.fragment_length_histogram.read()
+
+        alleles_key = _get_key('alleles', chromosome)
+        if alleles_key in h5file:
+            group = h5file.get_node(alleles_key)
+            if 'allele_count' not in group._v_attrs:
+                return None
+            stats['allele_count'] = group._v_attrs.allele_count
+
+    return stats
+
+
+def read_summary_stats(seqdata_filename, chromosome):
+    """ Read summary statistics recorded when a HDF seqdata file was written.
+
+    Args:
+        seqdata_filename (str): name of seqdata file
+        chromosome (str): select specific chromosome
+
+    Returns:
+        dict: summary statistics, None if not recorded
+
+    Summary statistics are:
+        'fragment_count': fragment counts by duplicate flag and mapping quality
+        'fragment_length_sum': sum of fragment lengths by duplicate flag and mapping quality
+        'fragment_length_sum_squares': sum of squared fragment lengths by duplicate flag and mapping quality
+        'fragment_length_histogram': fragment counts by fragment length
+        'allele_count': counts of reference and alternate allele observations
+
+    Statistics by duplicate flag and mapping quality are 2 by 256 arrays indexed
+    by the duplicate flag then the mapping quality.
+
+    """
+
+    stats = _create_summary_stats()
+
+    for part_filename, _ in _get_seq_data_parts(seqdata_filename, chromosome):
+        part_stats = _read_file_summary_stats(part_filename, chromosome)
+
+        if part_stats is None:
+            return None
+
+        for name in ('fragment_count', 'fragment_length_sum', 'fragment_length_sum_squares', 'allele_count'):
+            stats[name] = stats[name] + part_stats[name]
+
+        stats['fragment_length_histogram'] = _add_histograms(
+            stats['fragment_length_histogram'], part_stats['fragment_length_histogram'])
+
+    return stats
+
+
+def read_fragment_length_moments(seqdata_filename, chromosome, filter_duplicates=False, map_qual_threshold=1):
+    """ Read moments of the fragment length distribution from recorded summary statistics.
+
+    Args:
+        seqdata_filename (str): name of seqdata file
+        chromosome (str): select specific chromosome
+
+    KwArgs:
+        filter_duplicates (bool): filter reads marked as duplicate
+        map_qual_threshold (int): filter reads with less than this mapping quality
+
+    Returns:
+        tuple: count, sum and sum of squares of fragment lengths, None if not recorded
+
+    """
+
+    stats = read_summary_stats(seqdata_filename, chromosome)
+
+    if stats is None:
+        return None
+
+    is_duplicate = slice(0, 1) if filter_duplicates else slice(0, 2)
+    mapping_quality = slice(map_qual_threshold, 256) if map_qual_threshold is not None else slice(0, 256)
+
+    return tuple([int(stats[name][is_duplicate, mapping_quality].sum()) for name in ('fragment_count', 'fragment_length_sum', 'fragment_length_sum_squares')])
+
+
+def _read_file_snp_counts(seqdata_filename, chromosome):
+    with tables.open_file(seqdata_filename, 'r') as h5file:
+        if not getattr(h5file.root._v_attrs, 'snp_counts_recorded', False):
+            return None
+
+        key = _get_key('snp_counts', chromosome)
+        if key not in h5file:
+            return _combine_snp_counts([])
+
+        return pd.DataFrame(dict([(column, h5file.get_node(key, column).read().astype(int)) for column, _ in snp_count_columns]))
+
+
+def read_snp_counts(seqdata_filename, chromosome):
+    """ Read counts of reads for each snp recorded in a HDF seqdata file.
+
+    Args:
+        seqdata_filename (str): name of seqdata file
+        chromosome (str): select specific chromosome
+
+    Returns:
+        pandas.DataFrame: read counts per snp, None if not recorded
+
+    Returned dataframe has columns 'position', 'ref_count', 'alt_count', sorted by position.
+
+    """
+
+    snp_counts = list()
+
+    for part_filename, _ in _get_seq_data_parts(seqdata_filename, chromosome):
+        part_snp_counts = _read_file_snp_counts(part_filename, chromosome)
+
+        if part_snp_counts is None:
+            return None
+
+        snp_counts.append(part_snp_counts)
+
+    return _combine_snp_counts(snp_counts)
 
 
 def read_chromosomes(seqdata_filename):
@@ -302,12 +1620,18 @@ def read_chromosomes(seqdata_filename):
 
     """
 
-    with pd.HDFStore(seqdata_filename, 'r') as store:
-        chromosomes = set()
-        for key in store.keys():
-            if 'chromosome_' in key:
-                chromosomes.add(key[key.index('chromosome_') + len('chromosome_'):])
+    if _get_seq_data_format(seqdata_filename) == manifest_format:
+        return set(_read_manifest(seqdata_filename)['chromosome'].values)
 
-        return chromosomes
+    chromosomes = set()
 
+    # Chromosome groups are named the same in columnar and pandas seqdata files
+    with tables.open_file(seqdata_filename, 'r') as h5file:
+        for record_type in ('fragments', 'alleles'):
+            if '/' + record_type not in h5file:
+                continue
+            for name in h5file.get_node('/' + record_type)._v_children:
+                if name.startswith('chromosome_'):
+                    chromosomes.add(name[len('chromosome_'):])
 
+    return chromosomes
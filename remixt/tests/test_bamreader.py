@@ -0,0 +1,559 @@
+import sys
+import os
+import struct
+import unittest
+import zlib
+import numpy as np
+import pandas as pd
+
+import remixt.bamreader
+import remixt.seqdataio
+import remixt.analysis.gcbias
+import remixt.analysis.readcount
+import remixt.analysis.stats
+
+np.random.seed(2014)
+
+
+bases = np.array(list('ACGT'))
+
+# Standard bgzf end of file marker block
+bgzf_eof = bytes.fromhex('1f8b08040000000000ff0600424302001b0003000000000000000000')
+
+# Maximum uncompressed bytes per bgzf block
+bgzf_block_size = 0xff00
+
+
+class BgzfWriter(object):
+    """ Minimal bgzf writer tracking virtual offsets for indexing
+    """
+
+    def __init__(self, filename):
+        self.file = open(filename, 'wb')
+        self.buffer = b''
+        self.block_offset = 0
+
+    def write(self, data):
+        self.buffer += data
+        while len(self.buffer) >= bgzf_block_size:
+            self._write_block(self.buffer[:bgzf_block_size])
+            self.buffer = self.buffer[bgzf_block_size:]
+
+    def tell(self):
+        return (self.block_offset << 16) | len(self.buffer)
+
+    def close(self):
+        if len(self.buffer) > 0:
+            self._write_block(self.buffer)
+        self.file.write(bgzf_eof)
+        self.file.close()
+
+    def _write_block(self, data):
+        compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -15)
+        compressed = compressor.compress(data) + compressor.flush()
+        block = (
+            struct.pack('<BBBBIBBHBBHH', 31, 139, 8, 4, 0, 0, 255, 6, 66, 67, 2, len(compressed) + 25) +
+            compressed + struct.pack('<II', zlib.crc32(data) & 0xffffffff, len(data)))
+        self.file.write(block)
+        self.block_offset += len(block)
+
+
+def reg2bin(beg, end):
+    """ Smallest bin of the bam binning scheme containing [beg, end)
+    """
+    end -= 1
+    for shift, offset in ((14, 4681), (17, 585), (20, 73), (23, 9), (26, 1)):
+        if beg >> shift == end >> shift:
+            return offset + (beg >> shift)
+    return 0
+
+
+def get_reference_length(cigar):
+    return sum([length for op, length in cigar if op in 'MDN=X'])
+
+
+def encode_read(read):
+    """ Encode a read as a bam record
+    """
+    name = read['name'].encode() + b'\0'
+    cigar = read['cigar']
+    seq = read['seq']
+
+    seq_codes = ['=ACMGRSVTWYHKDBN'.index(base) for base in seq]
+    if len(seq_codes) % 2 == 1:
+        seq_codes.append(0)
+    packed_seq = bytes([(a << 4) | b for a, b in zip(seq_codes[::2], seq_codes[1::2])])
+
+    packed_cigar = b''.join([struct.pack('<I', (length << 4) | 'MIDNSHP=X'.index(op)) for op, length in cigar])
+
+    end = read['position'] + max(get_reference_length(cigar), 1)
+
+    record = struct.pack(
+        '<iiBBHHHiiii',
+        read['ref_id'], read['position'], len(name), read['mapq'],
+        reg2bin(read['position'], end), len(cigar), read['flag'], len(seq),
+        read['ref_id'], read['mate_position'], read['insert_size'])
+    record += name + packed_cigar + packed_seq + b'\xff' * len(seq)
+
+    return struct.pack('<i', len(record)) + record
+
+
+def write_bam(bam_filename, references, reads):
+    """ Write a coordinate sorted bam and a minimal bai index
+
+    Args:
+        bam_filename (str): bam filename, the index is written to bam_filename + '.bai'
+        references (list): tuples of reference name and length
+        reads (list): reads as dicts, sorted by ref_id and position
+
+    The index has a single bin per reference holding one chunk spanning the
+    reference's reads, sufficient for region queries.
+
+    """
+
+    writer = BgzfWriter(bam_filename)
+
+    header = b'BAM\1' + struct.pack('<i', 0) + struct.pack('<i', len(references))
+    for name, length in references:
+        header += struct.pack('<i', len(name) + 1) + name.encode() + b'\0' + struct.pack('<i', length)
+    writer.write(header)
+
+    ref_offsets = dict()
+    for read in reads:
+        offset = writer.tell()
+        if read['ref_id'] not in ref_offsets:
+            ref_offsets[read['ref_id']] = [offset, offset]
+        writer.write(encode_read(read))
+        ref_offsets[read['ref_id']][1] = writer.tell()
+
+    writer.close()
+
+    with open(bam_filename + '.bai', 'wb') as index_file:
+        index_file.write(b'BAI\1' + struct.pack('<i', len(references)))
+        for ref_id, (name, length) in enumerate(references):
+            if ref_id not in ref_offsets:
+                index_file.write(struct.pack('<ii', 0, 0))
+                continue
+            begin, end = ref_offsets[ref_id]
+            num_intervals = (length >> 14) + 1
+            index_file.write(struct.pack('<iIiQQ', 1, 0, 1, begin, end))
+            index_file.write(struct.pack('<i', num_intervals) + struct.pack('<Q', begin) * num_intervals)
+
+
+def simulate_bam(bam_filename, snps_filename, chromosome_lengths, num_fragments, max_fragment_length=1000, read_length=100):
+    """ Simulate paired reads over random genomes with snps
+
+    Args:
+        bam_filename (str): bam to write, indexed
+        snps_filename (str): TSV chromosome, position, ref, alt file of snps to write
+        chromosome_lengths (list): tuples of chromosome and length
+        num_fragments (int): number of fragments per chromosome
+
+    KwArgs:
+        max_fragment_length (int): maximum length of concordant fragments
+        read_length (int): length of reads
+
+    Returns:
+        tuple: expected fragments and alleles tables
+
+    Expected fragments and alleles are those of valid concordant read pairs,
+    identified by chromosome, start and end rather than fragment id.  Reads pairs
+    include duplicates, low mapping quality, indels, soft clipped reads, discordant
+    pairs and reads with no mate.
+
+    """
+
+    reads = list()
+    snps = list()
+    expected_fragments = list()
+    expected_alleles = list()
+
+    for ref_id, (chromosome, chromosome_length) in enumerate(chromosome_lengths):
+        genome = bases[np.random.randint(4, size=chromosome_length)]
+
+        snp_positions = np.sort(np.random.choice(chromosome_length, size=chromosome_length // 50, replace=False))
+        snp_alts = bases[(np.searchsorted(bases, genome[snp_positions]) + np.random.randint(1, 4, size=len(snp_positions))) % 4]
+        snp_alt = dict(zip(snp_positions, snp_alts))
+        snps.append(pd.DataFrame({'chromosome': chromosome, 'position': snp_positions + 1, 'ref': genome[snp_positions], 'alt': snp_alts}))
+
+        def create_read(name, position, cigar, flag, mapq, mate_position, insert_size):
+            seq = list()
+            alleles = list()
+            ref_position = position
+            for op, length in cigar:
+                if op == 'M':
+                    for base_position in range(ref_position, ref_position + length):
+                        base = genome[base_position]
+                        if base_position in snp_alt:
+                            # Reference, alternate, or neither allele
+                            allele = np.random.choice(3, p=[0.45, 0.45, 0.1])
+                            if allele == 1:
+                                base = snp_alt[base_position]
+                            elif allele == 2:
+                                base = [a for a in bases if a not in (base, snp_alt[base_position])][0]
+                            if allele < 2:
+                                alleles.append((base_position + 1, allele))
+                        seq.append(base)
+                    ref_position += length
+                elif op == 'D':
+                    ref_position += length
+                elif op in 'IS':
+                    seq.extend(bases[np.random.randint(4, size=length)])
+            read = {
+                'name': name, 'ref_id': ref_id, 'position': position, 'cigar': cigar,
+                'seq': ''.join(seq), 'flag': flag, 'mapq': mapq,
+                'mate_position': mate_position, 'insert_size': insert_size,
+            }
+            return read, alleles
+
+        cigars = [
+            [('M', read_length)],
+            [('M', 40), ('D', 2), ('M', read_length - 40)],
+            [('M', 30), ('I', 3), ('M', read_length - 33)],
+            [('S', 5), ('M', read_length - 5)],
+            [('S', 20), ('M', read_length - 20)],
+        ]
+        cigar_probs = [0.8, 0.05, 0.05, 0.05, 0.05]
+
+        for idx in range(num_fragments):
+            name = 'read_{}_{}'.format(chromosome, idx)
+            start = np.random.randint(0, chromosome_length - 2 * max_fragment_length - 10000)
+            length = np.random.randint(2 * read_length, max_fragment_length)
+            mapq = np.random.randint(0, 61, size=2)
+            duplicate = 0x400 if np.random.random() < 0.05 else 0
+            cigar_1, cigar_2 = [cigars[a] for a in np.random.choice(len(cigars), size=2, p=cigar_probs)]
+            is_discordant = np.random.random() < 0.02
+            is_orphan = np.random.random() < 0.02
+
+            if is_discordant:
+                length += 5000
+                proper_flag = 0
+            else:
+                proper_flag = 0x2
+
+            position_1 = start
+            position_2 = start + length - get_reference_length(cigar_2)
+
+            read_1, alleles_1 = create_read(name, position_1, cigar_1, 0x1 | proper_flag | duplicate | 0x40, mapq[0], position_2, length)
+            read_2, alleles_2 = create_read(name, position_2, cigar_2, 0x1 | proper_flag | duplicate | 0x80, mapq[1], position_1, -length)
+
+            reads.append(read_1)
+            if not is_orphan:
+                reads.append(read_2)
+
+            is_clipped = any([op == 'S' and op_length > 8 for op, op_length in cigar_1 + cigar_2])
+            if is_discordant or is_orphan or is_clipped:
+                continue
+
+            expected_fragments.append((chromosome, start, start + length, mapq.min(), int(duplicate > 0)))
+            for position, is_alt in alleles_1 + alleles_2:
+                expected_alleles.append((chromosome, start, start + length, position, is_alt))
+
+    reads.sort(key=lambda read: (read['ref_id'], read['position']))
+
+    write_bam(bam_filename, [(chromosome, length) for chromosome, length in chromosome_lengths], reads)
+
+    snps = pd.concat(snps, ignore_index=True)
+    snps.to_csv(snps_filename, sep='\t', index=False, header=False, columns=['chromosome', 'position', 'ref', 'alt'])
+
+    fragments = pd.DataFrame(expected_fragments, columns=['chromosome', 'start', 'end', 'mapping_quality', 'is_duplicate'])
+    alleles = pd.DataFrame(expected_alleles, columns=['chromosome', 'start', 'end', 'position', 'is_alt'])
+
+    return fragments, alleles
+
+
+def read_all_batches(reader, max_alignments):
+    """ Read fragments and alleles from an allele reader, with alleles labelled by fragment start and end
+    """
+
+    fragments = list()
+    alleles = list()
+    while reader.ReadAlignments(max_alignments):
+        chromosome = reader.GetChromosome()
+        fragments.append(reader.GetFragmentTable().assign(chromosome=chromosome))
+        alleles.append(reader.GetAlleleTable().assign(chromosome=chromosome))
+
+    fragments = pd.concat(fragments, ignore_index=True)
+    alleles = pd.concat(alleles, ignore_index=True)
+
+    alleles = alleles.merge(fragments[['chromosome', 'fragment_id', 'start', 'end']], on=['chromosome', 'fragment_id'])
+
+    return fragments, alleles
+
+
+def sort_table(data, columns):
+    data = data[columns].astype(dict([(column, int) for column in columns if column != 'chromosome']))
+    return data.sort_values(columns).reset_index(drop=True)
+
+
+fragment_columns = ['chromosome', 'start', 'end', 'mapping_quality', 'is_duplicate']
+allele_columns = ['chromosome', 'start', 'end', 'position', 'is_alt']
+
+
+class bamreader_unittest(unittest.TestCase):
+
+    def setUp(self):
+        self.bam_filename = './test_bamreader.bam'
+        self.snps_filename = './test_bamreader.snps.tsv'
+        self.max_fragment_length = 1000
+        self.max_soft_clipped = 8
+
+        self.chromosome_lengths = [('1', 200000), ('2', 100000)]
+        self.fragments, self.alleles = simulate_bam(
+            self.bam_filename, self.snps_filename, self.chromosome_lengths, 5000,
+            max_fragment_length=self.max_fragment_length)
+
+    def tearDown(self):
+        for filename in os.listdir('.'):
+            if filename.startswith('test_bamreader.'):
+                os.remove(filename)
+
+    def create_reader(self, chromosome, **kwargs):
+        return remixt.bamreader.AlleleReader(
+            self.bam_filename, self.snps_filename, chromosome,
+            self.max_fragment_length, self.max_soft_clipped, True, **kwargs)
+
+    def assert_extracted(self, fragments, alleles, expected_fragments, expected_alleles):
+        self.assertTrue(sort_table(fragments, fragment_columns).equals(sort_table(expected_fragments, fragment_columns)))
+        self.assertTrue(sort_table(alleles, allele_columns).equals(sort_table(expected_alleles, allele_columns)))
+
+        # Fragment ids unique and consecutive per chromosome
+        for chromosome, chrom_fragments in fragments.groupby('chromosome'):
+            self.assertTrue(np.array_equal(np.sort(chrom_fragments['fragment_id'].values), np.arange(len(chrom_fragments.index))))
+
+    def test_read_chromosomes(self):
+
+        for snp_targeted in (True, False):
+            fragments = list()
+            alleles = list()
+
+            for chromosome, _ in self.chromosome_lengths:
+                reader = self.create_reader(chromosome, snp_targeted=snp_targeted)
+                chrom_fragments, chrom_alleles = read_all_batches(reader, 1000)
+                fragments.append(chrom_fragments)
+                alleles.append(chrom_alleles)
+
+            fragments = pd.concat(fragments, ignore_index=True)
+            alleles = pd.concat(alleles, ignore_index=True)
+
+            self.assert_extracted(fragments, alleles, self.fragments, self.alleles)
+
+    def test_read_all_chromosomes(self):
+
+        reader = self.create_reader(None)
+        fragments, alleles = read_all_batches(reader, 1000)
+
+        self.assert_extracted(fragments, alleles, self.fragments, self.alleles)
+
+    def test_read_regions(self):
+
+        regions = remixt.seqdataio.create_regions(dict(self.chromosome_lengths), 30000)
+
+        fragments = list()
+        alleles = list()
+
+        for region in regions.values():
+            reader = self.create_reader(region.chromosome, start=region.start, end=region.end)
+            region_fragments, region_alleles = read_all_batches(reader, 1000)
+
+            fragments.append(region_fragments)
+            alleles.append(region_alleles)
+
+        fragments = pd.concat(fragments, ignore_index=True)
+        alleles = pd.concat(alleles, ignore_index=True)
+
+        self.assertTrue(sort_table(fragments, fragment_columns).equals(sort_table(self.fragments, fragment_columns)))
+        self.assertTrue(sort_table(alleles, allele_columns).equals(sort_table(self.alleles, allele_columns)))
+
+    def test_read_small_batches(self):
+
+        # Batches of a few alignments include empty batches, for instance
+        # of discordant reads, before all alignments are read
+        reader = self.create_reader(None)
+        num_empty = 0
+        fragments = list()
+        while reader.ReadAlignments(10):
+            batch_fragments = reader.GetFragmentTable()
+            batch_alleles = reader.GetAlleleTable()
+            if len(batch_fragments.index) == 0 and len(batch_alleles.index) == 0:
+                num_empty += 1
+            fragments.append(batch_fragments.assign(chromosome=reader.GetChromosome()))
+        fragments = pd.concat(fragments, ignore_index=True)
+
+        self.assertGreater(num_empty, 0)
+        self.assertTrue(sort_table(fragments, fragment_columns).equals(sort_table(self.fragments, fragment_columns)))
+
+        # Empty batches are not yielded as seqdata batches
+        class SmallBatchReader(object):
+            def __init__(self, reader):
+                self.reader = reader
+            def ReadAlignments(self, max_alignments):
+                return self.reader.ReadAlignments(10)
+            def __getattr__(self, name):
+                return getattr(self.reader, name)
+
+        reader = SmallBatchReader(self.create_reader(None))
+        fragments = list()
+        alleles = list()
+        for chromosome, batch_fragments, batch_alleles in remixt.seqdataio._read_batches(reader, max_memory=1.):
+            self.assertTrue(len(batch_fragments.index) > 0 or len(batch_alleles.index) > 0)
+            fragments.append(batch_fragments.assign(chromosome=chromosome))
+            alleles.append(batch_alleles.assign(chromosome=chromosome))
+        fragments = pd.concat(fragments, ignore_index=True)
+        alleles = pd.concat(alleles, ignore_index=True)
+        alleles = alleles.merge(fragments[['chromosome', 'fragment_id', 'start', 'end']], on=['chromosome', 'fragment_id'])
+
+        self.assert_extracted(fragments, alleles, self.fragments, self.alleles)
+
+    def test_read_threads(self):
+
+        for prefetch_alignments in (7, 40000):
+            reader = self.create_reader(None, threads=2, prefetch_alignments=prefetch_alignments)
+            fragments, alleles = read_all_batches(reader, 1000)
+
+            self.assert_extracted(fragments, alleles, self.fragments, self.alleles)
+
+    def test_table_memory(self):
+
+        reader = self.create_reader(None)
+        self.assertTrue(reader.ReadAlignments(10000))
+
+        # Allocated memory includes unused capacity of the arrays taken by numpy
+        table_memory = reader.GetTableMemory()
+        fragments = reader.GetFragmentTable()
+        alleles = reader.GetAlleleTable()
+        table_bytes = sum([table.memory_usage(index=False).sum() for table in (fragments, alleles)])
+
+        self.assertGreater(len(fragments.index), 0)
+        self.assertGreaterEqual(table_memory, table_bytes)
+        self.assertEqual(reader.GetTableMemory(), 0)
+
+    def test_max_buffered_reads(self):
+
+        reader = self.create_reader(None, max_buffered_reads=10)
+        fragments, alleles = read_all_batches(reader, 1000)
+
+        # Reads beyond the maximum buffered are discarded and counted, the
+        # fragments extracted are a subset of the expected fragments
+        self.assertGreater(reader.GetNumDiscardedReads(), 0)
+        fragments = sort_table(fragments, fragment_columns)
+        expected_fragments = sort_table(self.fragments, fragment_columns)
+        self.assertGreater(len(fragments.index), 0)
+        self.assertLess(len(fragments.index), len(expected_fragments.index))
+        self.assertEqual(len(fragments.merge(expected_fragments.drop_duplicates()).index), len(fragments.index))
+
+        alleles = sort_table(alleles, allele_columns)
+        expected_alleles = sort_table(self.alleles, allele_columns)
+        self.assertEqual(len(alleles.merge(expected_alleles.drop_duplicates()).index), len(alleles.index))
+
+        # Extraction fails rather than silently discarding reads
+        seqdata_filename = './test_bamreader.seqdata'
+        with self.assertRaises(ValueError):
+            remixt.seqdataio.create_chromosome_seqdata(
+                seqdata_filename, self.bam_filename, self.snps_filename, '1',
+                self.max_fragment_length, self.max_soft_clipped, True,
+                max_buffered_reads=10)
+        with self.assertRaises(ValueError):
+            remixt.seqdataio.create_seqdata(
+                seqdata_filename, self.bam_filename, self.snps_filename,
+                self.max_fragment_length, self.max_soft_clipped, True,
+                None, ['1', '2'], max_buffered_reads=10)
+
+    def test_count_bam_regions(self):
+
+        segments_filename = './test_bamreader.segments.tsv'
+        haps_filename = './test_bamreader.haps.tsv'
+        het_snps_filename = './test_bamreader.het_snps.tsv'
+        gc_positions_filename = './test_bamreader.gc_positions.tsv'
+        seqdata_filename = './test_bamreader.seqdata'
+
+        # Adjacent segments, with a gap where a segment is removed
+        segments = list()
+        for chromosome, chromosome_length in self.chromosome_lengths:
+            breakpoints = np.unique(np.concatenate([[0, chromosome_length], np.random.randint(0, chromosome_length, size=8)]))
+            chrom_segments = pd.DataFrame({'chromosome': chromosome, 'start': breakpoints[:-1], 'end': breakpoints[1:]})
+            segments.append(chrom_segments.drop(chrom_segments.index[np.random.randint(len(chrom_segments.index))]))
+        segments = pd.concat(segments, ignore_index=True)
+        segments.to_csv(segments_filename, sep='\t', index=False)
+
+        # Heterozygous snps in haplotype blocks, many reads have multiple
+        # alleles so the allele counted for each read matters
+        snps = pd.read_csv(self.snps_filename, sep='\t', header=None, names=['chromosome', 'position', 'ref', 'alt'], converters={'chromosome': str})
+        haps = snps.sample(frac=0.5).sort_values(['chromosome', 'position'])[['chromosome', 'position']]
+        haps['hap_label'] = haps['position'] // 20000
+        haps['allele'] = np.random.randint(0, 2, size=len(haps.index))
+        haps = pd.concat([haps.assign(allele_id=0), haps.assign(allele=1 - haps['allele'], allele_id=1)])
+        haps = haps.sort_values(['chromosome', 'position', 'allele_id'])
+        haps.to_csv(haps_filename, sep='\t', index=False, columns=['chromosome', 'position', 'allele', 'hap_label', 'allele_id'])
+
+        # Sampled positions including fragment starts
+        gc_positions = pd.concat([
+            self.fragments[['chromosome', 'start']].sample(200).rename(columns={'start': 'position'}),
+            pd.DataFrame({'chromosome': '1', 'position': np.random.randint(0, 200000, size=200)}),
+        ])
+        gc_positions = gc_positions.drop_duplicates().sort_values(['chromosome', 'position']).reset_index(drop=True)
+        gc_positions.to_csv(gc_positions_filename, sep='\t', index=False)
+
+        remixt.analysis.readcount.write_het_snps(het_snps_filename, self.snps_filename, haps_filename)
+
+        regions = remixt.seqdataio.create_regions(dict(self.chromosome_lengths), 30000)
+
+        for snp_targeted in (True, False):
+            config = {
+                'filter_duplicates': True,
+                'map_qual_threshold': 1,
+                'bam_max_fragment_length': self.max_fragment_length,
+                'bam_max_soft_clipped': self.max_soft_clipped,
+                'bam_check_proper_pair': True,
+                'bam_snp_targeted': snp_targeted,
+                'bam_extract_threads': 1,
+            }
+
+            # Counts from seqdata
+            remixt.seqdataio.create_seqdata(
+                seqdata_filename, self.bam_filename, self.snps_filename,
+                self.max_fragment_length, self.max_soft_clipped, True,
+                None, [chromosome for chromosome, _ in self.chromosome_lengths],
+                snp_targeted=snp_targeted)
+
+            remixt.analysis.readcount.segment_readcount('./test_bamreader.segment_counts.tsv', segments_filename, seqdata_filename, config)
+            remixt.analysis.readcount.haplotype_allele_readcount('./test_bamreader.allele_counts.tsv', segments_filename, seqdata_filename, haps_filename, config)
+            gc_counts = gc_positions.assign(read_count=remixt.analysis.gcbias.count_fragment_starts(seqdata_filename, gc_positions, config))
+            fragment_stats = remixt.analysis.stats.calculate_fragment_stats(seqdata_filename, config)
+
+            # Counts directly from the bam, by region
+            region_counts_filenames = dict()
+            for region_id, region in regions.items():
+                region_counts_filenames[region_id] = './test_bamreader.region_{}.pickle'.format(region_id)
+                remixt.analysis.readcount.count_bam_region(
+                    region_counts_filenames[region_id], self.bam_filename, het_snps_filename,
+                    segments_filename, gc_positions_filename, region.chromosome, config,
+                    start=region.start, end=region.end)
+
+            bam_fragment_stats = remixt.analysis.readcount.merge_bam_region_counts(
+                './test_bamreader.bam_segment_counts.tsv', './test_bamreader.bam_allele_counts.tsv',
+                './test_bamreader.bam_gc_counts.tsv', region_counts_filenames, segments_filename, haps_filename)
+
+            segment_counts = pd.read_csv('./test_bamreader.segment_counts.tsv', sep='\t', converters={'chromosome': str})
+            bam_segment_counts = pd.read_csv('./test_bamreader.bam_segment_counts.tsv', sep='\t', converters={'chromosome': str})
+            self.assertGreater(segment_counts['readcount'].sum(), 0)
+            self.assertTrue(segment_counts.equals(bam_segment_counts))
+
+            allele_columns = ['chromosome', 'start', 'end', 'hap_label', 'allele_id', 'readcount']
+            allele_counts = pd.read_csv('./test_bamreader.allele_counts.tsv', sep='\t', converters={'chromosome': str})
+            bam_allele_counts = pd.read_csv('./test_bamreader.bam_allele_counts.tsv', sep='\t', converters={'chromosome': str})
+            allele_counts = allele_counts[allele_columns].sort_values(allele_columns).reset_index(drop=True)
+            bam_allele_counts = bam_allele_counts[allele_columns].sort_values(allele_columns).reset_index(drop=True)
+            self.assertGreater(allele_counts['readcount'].sum(), 0)
+            self.assertTrue(allele_counts.equals(bam_allele_counts))
+
+            bam_gc_counts = pd.read_csv('./test_bamreader.bam_gc_counts.tsv', sep='\t', converters={'chromosome': str})
+            bam_gc_counts = gc_positions.merge(bam_gc_counts, how='left').fillna(0)
+            self.assertGreater(gc_counts['read_count'].sum(), 0)
+            self.assertTrue(np.array_equal(gc_counts['read_count'].values, bam_gc_counts['read_count'].values))
+
+            self.assertTrue(np.allclose(fragment_stats, bam_fragment_stats))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,371 @@
+import sys
+import os
+import unittest
+import numpy as np
+import pandas as pd
+
+import remixt.segalg
+import remixt.seqdataio
+import remixt.analysis.gcbias
+import remixt.analysis.haplotype
+import remixt.analysis.readcount
+import remixt.analysis.segment
+import remixt.analysis.stats
+
+np.random.seed(2014)
+
+
+def create_random_seqdata(chromosome_lengths, num_reads, snp_positions):
+    """ Create random fragments and alleles at snp positions overlapped by each fragment
+    """
+
+    seqdata = dict()
+
+    for chromosome, chromosome_length in chromosome_lengths.items():
+        fragments = pd.DataFrame({
+            'fragment_id': np.arange(num_reads),
+            'start': np.sort(np.random.randint(0, chromosome_length - 1000, size=num_reads)),
+        })
+        fragments['end'] = fragments['start'] + np.random.randint(100, 600, size=num_reads)
+        fragments['mapping_quality'] = np.random.randint(0, 61, size=num_reads)
+        fragments['is_duplicate'] = (np.random.random(size=num_reads) < 0.05).astype(int)
+
+        # Snps in each fragment, in random order within each fragment
+        positions = snp_positions[chromosome]
+        snp_starts = np.searchsorted(positions, fragments['start'].values)
+        snp_ends = np.searchsorted(positions, fragments['end'].values)
+        num_snps = snp_ends - snp_starts
+        fragment_idx = np.repeat(np.arange(num_reads), num_snps)
+        snp_idx = np.arange(num_snps.sum()) - np.repeat(np.cumsum(num_snps) - num_snps, num_snps) + np.repeat(snp_starts, num_snps)
+        alleles = pd.DataFrame({
+            'fragment_id': fragment_idx,
+            'position': positions[snp_idx],
+            'is_alt': np.random.randint(0, 2, size=len(snp_idx)),
+            'order': np.random.random(size=len(snp_idx)),
+        })
+        alleles = alleles.sort_values(['fragment_id', 'order'])[['fragment_id', 'position', 'is_alt']].reset_index(drop=True)
+
+        seqdata[chromosome] = (fragments, alleles)
+
+    return seqdata
+
+
+def write_seqdata(seqdata_filename, seqdata, chunk_size=10000, shuffle_alleles=False):
+    """ Write fragments and alleles in chunks, optionally shuffling alleles of
+    different fragments within each chunk
+    """
+
+    with remixt.seqdataio.Writer(seqdata_filename) as writer:
+        for chromosome, (fragments, alleles) in seqdata.items():
+            for chunk_start in range(0, len(fragments.index), chunk_size):
+                chunk_end = chunk_start + chunk_size
+                chunk_alleles = alleles[(alleles['fragment_id'] >= chunk_start) & (alleles['fragment_id'] < chunk_end)]
+
+                if shuffle_alleles:
+                    fragment_order = np.random.permutation(chunk_size)[chunk_alleles['fragment_id'].values - chunk_start]
+                    chunk_alleles = chunk_alleles.iloc[np.argsort(fragment_order, kind='stable')]
+
+                writer.write(chromosome, fragments.iloc[chunk_start:chunk_end], chunk_alleles)
+
+
+def count_allele_reads_unopt(fragments, alleles, haps, segments, filter_duplicates, map_qual_threshold):
+    """ Count reads for each haplotype block allele by merging tables in memory
+    """
+
+    reads = fragments
+    if filter_duplicates:
+        reads = reads[reads['is_duplicate'] == 0]
+    reads = reads[reads['mapping_quality'] >= map_qual_threshold]
+
+    # First haplotype block allele of each read
+    alleles = alleles.merge(haps, left_on=['position', 'is_alt'], right_on=['position', 'allele'])
+    alleles = alleles.merge(reads[['fragment_id', 'start', 'end']], on='fragment_id')
+    alleles = alleles.drop_duplicates('fragment_id')
+
+    segments = segments.sort_values('start').reset_index(drop=True)
+    segment_idx = remixt.segalg.find_contained_segments(segments[['start', 'end']].values, alleles[['start', 'end']].values)
+    alleles = alleles.assign(start=segments['start'].values[segment_idx], end=segments['end'].values[segment_idx])[segment_idx >= 0]
+
+    return alleles.groupby(['start', 'end', 'hap_label', 'allele_id']).size().rename('readcount').reset_index()
+
+
+def count_segment_reads_unopt(fragments, segments, filter_duplicates, map_qual_threshold):
+    """ Count reads contained in segments from all reads in memory
+    """
+
+    reads = fragments
+    if filter_duplicates:
+        reads = reads[reads['is_duplicate'] == 0]
+    reads = reads[reads['mapping_quality'] >= map_qual_threshold]
+
+    reads = reads.sort_values('start')
+    segments = segments.sort_values('start')
+
+    segments['readcount'] = remixt.segalg.contained_counts(
+        segments[['start', 'end']].values,
+        reads[['start', 'end']].values,
+    )
+
+    return segments.sort_index()
+
+
+class readcount_unittest(unittest.TestCase):
+
+    def setUp(self):
+
+        self.seqdata_filename = './test_readcount.seqdata'
+        self.segment_filename = './test_readcount.segments.tsv'
+        self.haps_filename = './test_readcount.haps.tsv'
+        self.gc_positions_filename = './test_readcount.gc_positions.tsv'
+        self.output_filenames = dict([(name, './test_readcount.{}.tsv'.format(name)) for name in ('segment_counts', 'allele_counts', 'gc_counts')])
+
+        chromosome_lengths = {'1': 200000, '2': 100000}
+
+        snp_positions = dict()
+        haps = list()
+        for chromosome, chromosome_length in chromosome_lengths.items():
+            snp_positions[chromosome] = np.unique(np.random.randint(0, chromosome_length, size=chromosome_length // 200))
+
+            # Het snps are a subset of snps, both alleles in blocks of 20 snps
+            het_positions = np.sort(np.random.choice(snp_positions[chromosome], size=len(snp_positions[chromosome]) // 2, replace=False))
+            for allele in (0, 1):
+                haps.append(pd.DataFrame({
+                    'chromosome': chromosome,
+                    'position': het_positions,
+                    'allele': allele,
+                    'hap_label': np.arange(len(het_positions)) // 20,
+                    'allele_id': (np.random.random(size=len(het_positions)) < 0.5).astype(int) ^ allele,
+                }))
+        haps = pd.concat(haps, ignore_index=True)
+        haps.to_csv(self.haps_filename, sep='\t', index=False)
+
+        self.seqdata = create_random_seqdata(chromosome_lengths, 20000, snp_positions)
+        write_seqdata(self.seqdata_filename, self.seqdata)
+
+        # Shuffled segments, including a segment on a chromosome with no seqdata
+        segments = list()
+        for chromosome, chromosome_length in chromosome_lengths.items():
+            boundaries = np.unique(np.concatenate([[0, chromosome_length], np.random.randint(0, chromosome_length, size=20)]))
+            segments.append(pd.DataFrame({'chromosome': chromosome, 'start': boundaries[:-1], 'end': boundaries[1:]}))
+        segments.append(pd.DataFrame({'chromosome': ['3'], 'start': [0], 'end': [1000]}))
+        segments = pd.concat(segments, ignore_index=True).sample(frac=1).reset_index(drop=True)
+        segments.to_csv(self.segment_filename, sep='\t', index=False)
+
+        # Sampled positions including duplicate positions and fragment starts
+        fragment_starts = remixt.seqdataio.read_fragment_data(self.seqdata_filename, '1')['start'].values
+        self.gc_positions = pd.DataFrame({
+            'chromosome': ['1'] * 300 + ['2'] * 100 + ['3'] * 10,
+            'position': np.concatenate([
+                np.random.choice(fragment_starts, size=200),
+                np.random.randint(0, 200000, size=100),
+                np.random.randint(0, 100000, size=100),
+                np.random.randint(0, 1000, size=10),
+            ]),
+        })
+        self.gc_positions.to_csv(self.gc_positions_filename, sep='\t', index=False)
+
+    def tearDown(self):
+
+        for filename in [self.seqdata_filename, self.segment_filename, self.haps_filename, self.gc_positions_filename] + list(self.output_filenames.values()):
+            if os.path.exists(filename):
+                os.remove(filename)
+
+    def test_count_seqdata(self):
+
+        segments = pd.read_csv(self.segment_filename, sep='\t', converters={'chromosome': str})
+
+        for filter_duplicates, map_qual_threshold in ((False, 1), (True, 30)):
+            config = {'filter_duplicates': filter_duplicates, 'map_qual_threshold': map_qual_threshold}
+
+            fragment_stats = remixt.analysis.readcount.count_seqdata(
+                self.output_filenames['segment_counts'],
+                self.output_filenames['allele_counts'],
+                self.output_filenames['gc_counts'],
+                self.seqdata_filename,
+                self.segment_filename,
+                self.haps_filename,
+                self.gc_positions_filename,
+                config)
+
+            segment_counts = pd.read_csv(self.output_filenames['segment_counts'], sep='\t', converters={'chromosome': str})
+            allele_counts = pd.read_csv(self.output_filenames['allele_counts'], sep='\t', converters={'chromosome': str})
+            gc_counts = pd.read_csv(self.output_filenames['gc_counts'], sep='\t', converters={'chromosome': str})
+
+            expected_segment_counts = remixt.analysis.segment.create_segment_counts(
+                segments, self.seqdata_filename,
+                filter_duplicates=filter_duplicates, map_qual_threshold=map_qual_threshold)
+
+            expected_allele_counts = remixt.analysis.haplotype.create_allele_counts(
+                segments, self.seqdata_filename, self.haps_filename,
+                filter_duplicates=filter_duplicates, map_qual_threshold=map_qual_threshold)
+
+            expected_gc_counts = remixt.analysis.gcbias.count_fragment_starts(
+                self.seqdata_filename, self.gc_positions, config)
+
+            expected_fragment_stats = remixt.analysis.stats.calculate_fragment_stats(self.seqdata_filename, config)
+
+            self.assertTrue(segment_counts['readcount'].sum() > 0)
+            self.assertTrue(np.all(segment_counts.values == expected_segment_counts.values))
+
+            self.assertTrue(allele_counts['readcount'].sum() > 0)
+            self.assertEqual(allele_counts.values.shape, expected_allele_counts.values.shape)
+            self.assertTrue(np.all(allele_counts.values == expected_allele_counts.values))
+
+            self.assertTrue(gc_counts['read_count'].sum() > 0)
+            self.assertTrue(np.all(gc_counts[['chromosome', 'position']].values == self.gc_positions.values))
+            self.assertTrue(np.all(gc_counts['read_count'].values == expected_gc_counts))
+
+            np.testing.assert_almost_equal(fragment_stats, expected_fragment_stats)
+
+    def test_fragment_stats_from_moments(self):
+
+        lengths = np.random.randint(100, 600, size=1000)
+
+        fragment_stats = remixt.analysis.stats.calculate_fragment_stats_from_moments(
+            len(lengths), lengths.sum(), (lengths * lengths).sum())
+
+        np.testing.assert_almost_equal(fragment_stats, (lengths.mean(), lengths.std()))
+
+        with self.assertRaises(ValueError):
+            remixt.analysis.stats.calculate_fragment_stats_from_moments(0, 0, 0)
+
+    def test_count_allele_reads(self):
+
+        shuffled_seqdata_filename = './test_readcount.shuffled.seqdata'
+        unsorted_seqdata_filename = './test_readcount.unsorted.seqdata'
+
+        write_seqdata(shuffled_seqdata_filename, self.seqdata, shuffle_alleles=True)
+
+        # Alleles of the second half of the fragments written first
+        with remixt.seqdataio.Writer(unsorted_seqdata_filename) as writer:
+            for chromosome, (fragments, alleles) in self.seqdata.items():
+                is_second_half = alleles['fragment_id'] >= len(fragments.index) // 2
+                writer.write(chromosome, fragments, alleles[is_second_half])
+                writer.write(chromosome, fragments.iloc[0:0], alleles[~is_second_half])
+
+        haps = pd.read_csv(self.haps_filename, sep='\t', converters={'chromosome': str})
+        segments = pd.read_csv(self.segment_filename, sep='\t', converters={'chromosome': str})
+
+        for chromosome, (fragments, alleles) in self.seqdata.items():
+
+            # Alleles sorted by fragment id, retaining the order of alleles of each fragment
+            alleles_test = remixt.seqdataio.read_allele_data(shuffled_seqdata_filename, chromosome)
+
+            self.assertTrue(np.all(alleles.values == alleles_test[['fragment_id', 'position', 'is_alt']].values))
+
+            self.assertTrue(remixt.seqdataio.read_fragment_id_sorted(shuffled_seqdata_filename, 'alleles', chromosome))
+            self.assertFalse(remixt.seqdataio.read_fragment_id_sorted(unsorted_seqdata_filename, 'alleles', chromosome))
+
+            # First alleles selected per chunk if sorted, otherwise across chunks
+            first_alleles = remixt.analysis.haplotype.read_first_hap_alleles(self.seqdata_filename, haps, chromosome)
+            for seqdata_filename in (shuffled_seqdata_filename, unsorted_seqdata_filename):
+                first_alleles_test = remixt.analysis.haplotype.read_first_hap_alleles(seqdata_filename, haps, chromosome, chunksize=997)
+                self.assertTrue(np.all(first_alleles.values == first_alleles_test.values))
+
+            chrom_haps = haps[haps['chromosome'] == chromosome]
+            chrom_segments = segments[segments['chromosome'] == chromosome]
+
+            for filter_duplicates, map_qual_threshold in ((False, 1), (True, 30)):
+                expected = count_allele_reads_unopt(fragments, alleles, chrom_haps, chrom_segments, filter_duplicates, map_qual_threshold)
+
+                self.assertTrue(expected['readcount'].sum() > 0)
+
+                for seqdata_filename in (self.seqdata_filename, shuffled_seqdata_filename, unsorted_seqdata_filename):
+                    allele_counts = remixt.analysis.haplotype.count_allele_reads(
+                        seqdata_filename, haps, chromosome, chrom_segments,
+                        filter_duplicates=filter_duplicates, map_qual_threshold=map_qual_threshold)
+
+                    allele_counts = allele_counts.sort_values(['start', 'end', 'hap_label', 'allele_id'])
+                    allele_counts = allele_counts[['start', 'end', 'hap_label', 'allele_id', 'readcount']]
+
+                    self.assertEqual(expected.values.shape, allele_counts.values.shape)
+                    self.assertTrue(np.all(expected.values == allele_counts.values))
+
+        os.remove(shuffled_seqdata_filename)
+        os.remove(unsorted_seqdata_filename)
+
+    def test_count_segment_reads(self):
+
+        segments = pd.read_csv(self.segment_filename, sep='\t', converters={'chromosome': str})
+
+        for chromosome, (fragments, alleles) in self.seqdata.items():
+            chrom_segments = segments[segments['chromosome'] == chromosome]
+
+            for filter_duplicates, map_qual_threshold in ((False, 1), (True, 30)):
+                expected = count_segment_reads_unopt(fragments, chrom_segments.copy(), filter_duplicates, map_qual_threshold)
+
+                self.assertTrue(expected['readcount'].sum() > 0)
+
+                for chunksize in (1000000, 997):
+                    segment_counts = remixt.analysis.segment.count_segment_reads(
+                        self.seqdata_filename, chromosome, chrom_segments.copy(),
+                        filter_duplicates=filter_duplicates, map_qual_threshold=map_qual_threshold,
+                        chunksize=chunksize)
+
+                    self.assertTrue(np.all(expected.values == segment_counts.values))
+
+    def test_create_multiple_segment_counts(self):
+
+        segments = pd.read_csv(self.segment_filename, sep='\t', converters={'chromosome': str})
+
+        seqdata_filenames = {
+            'tumour_1': self.seqdata_filename,
+            'tumour_2': './test_readcount.tumour_2.seqdata',
+        }
+
+        write_seqdata(
+            seqdata_filenames['tumour_2'],
+            create_random_seqdata({'1': 200000, '2': 100000}, 10000, {'1': np.array([100]), '2': np.array([100])}),
+            chunk_size=3001)
+
+        bin_counts_filenames = dict()
+        for sample_id, seqdata_filename in seqdata_filenames.items():
+            bin_counts_filenames[sample_id] = seqdata_filename + '.bin_counts'
+            remixt.analysis.segment.create_bin_counts(
+                bin_counts_filenames[sample_id], seqdata_filename,
+                bin_size=1000, filter_duplicates=True, map_qual_threshold=30)
+
+        for filter_duplicates, map_qual_threshold, sample_bin_counts_filenames in ((False, 1, None), (True, 30, None), (True, 30, bin_counts_filenames)):
+            for processes in (1, 2):
+                segment_counts = remixt.analysis.segment.create_multiple_segment_counts(
+                    segments, seqdata_filenames,
+                    filter_duplicates=filter_duplicates, map_qual_threshold=map_qual_threshold,
+                    bin_counts_filenames=sample_bin_counts_filenames,
+                    processes=processes, chunksize=997)
+
+                self.assertEqual(set(segment_counts.keys()), set(seqdata_filenames.keys()))
+
+                for sample_id, seqdata_filename in seqdata_filenames.items():
+                    expected = remixt.analysis.segment.create_segment_counts(
+                        segments, seqdata_filename,
+                        filter_duplicates=filter_duplicates, map_qual_threshold=map_qual_threshold)
+
+                    self.assertTrue(expected['readcount'].sum() > 0)
+                    self.assertTrue(np.all(expected.columns == segment_counts[sample_id].columns))
+                    self.assertTrue(np.all(expected.values == segment_counts[sample_id].values))
+
+        # Read windows separately regardless of the blocks they span
+        sparse_read_fraction = remixt.analysis.segment.sparse_read_fraction
+        remixt.analysis.segment.sparse_read_fraction = 2.
+        try:
+            segment_counts = remixt.analysis.segment.create_multiple_segment_counts(
+                segments, seqdata_filenames,
+                filter_duplicates=True, map_qual_threshold=30,
+                bin_counts_filenames=bin_counts_filenames,
+                processes=1, chunksize=997)
+        finally:
+            remixt.analysis.segment.sparse_read_fraction = sparse_read_fraction
+
+        for sample_id, seqdata_filename in seqdata_filenames.items():
+            expected = remixt.analysis.segment.create_segment_counts(
+                segments, seqdata_filename,
+                filter_duplicates=True, map_qual_threshold=30)
+
+            self.assertTrue(np.all(expected.values == segment_counts[sample_id].values))
+
+        for filename in [seqdata_filenames['tumour_2']] + list(bin_counts_filenames.values()):
+            os.remove(filename)
+
+
+if __name__ == '__main__':
+    unittest.main()
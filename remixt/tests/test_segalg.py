@@ -81,6 +81,22 @@ class segalg_unittest(unittest.TestCase):
         self.assertTrue(np.all(unopt_result == opt_result))
 
 
+    def test_union_intervals_opt(self):
+
+        X = self.random_overlapping(n=100, l=10)
+        X[:, 1] = X[:, 0] + np.random.randint(0, 20, size=100)
+        Y = self.random_positions()
+
+        unopt_result = segalg.union_intervals_unopt(X)
+        opt_result = segalg.union_intervals(X)
+
+        self.assertTrue(np.all(unopt_result == opt_result))
+
+        # Positions contained in any interval are contained in the union
+        contained = np.any((Y[:, np.newaxis] >= X[:, 0]) & (Y[:, np.newaxis] < X[:, 1]), axis=1)
+        self.assertTrue(np.all(contained == (segalg.find_contained_positions(opt_result, Y) >= 0)))
+
+
     def test_reindex_segments(self):
 
         df_1 = pd.DataFrame({
@@ -1,5 +1,6 @@
 import sys
 import os
+import shutil
 import unittest
 import copy
 import itertools
@@ -9,6 +10,8 @@ import scipy
 import scipy.optimize
 
 import remixt.seqdataio
+import remixt.analysis.segment
+import remixt.analysis.stats
 
 np.random.seed(2014)
 
@@ -17,7 +20,7 @@ class seqdata_unittest(unittest.TestCase):
 
     def test_seqdataio(self):
 
-        writer = remixt.seqdataio.Writer('./test.seqdata', './')
+        writer = remixt.seqdataio.Writer('./test.seqdata')
 
         chromosome = '1'
 
@@ -44,8 +47,7 @@ class seqdata_unittest(unittest.TestCase):
             fragments_chunk = fragments.reindex(fragment_ids.set_index('fragment_id').index)
             alleles_chunk = alleles[alleles['fragment_id'].isin(fragment_ids['fragment_id'])].copy()
 
-            fragments_chunk.reset_index(inplace=True, drop=True)
-            alleles_chunk['fragment_id'] -= num_reads_written
+            fragments_chunk.reset_index(inplace=True)
 
             writer.write(chromosome, fragments_chunk, alleles_chunk)
 
@@ -53,8 +55,11 @@ class seqdata_unittest(unittest.TestCase):
 
         writer.close()
 
-        fragments_test = next(remixt.seqdataio.read_read_data('./test.seqdata', chromosome='1', num_rows=None))
-        alleles_test = next(remixt.seqdataio.read_allele_data('./test.seqdata', chromosome='1', num_rows=None))
+        fragments_test = remixt.seqdataio.read_fragment_data('./test.seqdata', '1')
+        alleles_test = remixt.seqdataio.read_allele_data('./test.seqdata', '1')
+
+        fragments = fragments.reset_index().rename(columns={'index': 'fragment_id'})
+        fragments_test = fragments_test[['fragment_id', 'start', 'end']]
 
         self.assertEqual(fragments.values.shape, fragments_test.values.shape)
         self.assertEqual(alleles.values.shape, alleles_test.values.shape)
@@ -62,6 +67,308 @@ class seqdata_unittest(unittest.TestCase):
         self.assertTrue(np.all(fragments.values == fragments_test.values))
         self.assertTrue(np.all(alleles.values == alleles_test.values))
 
+        # Chunks beginning within a block of delta encoded starts
+        fragments_chunks = remixt.seqdataio.read_fragment_data('./test.seqdata', '1', chunksize=100003)
+        fragments_chunks = pd.concat(list(fragments_chunks), ignore_index=True)[['fragment_id', 'start', 'end']]
+
+        self.assertTrue(np.all(fragments.values == fragments_chunks.values))
+
+    def test_read_fragment_range(self):
+
+        num_reads = 500000
+
+        fragments = pd.DataFrame({
+            'fragment_id': np.arange(num_reads),
+            'start': np.sort(np.random.randint(0, int(1e8), size=num_reads)),
+        })
+        fragments['end'] = fragments['start'] + np.random.randint(0, 100, size=num_reads)
+
+        alleles = pd.DataFrame(columns=['fragment_id', 'position', 'is_alt'], dtype=int)
+
+        with remixt.seqdataio.Writer('./test.seqdata') as writer:
+            for chunk_start in range(0, num_reads, 70001):
+                writer.write('1', fragments.iloc[chunk_start:chunk_start + 70001], alleles)
+
+        for start, end in ((None, None), (int(5e7), int(5e7) + 10000), (None, 1000), (int(3e7), int(6e7))):
+            expected = fragments
+            if start is not None:
+                expected = expected[expected['start'] >= start]
+            if end is not None:
+                expected = expected[expected['start'] < end]
+
+            fragments_test = remixt.seqdataio.read_fragment_data('./test.seqdata', '1', start=start, end=end)
+            fragments_test = fragments_test[['fragment_id', 'start', 'end']]
+
+            self.assertEqual(expected.values.shape, fragments_test.values.shape)
+            self.assertTrue(np.all(expected.values == fragments_test.values))
+
+    def test_fragment_length_limit(self):
+
+        fragments = pd.DataFrame({
+            'fragment_id': np.arange(3),
+            'start': [100, 200, 300],
+            'end': [200, 200 + 65535, 300 + 65536],
+        })
+
+        alleles = pd.DataFrame(columns=['fragment_id', 'position', 'is_alt'], dtype=int)
+
+        with remixt.seqdataio.Writer('./test.seqdata') as writer:
+            writer.write('1', fragments.iloc[:2], alleles)
+
+            with self.assertRaises(ValueError):
+                writer.write('1', fragments.iloc[2:], alleles)
+
+        fragments_test = remixt.seqdataio.read_fragment_data('./test.seqdata', '1')
+
+        self.assertTrue(np.all(fragments.iloc[:2].values == fragments_test[['fragment_id', 'start', 'end']].values))
+
+
+    def test_link_seqdata(self):
+
+        fragments = pd.DataFrame({
+            'fragment_id': np.arange(1000),
+            'start': np.sort(np.random.randint(0, int(1e6), size=1000)),
+        })
+        fragments['end'] = fragments['start'] + 100
+
+        alleles = pd.DataFrame({
+            'fragment_id': np.arange(0, 1000, 10),
+            'position': fragments['start'].values[::10] + 10,
+            'is_alt': np.random.randint(0, 2, size=100),
+        })
+
+        regions = dict()
+        region_filenames = dict()
+        for idx, (region_start, region_end) in enumerate(((0, 400), (400, 1000))):
+            region_fragments = fragments.iloc[region_start:region_end].copy()
+            region_alleles = alleles[(alleles['fragment_id'] >= region_start) & (alleles['fragment_id'] < region_end)].copy()
+
+            region_fragments['fragment_id'] -= region_start
+            region_alleles['fragment_id'] -= region_start
+
+            region_filenames[idx] = './test.seqdata.region_{}'.format(idx)
+            regions[idx] = remixt.seqdataio.Region('1', region_start, None)
+
+            with remixt.seqdataio.Writer(region_filenames[idx]) as writer:
+                writer.write('1', region_fragments, region_alleles)
+
+        remixt.seqdataio.link_seqdata('./test.seqdata', region_filenames, regions=regions)
+
+        fragments_test = remixt.seqdataio.read_fragment_data('./test.seqdata', '1')
+        alleles_test = remixt.seqdataio.read_allele_data('./test.seqdata', '1')
+
+        self.assertEqual(remixt.seqdataio.read_chromosomes('./test.seqdata'), set(['1']))
+        self.assertTrue(np.all(fragments.values == fragments_test[['fragment_id', 'start', 'end']].values))
+        self.assertTrue(np.all(alleles.values == alleles_test[['fragment_id', 'position', 'is_alt']].values))
+
+        # Inputs are found relative to the manifest after moving both
+        relocated_directory = './test.seqdata.relocated'
+        os.makedirs(relocated_directory)
+        for filename in ['./test.seqdata'] + list(region_filenames.values()):
+            shutil.move(filename, relocated_directory)
+
+        relocated_filename = os.path.join(relocated_directory, 'test.seqdata')
+        fragments_test = remixt.seqdataio.read_fragment_data(relocated_filename, '1')
+        alleles_test = remixt.seqdataio.read_allele_data(relocated_filename, '1')
+
+        self.assertTrue(np.all(fragments.values == fragments_test[['fragment_id', 'start', 'end']].values))
+        self.assertTrue(np.all(alleles.values == alleles_test[['fragment_id', 'position', 'is_alt']].values))
+
+        shutil.rmtree(relocated_directory)
+
+    def test_bin_counts(self):
+
+        num_reads = 100000
+
+        fragments = pd.DataFrame({
+            'fragment_id': np.arange(num_reads),
+            'start': np.sort(np.random.randint(0, int(1e6), size=num_reads)),
+        })
+        fragments['end'] = fragments['start'] + np.random.randint(1, 500, size=num_reads)
+
+        with remixt.seqdataio.Writer('./test.seqdata') as writer:
+            writer.write('1', fragments, pd.DataFrame(columns=['fragment_id', 'position', 'is_alt']))
+
+        remixt.analysis.segment.create_bin_counts('./test.seqdata.bin_counts', './test.seqdata', bin_size=1000)
+
+        # Adjacent segments on bin boundaries, and segments with gaps and partial bins
+        boundaries = np.unique(np.concatenate([
+            np.random.randint(0, 1000, size=50) * 1000,
+            np.random.randint(0, int(1e6), size=50),
+        ]))
+        for segments in (
+                pd.DataFrame({'start': boundaries[:-1], 'end': boundaries[1:]}),
+                pd.DataFrame({'start': boundaries[:-1:2], 'end': boundaries[1::2]})):
+
+            expected = remixt.analysis.segment.count_segment_reads('./test.seqdata', '1', segments.copy())
+            readcount = remixt.analysis.segment.count_segment_reads(
+                './test.seqdata', '1', segments.copy(),
+                bin_counts_filename='./test.seqdata.bin_counts')
+
+            self.assertTrue(np.all(expected['readcount'].values == readcount['readcount'].values))
+
+        os.remove('./test.seqdata.bin_counts')
+
+    def test_read_fragment_filter(self):
+
+        num_reads = 100000
+
+        fragments = pd.DataFrame({
+            'fragment_id': np.arange(num_reads),
+            'start': np.sort(np.random.randint(0, int(1e7), size=num_reads)),
+        })
+        fragments['end'] = fragments['start'] + np.random.randint(0, 1000, size=num_reads)
+        fragments['mapping_quality'] = np.random.randint(0, 61, size=num_reads)
+        fragments['is_duplicate'] = np.random.randint(0, 2, size=num_reads)
+
+        alleles = pd.DataFrame(columns=['fragment_id', 'position', 'is_alt'], dtype=int)
+
+        with remixt.seqdataio.Writer('./test.seqdata') as writer:
+            for chunk_start in range(0, num_reads, 30001):
+                writer.write('1', fragments.iloc[chunk_start:chunk_start + 30001], alleles)
+
+        for filter_duplicates, map_qual_threshold in ((False, 1), (True, 1), (False, 30), (True, 60), (None, None)):
+            expected = fragments
+            if filter_duplicates:
+                expected = expected[expected['is_duplicate'] == 0]
+            if map_qual_threshold is not None:
+                expected = expected[expected['mapping_quality'] >= map_qual_threshold]
+
+            for columns in (None, ['end', 'fragment_id']):
+                expected_columns = columns
+                if columns is None:
+                    expected_columns = ['fragment_id', 'start', 'end']
+                    if filter_duplicates is None:
+                        expected_columns.append('is_duplicate')
+                    if map_qual_threshold is None:
+                        expected_columns.append('mapping_quality')
+
+                for chunksize in (None, 7001):
+                    fragments_test = remixt.seqdataio.read_fragment_data(
+                        './test.seqdata', '1',
+                        filter_duplicates=filter_duplicates,
+                        map_qual_threshold=map_qual_threshold,
+                        chunksize=chunksize,
+                        columns=columns)
+
+                    if chunksize is not None:
+                        fragments_test = pd.concat(list(fragments_test), ignore_index=True)
+
+                    self.assertEqual(list(fragments_test.columns), expected_columns)
+                    self.assertEqual(expected[expected_columns].values.shape, fragments_test.values.shape)
+                    self.assertTrue(np.all(expected[expected_columns].values == fragments_test.values))
+
+    def test_summary_stats(self):
+
+        num_reads = 100000
+
+        fragments = pd.DataFrame({
+            'fragment_id': np.arange(num_reads),
+            'start': np.sort(np.random.randint(0, int(1e7), size=num_reads)),
+        })
+        fragments['end'] = fragments['start'] + np.random.randint(0, 1000, size=num_reads)
+        fragments['mapping_quality'] = np.random.randint(0, 61, size=num_reads)
+        fragments['is_duplicate'] = np.random.randint(0, 2, size=num_reads)
+
+        alleles = pd.DataFrame({
+            'fragment_id': np.sort(np.random.randint(0, num_reads, size=num_reads)),
+            'position': np.random.randint(0, int(1e7), size=num_reads),
+            'is_alt': np.random.randint(0, 2, size=num_reads),
+        })
+
+        with remixt.seqdataio.Writer('./test.seqdata') as writer:
+            for chunk_start in range(0, num_reads, 30001):
+                chunk_end = chunk_start + 30001
+                writer.write(
+                    '1', fragments.iloc[chunk_start:chunk_end],
+                    alleles[(alleles['fragment_id'] >= chunk_start) & (alleles['fragment_id'] < chunk_end)])
+
+        lengths = fragments['end'] - fragments['start']
+
+        stats = remixt.seqdataio.read_summary_stats('./test.seqdata', '1')
+
+        self.assertEqual(stats['fragment_count'].sum(), num_reads)
+        self.assertEqual(stats['fragment_length_sum'].sum(), lengths.sum())
+        self.assertEqual(stats['fragment_length_sum_squares'].sum(), (lengths * lengths).sum())
+        self.assertTrue(np.all(stats['fragment_length_histogram'] == np.bincount(lengths)))
+        self.assertTrue(np.all(stats['allele_count'] == np.bincount(alleles['is_alt'], minlength=2)))
+
+        for filter_duplicates, map_qual_threshold in ((False, 1), (True, 1), (False, 30), (True, 60)):
+            config = {'filter_duplicates': filter_duplicates, 'map_qual_threshold': map_qual_threshold}
+
+            filtered_lengths = remixt.seqdataio.read_fragment_data(
+                './test.seqdata', '1',
+                filter_duplicates=filter_duplicates,
+                map_qual_threshold=map_qual_threshold,
+                columns=['start', 'end'])
+            filtered_lengths = (filtered_lengths['end'] - filtered_lengths['start']).values
+
+            moments = remixt.seqdataio.read_fragment_length_moments(
+                './test.seqdata', '1',
+                filter_duplicates=filter_duplicates,
+                map_qual_threshold=map_qual_threshold)
+
+            self.assertEqual(moments, (len(filtered_lengths), filtered_lengths.sum(), (filtered_lengths * filtered_lengths).sum()))
+
+            fragment_stats = remixt.analysis.stats.calculate_fragment_stats('./test.seqdata', config)
+
+            np.testing.assert_almost_equal(fragment_stats, (filtered_lengths.mean(), filtered_lengths.std()))
+
+    def test_snp_counts(self):
+
+        num_reads = 100000
+
+        fragments = pd.DataFrame({
+            'fragment_id': np.arange(num_reads),
+            'start': np.sort(np.random.randint(0, int(1e7), size=num_reads)),
+        })
+        fragments['end'] = fragments['start'] + 100
+
+        alleles = pd.DataFrame({
+            'fragment_id': np.sort(np.random.randint(0, num_reads, size=num_reads)),
+            'position': np.random.randint(0, 20000, size=num_reads),
+            'is_alt': np.random.randint(0, 2, size=num_reads),
+        })
+
+        region_filenames = dict()
+        regions = dict()
+        for idx, (region_start, region_end) in enumerate(((0, 40000), (40000, num_reads))):
+            region_filenames[idx] = './test.seqdata.region_{}'.format(idx)
+            regions[idx] = remixt.seqdataio.Region('1', region_start, None)
+
+            with remixt.seqdataio.Writer(region_filenames[idx]) as writer:
+                for chunk_start in range(region_start, region_end, 7001):
+                    chunk_end = min(chunk_start + 7001, region_end)
+                    chunk_fragments = fragments.iloc[chunk_start:chunk_end].copy()
+                    chunk_alleles = alleles[(alleles['fragment_id'] >= chunk_start) & (alleles['fragment_id'] < chunk_end)].copy()
+                    chunk_fragments['fragment_id'] -= region_start
+                    chunk_alleles['fragment_id'] -= region_start
+                    writer.write('1', chunk_fragments, chunk_alleles)
+
+        remixt.seqdataio.link_seqdata('./test.seqdata', region_filenames, regions=regions)
+
+        expected = (
+            alleles
+            .assign(ref_count=lambda data: 1 - data['is_alt'], alt_count=lambda data: data['is_alt'])
+            .groupby('position')[['ref_count', 'alt_count']].sum()
+            .reset_index())
+
+        snp_counts = remixt.seqdataio.read_snp_counts('./test.seqdata', '1')
+
+        self.assertEqual(expected.values.shape, snp_counts[['position', 'ref_count', 'alt_count']].values.shape)
+        self.assertTrue(np.all(expected.values == snp_counts[['position', 'ref_count', 'alt_count']].values))
+
+        # Counts added after writing
+        remixt.seqdataio.write_snp_counts('./test.seqdata', chunksize=9001)
+
+        snp_counts = remixt.seqdataio.read_snp_counts('./test.seqdata', '1')
+
+        self.assertTrue(np.all(expected.values == snp_counts[['position', 'ref_count', 'alt_count']].values))
+
+        for region_filename in region_filenames.values():
+            os.remove(region_filename)
+
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -27,6 +27,9 @@ def run(**args):
     if args['normal_sample_id'] is not None and args['normal_bam_file'] is not None:
         bam_filenames[args['normal_sample_id']] = args['normal_bam_file']
 
+    if (args['segment_file'] is None) != (args['haplotypes_file'] is None):
+        raise Exception('--segment_file and --haplotypes_file must be both set or unset')
+
     pypeliner_config = config.copy()
     pypeliner_config.update(args)
     pyp = pypeliner.app.Pypeline([remixt], pypeliner_config)
@@ -39,6 +42,8 @@ def run(**args):
         config,
         args['ref_data_dir'],
         normal_id=args['normal_sample_id'],
+        segment_filename=args['segment_file'],
+        haplotypes_filename=args['haplotypes_file'],
     )
 
     pyp.run(workflow)
@@ -71,6 +76,12 @@ def add_arguments(argparser):
     argparser.add_argument('--normal_bam_file', default=None, required=False,
         help='Input normal bam filenames')
 
+    argparser.add_argument('--segment_file', default=None, required=False,
+        help='Input final segments filename, counts reads directly from bams with --haplotypes_file')
+
+    argparser.add_argument('--haplotypes_file', default=None, required=False,
+        help='Input haplotypes filename, counts reads directly from bams with --segment_file')
+
     argparser.add_argument('--config', required=False,
         help='Configuration Filename')
 
@@ -13,58 +13,137 @@ def create_extract_seqdata_workflow(
      no_parallelism=False
 ):
     chromosomes = remixt.config.get_chromosomes(config, ref_data_dir)
+    chromosome_lengths = remixt.config.get_chromosome_lengths(config, ref_data_dir)
     snp_positions_filename = remixt.config.get_filename(config, ref_data_dir, 'snp_positions')
 
+    # Per chromosome snp index, not available in reference data created by older versions
+    snp_index_template = remixt.config.get_filename(config, ref_data_dir, 'snp_positions_index', chromosome='{chromosome}')
+    if not all([os.path.exists(snp_index_template.format(chromosome=chrom)) for chrom in chromosomes]):
+        snp_index_template = None
+
     bam_max_fragment_length = remixt.config.get_param(config, 'bam_max_fragment_length')
     bam_max_soft_clipped = remixt.config.get_param(config, 'bam_max_soft_clipped')
     bam_check_proper_pair = remixt.config.get_param(config, 'bam_check_proper_pair')
+    bam_extract_region_size = remixt.config.get_param(config, 'bam_extract_region_size')
+    bam_max_buffered_reads = remixt.config.get_param(config, 'bam_max_buffered_reads')
+    bam_snp_targeted = remixt.config.get_param(config, 'bam_snp_targeted')
+    bam_extract_single_pass = remixt.config.get_param(config, 'bam_extract_single_pass')
+    # Bam extraction uses at most 2 threads, see `remixt.seqdataio.max_extract_threads`
+    bam_extract_threads = min(remixt.config.get_param(config, 'bam_extract_threads'), 2)
+    bam_prefetch_alignments = remixt.config.get_param(config, 'bam_prefetch_alignments')
+    bam_extract_max_memory = remixt.config.get_param(config, 'bam_extract_max_memory')
+    seqdata_complib = remixt.config.get_param(config, 'seqdata_complib')
+    seqdata_complevel = remixt.config.get_param(config, 'seqdata_complevel')
+    seqdata_link_regions = remixt.config.get_param(config, 'seqdata_link_regions')
+
+    # Job memory covers the batch memory budget, reads awaiting their mates and
+    # snps, with all snps held in memory for single pass extraction
+    region_extract_mem = bam_extract_max_memory + 2
+    single_pass_extract_mem = bam_extract_max_memory + 6
 
     workflow = pypeliner.workflow.Workflow()
 
-    workflow.setobj(obj=mgd.OutputChunks('chromosome'), value=chromosomes)
-
-    if no_parallelism:
+    if no_parallelism or bam_extract_single_pass:
         workflow.transform(
             name='create_seqdata',
-            ctx={'mem': 16},
+            ctx={'mem': single_pass_extract_mem, 'ncpus': bam_extract_threads},
             func='remixt.seqdataio.create_seqdata',
             args=(
                 mgd.OutputFile(seqdata_filename),
-                mgd.InputFile(bam_filename, extensions=['.bai']),
+                mgd.InputFile(bam_filename),
                 snp_positions_filename,
                 bam_max_fragment_length,
                 bam_max_soft_clipped,
                 bam_check_proper_pair,
-                mgd.TempSpace('create_seqdata_temp'),
-                chromosomes
-            )
+                None,
+                chromosomes,
+            ),
+            kwargs={
+                'max_buffered_reads': bam_max_buffered_reads,
+                'snp_targeted': bam_snp_targeted,
+                'threads': bam_extract_threads,
+                'prefetch_alignments': bam_prefetch_alignments,
+                'max_memory': bam_extract_max_memory,
+                'complib': seqdata_complib,
+                'complevel': seqdata_complevel,
+            },
         )
     else:
+        # Linked region seqdata are referenced by the merged seqdata and must
+        # not be removed as temporaries
+        if seqdata_link_regions:
+            region_seqdata_template = seqdata_filename + '.region_{region}'
+            region_seqdata_output = mgd.OutputFile('region_seqdata', 'region', template=region_seqdata_template)
+            region_seqdata_input = mgd.InputFile('region_seqdata', 'region', template=region_seqdata_template)
+        else:
+            region_seqdata_output = mgd.TempOutputFile('seqdata', 'region')
+            region_seqdata_input = mgd.TempInputFile('seqdata', 'region')
+
         workflow.transform(
-            name='create_chromosome_seqdata',
-            axes=('chromosome',),
-            ctx={'mem': 16},
+            name='create_regions',
+            func='remixt.seqdataio.create_regions',
+            ret=mgd.TempOutputObj('region', 'region'),
+            args=(
+                chromosome_lengths,
+                bam_extract_region_size,
+            ),
+        )
+
+        workflow.transform(
+            name='create_region_seqdata',
+            axes=('region',),
+            ctx={'mem': region_extract_mem, 'ncpus': bam_extract_threads},
             func='remixt.seqdataio.create_chromosome_seqdata',
             args=(
-                mgd.TempOutputFile('seqdata', 'chromosome'),
+                region_seqdata_output,
                 mgd.InputFile(bam_filename, extensions=['.bai']),
                 snp_positions_filename,
-                mgd.InputInstance('chromosome'),
+                mgd.TempInputObj('region', 'region').prop('chromosome'),
                 bam_max_fragment_length,
                 bam_max_soft_clipped,
                 bam_check_proper_pair,
             ),
+            kwargs={
+                'start': mgd.TempInputObj('region', 'region').prop('start'),
+                'end': mgd.TempInputObj('region', 'region').prop('end'),
+                'snp_index_template': snp_index_template,
+                'max_buffered_reads': bam_max_buffered_reads,
+                'snp_targeted': bam_snp_targeted,
+                'threads': bam_extract_threads,
+                'prefetch_alignments': bam_prefetch_alignments,
+                'max_memory': bam_extract_max_memory,
+                'complib': seqdata_complib,
+                'complevel': seqdata_complevel,
+            },
         )
 
-        workflow.transform(
-            name='merge_seqdata',
-            ctx={'mem': 16},
-            func='remixt.seqdataio.merge_seqdata',
-            args=(
-                mgd.OutputFile(seqdata_filename),
-                mgd.TempInputFile('seqdata', 'chromosome'),
-            ),
-        )
+        if seqdata_link_regions:
+            workflow.transform(
+                name='link_seqdata',
+                func='remixt.seqdataio.link_seqdata',
+                args=(
+                    mgd.OutputFile(seqdata_filename),
+                    region_seqdata_input,
+                ),
+                kwargs={
+                    'regions': mgd.TempInputObj('region', 'region'),
+                },
+            )
+        else:
+            workflow.transform(
+                name='merge_seqdata',
+                ctx={'mem': 16},
+                func='remixt.seqdataio.merge_seqdata',
+                args=(
+                    mgd.OutputFile(seqdata_filename),
+                    region_seqdata_input,
+                ),
+                kwargs={
+                    'regions': mgd.TempInputObj('region', 'region'),
+                    'complib': seqdata_complib,
+                    'complevel': seqdata_complevel,
+                },
+            )
 
     return workflow
 
@@ -151,32 +230,59 @@ def create_calc_bias_workflow(
     segment_length_filename,
     config,
     ref_data_dir,
+    fragment_stats=None,
+    gc_counts_filename=None,
 ):
     workflow = pypeliner.workflow.Workflow(default_ctx={'mem': 4})
 
-    workflow.transform(
-        name='calc_fragment_stats',
-        ctx={'mem': 16},
-        func='remixt.analysis.stats.calculate_fragment_stats',
-        ret=mgd.TempOutputObj('fragstats'),
-        args=(
-            mgd.InputFile(tumour_seqdata_filename),
-            config,
+    # Fragment stats and gc sample counts calculated during bam extraction
+    # are used if provided, otherwise they are calculated from seqdata
+    if fragment_stats is None:
+        workflow.transform(
+            name='calc_fragment_stats',
+            ctx={'mem': 16},
+            func='remixt.analysis.stats.calculate_fragment_stats',
+            ret=mgd.TempOutputObj('fragstats'),
+            args=(
+                mgd.InputFile(tumour_seqdata_filename),
+                config,
+            )
         )
-    )
 
-    workflow.transform(
-        name='sample_gc',
-        ctx={'mem': 16},
-        func='remixt.analysis.gcbias.sample_gc',
-        args=(
-            mgd.TempOutputFile('gcsamples.tsv'),
-            mgd.InputFile(tumour_seqdata_filename),
-            mgd.TempInputObj('fragstats').prop('fragment_mean'),
-            config,
-            ref_data_dir,
+        fragment_mean = mgd.TempInputObj('fragstats').prop('fragment_mean')
+        fragment_stddev = mgd.TempInputObj('fragstats').prop('fragment_stddev')
+
+    else:
+        fragment_mean = fragment_stats.fragment_mean
+        fragment_stddev = fragment_stats.fragment_stddev
+
+    if gc_counts_filename is None:
+        workflow.transform(
+            name='sample_gc',
+            ctx={'mem': 16},
+            func='remixt.analysis.gcbias.sample_gc',
+            args=(
+                mgd.TempOutputFile('gcsamples.tsv'),
+                mgd.InputFile(tumour_seqdata_filename),
+                fragment_mean,
+                config,
+                ref_data_dir,
+            )
+        )
+
+    else:
+        workflow.transform(
+            name='sample_gc',
+            ctx={'mem': 16},
+            func='remixt.analysis.gcbias.sample_gc_from_counts',
+            args=(
+                mgd.TempOutputFile('gcsamples.tsv'),
+                mgd.InputFile(gc_counts_filename),
+                fragment_mean,
+                config,
+                ref_data_dir,
+            )
         )
-    )
 
     workflow.transform(
         name='gc_lowess',
@@ -206,8 +312,8 @@ def create_calc_bias_workflow(
         func='remixt.analysis.gcbias.gc_map_bias',
         args=(
             mgd.TempInputFile('segments.tsv', 'segment_rows_idx'),
-            mgd.TempInputObj('fragstats').prop('fragment_mean'),
-            mgd.TempInputObj('fragstats').prop('fragment_stddev'),
+            fragment_mean,
+            fragment_stddev,
             mgd.TempInputFile('gcloess.tsv'),
             mgd.TempOutputFile('biases.tsv', 'segment_rows_idx'),
             config,
@@ -245,6 +351,8 @@ def create_prepare_counts_workflow(
 ):
     count_filenames = dict([(tumour_id, count_filenames[tumour_id]) for tumour_id in tumour_filenames.keys()])
 
+    segment_count_processes = remixt.config.get_param(config, 'segment_count_processes')
+
     workflow = pypeliner.workflow.Workflow()
 
     workflow.setobj(
@@ -253,16 +361,31 @@ def create_prepare_counts_workflow(
     )
 
     workflow.transform(
-        name='segment_readcount',
+        name='create_bin_counts',
         axes=('tumour_id',),
-        ctx={'mem': 20},
-        func='remixt.analysis.readcount.segment_readcount',
+        ctx={'mem': 4},
+        func='remixt.analysis.readcount.create_bin_counts',
         args=(
-            mgd.TempOutputFile('segment_counts.tsv', 'tumour_id'),
+            mgd.TempOutputFile('bin_counts', 'tumour_id'),
+            mgd.InputFile('tumour_file', 'tumour_id', fnames=tumour_filenames),
+            config,
+        ),
+    )
+
+    # Samples are counted together in worker processes sharing the sorted segments
+    workflow.transform(
+        name='segment_readcount',
+        ctx={'mem': 20, 'ncpus': segment_count_processes},
+        func='remixt.analysis.readcount.multiple_segment_readcount',
+        args=(
+            mgd.TempOutputFile('segment_counts.tsv', 'tumour_id', axes_origin=[]),
             mgd.InputFile(segment_filename),
             mgd.InputFile('tumour_file', 'tumour_id', fnames=tumour_filenames),
             config,
         ),
+        kwargs={
+            'bin_counts_filenames': mgd.TempInputFile('bin_counts', 'tumour_id'),
+        },
     )
 
     workflow.transform(
@@ -415,15 +538,110 @@ def create_remixt_seqdata_workflow(
         }
     )
 
-    workflow.subworkflow(
-        name='prepare_counts_workflow',
-        func='remixt.workflow.create_prepare_counts_workflow',
-        args=(
-            mgd.InputFile(segment_filename),
-            mgd.InputFile(haplotypes_filename),
-            mgd.InputFile('seqdata', 'tumour_id', fnames=seqdata_filenames),
-            mgd.TempOutputFile('rawcounts', 'tumour_id', axes_origin=[]),
+    if remixt.config.get_param(config, 'seqdata_fused_counts'):
+        workflow.transform(
+            name='write_gc_positions',
+            ctx={'mem': 8},
+            func='remixt.analysis.gcbias.write_gc_positions',
+            args=(
+                mgd.TempOutputFile('gc_positions.tsv'),
+                config,
+                ref_data_dir,
+            ),
+        )
+
+        workflow.transform(
+            name='count_seqdata',
+            axes=('tumour_id',),
+            ctx={'mem': 16},
+            func='remixt.analysis.readcount.count_seqdata',
+            ret=mgd.TempOutputObj('fragstats', 'tumour_id'),
+            args=(
+                mgd.TempOutputFile('segment_counts.tsv', 'tumour_id'),
+                mgd.TempOutputFile('allele_counts.tsv', 'tumour_id'),
+                mgd.TempOutputFile('gc_counts.tsv', 'tumour_id'),
+                mgd.InputFile('seqdata', 'tumour_id', fnames=seqdata_filenames),
+                mgd.InputFile(segment_filename),
+                mgd.InputFile(haplotypes_filename),
+                mgd.TempInputFile('gc_positions.tsv'),
+                config,
+            ),
+        )
+
+        _add_counts_table_transforms(
+            workflow,
+            counts_table_template,
             config,
+            ref_data_dir,
+        )
+
+    else:
+        workflow.subworkflow(
+            name='prepare_counts_workflow',
+            func='remixt.workflow.create_prepare_counts_workflow',
+            args=(
+                mgd.InputFile(segment_filename),
+                mgd.InputFile(haplotypes_filename),
+                mgd.InputFile('seqdata', 'tumour_id', fnames=seqdata_filenames),
+                mgd.TempOutputFile('rawcounts', 'tumour_id', axes_origin=[]),
+                config,
+            ),
+        )
+
+        workflow.subworkflow(
+            name='calc_bias_workflow',
+            axes=('tumour_id',),
+            func='remixt.workflow.create_calc_bias_workflow',
+            args=(
+                mgd.InputFile('seqdata', 'tumour_id', fnames=seqdata_filenames),
+                mgd.TempInputFile('rawcounts', 'tumour_id'),
+                mgd.OutputFile('counts', 'tumour_id', template=counts_table_template),
+                config,
+                ref_data_dir,
+            ),
+        )
+
+    _add_fit_model_transforms(
+        workflow,
+        breakpoint_filename,
+        counts_table_template,
+        experiment_template,
+        ploidy_plots_template,
+        results_filenames,
+        config,
+        ref_data_dir,
+    )
+
+    return workflow
+
+
+def _add_counts_table_transforms(
+    workflow,
+    counts_table_template,
+    config,
+    ref_data_dir,
+):
+    # Counts tables from segment, allele and gc counts, and fragment stats,
+    # counted for each tumour in a single pass of the bam or seqdata
+    workflow.transform(
+        name='phase_segments',
+        ctx={'mem': 16},
+        func='remixt.analysis.readcount.phase_segments',
+        args=(
+            mgd.TempInputFile('allele_counts.tsv', 'tumour_id'),
+            mgd.TempOutputFile('phased_allele_counts.tsv', 'tumour_id', axes_origin=[]),
+        ),
+    )
+
+    workflow.transform(
+        name='prepare_readcount_table',
+        axes=('tumour_id',),
+        ctx={'mem': 16},
+        func='remixt.analysis.readcount.prepare_readcount_table',
+        args=(
+            mgd.TempInputFile('segment_counts.tsv', 'tumour_id'),
+            mgd.TempInputFile('phased_allele_counts.tsv', 'tumour_id'),
+            mgd.TempOutputFile('rawcounts', 'tumour_id'),
         ),
     )
 
@@ -432,14 +650,29 @@ def create_remixt_seqdata_workflow(
         axes=('tumour_id',),
         func='remixt.workflow.create_calc_bias_workflow',
         args=(
-            mgd.InputFile('seqdata', 'tumour_id', fnames=seqdata_filenames),
+            None,
             mgd.TempInputFile('rawcounts', 'tumour_id'),
             mgd.OutputFile('counts', 'tumour_id', template=counts_table_template),
             config,
             ref_data_dir,
         ),
+        kwargs={
+            'fragment_stats': mgd.TempInputObj('fragstats', 'tumour_id'),
+            'gc_counts_filename': mgd.TempInputFile('gc_counts.tsv', 'tumour_id'),
+        },
     )
 
+
+def _add_fit_model_transforms(
+    workflow,
+    breakpoint_filename,
+    counts_table_template,
+    experiment_template,
+    ploidy_plots_template,
+    results_filenames,
+    config,
+    ref_data_dir,
+):
     workflow.transform(
         name='create_experiment',
         axes=('tumour_id',),
@@ -478,8 +711,6 @@ def create_remixt_seqdata_workflow(
         },
     )
 
-    return workflow
-
 
 def create_remixt_bam_workflow(
     breakpoint_filename,
@@ -489,6 +720,8 @@ def create_remixt_bam_workflow(
     config,
     ref_data_dir,
     normal_id=None,
+    segment_filename=None,
+    haplotypes_filename=None,
 ):
     sample_ids = list(bam_filenames.keys())
     
@@ -500,6 +733,21 @@ def create_remixt_bam_workflow(
 
     results_filenames = dict([(tumour_id, results_filenames[tumour_id]) for tumour_id in tumour_ids])
 
+    # Count reads directly from the bams given final segments and haplotypes
+    if segment_filename is not None and haplotypes_filename is not None:
+        tumour_bam_filenames = dict([(tumour_id, bam_filenames[tumour_id]) for tumour_id in tumour_ids])
+
+        return create_remixt_bam_counts_workflow(
+            breakpoint_filename,
+            segment_filename,
+            haplotypes_filename,
+            tumour_bam_filenames,
+            results_filenames,
+            raw_data_directory,
+            config,
+            ref_data_dir,
+        )
+
     workflow = pypeliner.workflow.Workflow()
 
     workflow.setobj(
@@ -541,3 +789,122 @@ def create_remixt_bam_workflow(
     )
 
     return workflow
+
+
+def create_remixt_bam_counts_workflow(
+    breakpoint_filename,
+    segment_filename,
+    haplotypes_filename,
+    bam_filenames,
+    results_filenames,
+    raw_data_directory,
+    config,
+    ref_data_dir,
+):
+    tumour_ids = list(bam_filenames.keys())
+
+    chromosome_lengths = remixt.config.get_chromosome_lengths(config, ref_data_dir)
+    snp_positions_filename = remixt.config.get_filename(config, ref_data_dir, 'snp_positions')
+    bam_extract_region_size = remixt.config.get_param(config, 'bam_extract_region_size')
+    # Bam extraction uses at most 2 threads, see `remixt.seqdataio.max_extract_threads`
+    bam_extract_threads = min(remixt.config.get_param(config, 'bam_extract_threads'), 2)
+
+    counts_table_template = os.path.join(raw_data_directory, 'counts', 'sample_{tumour_id}.tsv')
+    experiment_template = os.path.join(raw_data_directory, 'experiment', 'sample_{tumour_id}.pickle')
+    ploidy_plots_template = os.path.join(raw_data_directory, 'ploidy_plots', 'sample_{tumour_id}.pdf')
+
+    workflow = pypeliner.workflow.Workflow()
+
+    workflow.setobj(
+        obj=mgd.OutputChunks('tumour_id'),
+        value=tumour_ids,
+    )
+
+    workflow.transform(
+        name='write_het_snps',
+        ctx={'mem': 8},
+        func='remixt.analysis.readcount.write_het_snps',
+        args=(
+            mgd.TempOutputFile('het_snps.tsv'),
+            snp_positions_filename,
+            mgd.InputFile(haplotypes_filename),
+        ),
+    )
+
+    workflow.transform(
+        name='write_gc_positions',
+        ctx={'mem': 8},
+        func='remixt.analysis.gcbias.write_gc_positions',
+        args=(
+            mgd.TempOutputFile('gc_positions.tsv'),
+            config,
+            ref_data_dir,
+        ),
+    )
+
+    workflow.transform(
+        name='create_regions',
+        func='remixt.seqdataio.create_regions',
+        ret=mgd.TempOutputObj('region', 'region'),
+        args=(
+            chromosome_lengths,
+            bam_extract_region_size,
+        ),
+    )
+
+    workflow.transform(
+        name='count_bam_region',
+        axes=('tumour_id', 'region'),
+        ctx={'mem': 8, 'ncpus': bam_extract_threads},
+        func='remixt.analysis.readcount.count_bam_region',
+        args=(
+            mgd.TempOutputFile('region_counts.pickle', 'tumour_id', 'region'),
+            mgd.InputFile('bam', 'tumour_id', fnames=bam_filenames, extensions=['.bai']),
+            mgd.TempInputFile('het_snps.tsv'),
+            mgd.InputFile(segment_filename),
+            mgd.TempInputFile('gc_positions.tsv'),
+            mgd.TempInputObj('region', 'region').prop('chromosome'),
+            config,
+        ),
+        kwargs={
+            'start': mgd.TempInputObj('region', 'region').prop('start'),
+            'end': mgd.TempInputObj('region', 'region').prop('end'),
+        },
+    )
+
+    workflow.transform(
+        name='merge_bam_region_counts',
+        axes=('tumour_id',),
+        ctx={'mem': 16},
+        func='remixt.analysis.readcount.merge_bam_region_counts',
+        ret=mgd.TempOutputObj('fragstats', 'tumour_id'),
+        args=(
+            mgd.TempOutputFile('segment_counts.tsv', 'tumour_id'),
+            mgd.TempOutputFile('allele_counts.tsv', 'tumour_id'),
+            mgd.TempOutputFile('gc_counts.tsv', 'tumour_id'),
+            mgd.TempInputFile('region_counts.pickle', 'tumour_id', 'region'),
+            mgd.InputFile(segment_filename),
+            mgd.InputFile(haplotypes_filename),
+        ),
+    )
+
+    _add_counts_table_transforms(
+        workflow,
+        counts_table_template,
+        config,
+        ref_data_dir,
+    )
+
+    _add_fit_model_transforms(
+        workflow,
+        breakpoint_filename,
+        counts_table_template,
+        experiment_template,
+        ploidy_plots_template,
+        results_filenames,
+        config,
+        ref_data_dir,
+    )
+
+    return workflow
+
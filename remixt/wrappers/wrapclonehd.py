@@ -16,6 +16,7 @@ import cmdline
 import remixt.seqdataio
 import remixt.segalg
 import remixt.analysis.haplotype
+import remixt.analysis.segment
 
 
 def read_chromosome_lengths(chrom_info_filename):
@@ -37,7 +38,7 @@ def create_segments(chrom_length, segment_length=1000):
     return segments
 
 
-def write_cna(cna_filename, seqdata_filename, chromosome_lengths, segment_length=1000):
+def write_cna(cna_filename, seqdata_filename, bin_counts_filename, chromosome_lengths, segment_length=1000):
 
     with open(cna_filename, 'w') as cna:
 
@@ -45,16 +46,12 @@ def write_cna(cna_filename, seqdata_filename, chromosome_lengths, segment_length
 
         for chrom in chromosomes:
 
-            reads = next(remixt.seqdataio.read_read_data(seqdata_filename, chromosome=chrom))
-
-            reads.sort_values('start', inplace=True)
-
             segments = create_segments(chromosome_lengths[chrom], segment_length)
 
-            segments['count'] = remixt.segalg.contained_counts(
-                segments[['start', 'end']].values,
-                reads[['start', 'end']].values,
-            )
+            segments['count'] = remixt.analysis.segment.count_segment_reads(
+                seqdata_filename, chrom, segments,
+                bin_counts_filename=bin_counts_filename,
+            )['readcount'].values
 
             segments['chromosome'] = chrom
             segments['num_obs'] = 1
@@ -188,8 +185,14 @@ class CloneHDAnalysis(object):
 
         chromosome_lengths = read_chromosome_lengths(self.tool.chrom_info_filename)
 
-        write_cna(self.get_analysis_filename('normal.cna.txt'), normal_filename, chromosome_lengths)
-        write_cna(self.get_analysis_filename('tumour.cna.txt'), tumour_filename, chromosome_lengths)
+        normal_bin_counts_filename = self.get_analysis_filename('normal.bin_counts')
+        tumour_bin_counts_filename = self.get_analysis_filename('tumour.bin_counts')
+
+        remixt.analysis.segment.create_bin_counts(normal_bin_counts_filename, normal_filename)
+        remixt.analysis.segment.create_bin_counts(tumour_bin_counts_filename, tumour_filename)
+
+        write_cna(self.get_analysis_filename('normal.cna.txt'), normal_filename, normal_bin_counts_filename, chromosome_lengths)
+        write_cna(self.get_analysis_filename('tumour.cna.txt'), tumour_filename, tumour_bin_counts_filename, chromosome_lengths)
 
         write_tumour_baf(self.get_analysis_filename('tumour.baf.txt'), normal_filename, tumour_filename)
 
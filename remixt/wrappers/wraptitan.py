@@ -17,6 +17,7 @@ import cmdline
 import remixt.seqdataio
 import remixt.segalg
 import remixt.analysis.haplotype
+import remixt.analysis.segment
 
 
 def read_chromosome_lengths(chrom_info_filename):
@@ -38,7 +39,7 @@ def create_segments(chrom_length, segment_length=1000):
     return segments
 
 
-def write_segment_count_wig(wig_filename, seqdata_filename, chromosome_lengths, segment_length=1000):
+def write_segment_count_wig(wig_filename, seqdata_filename, bin_counts_filename, chromosome_lengths, segment_length=1000):
 
     with open(wig_filename, 'w') as wig:
 
@@ -48,16 +49,13 @@ def write_segment_count_wig(wig_filename, seqdata_filename, chromosome_lengths,
 
             wig.write('fixedStep chrom={0} start=1 step={1} span={1}\n'.format(chrom, segment_length))
 
-            chrom_reads = next(remixt.seqdataio.read_read_data(seqdata_filename, chromosome=chrom))
-
-            chrom_reads.sort_values('start', inplace=True)
-
             chrom_segments = create_segments(chromosome_lengths[chrom], segment_length)
+            chrom_segments = pd.DataFrame(chrom_segments, columns=['start', 'end'])
 
-            seg_count = remixt.segalg.contained_counts(
-                chrom_segments,
-                chrom_reads[['start', 'end']].values,
-            )
+            seg_count = remixt.analysis.segment.count_segment_reads(
+                seqdata_filename, chrom, chrom_segments,
+                bin_counts_filename=bin_counts_filename,
+            )['readcount'].values
 
             wig.write('\n'.join([str(c) for c in seg_count]))
             wig.write('\n')
@@ -238,8 +236,14 @@ class TitanAnalysis(object):
         normal_wig_filename = self.get_analysis_filename('normal.wig')
         tumour_wig_filename = self.get_analysis_filename('tumour.wig')
 
-        write_segment_count_wig(normal_wig_filename, normal_filename, chromosome_lengths)
-        write_segment_count_wig(tumour_wig_filename, tumour_filename, chromosome_lengths)
+        normal_bin_counts_filename = self.get_analysis_filename('normal.bin_counts')
+        tumour_bin_counts_filename = self.get_analysis_filename('tumour.bin_counts')
+
+        remixt.analysis.segment.create_bin_counts(normal_bin_counts_filename, normal_filename)
+        remixt.analysis.segment.create_bin_counts(tumour_bin_counts_filename, tumour_filename)
+
+        write_segment_count_wig(normal_wig_filename, normal_filename, normal_bin_counts_filename, chromosome_lengths)
+        write_segment_count_wig(tumour_wig_filename, tumour_filename, tumour_bin_counts_filename, chromosome_lengths)
 
         # Identify het from normal
         het_positions = infer_het_positions(normal_filename)
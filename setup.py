@@ -41,7 +41,7 @@ extensions = [
         name='remixt.bamreader',
         sources=['remixt/bamreader.pyx', 'src/BamAlleleReader.cpp'] + bamtools_sources,
         include_dirs=['src', external_dir, bamtools_dir, get_numpy_include()],
-        libraries=['z', 'bz2'],
+        libraries=['z', 'bz2', 'pthread'],
         extra_compile_args=extra_compile_args,
         extra_link_args=extra_link_args,
         language="c++",
@@ -0,0 +1,164 @@
+#ifndef ALIGNMENTPREFETCHER_H_
+#define ALIGNMENTPREFETCHER_H_
+
+#include <deque>
+#include <vector>
+#include <stdexcept>
+#include <pthread.h>
+
+#include "external/bamtools/src/api/BamReader.h"
+
+
+// Decompress and decode alignments on a background thread, handing batches
+// of alignments to the reading thread through a bounded queue.  At most
+// (maxBatches + 2) * batchSize alignments are held, including the batch
+// being filled and the batch being consumed.
+class AlignmentPrefetcher
+{
+public:
+	AlignmentPrefetcher(BamTools::BamReader& bamReader, size_t batchSize, size_t maxBatches)
+		: mBamReader(bamReader),
+		  mBatchSize(batchSize),
+		  mMaxBatches(maxBatches),
+		  mBatchIndex(0),
+		  mFinished(false),
+		  mStopped(false),
+		  mStarted(false)
+	{
+		pthread_mutex_init(&mMutex, 0);
+		pthread_cond_init(&mNotEmpty, 0);
+		pthread_cond_init(&mNotFull, 0);
+	}
+
+	~AlignmentPrefetcher()
+	{
+		Stop();
+
+		pthread_cond_destroy(&mNotFull);
+		pthread_cond_destroy(&mNotEmpty);
+		pthread_mutex_destroy(&mMutex);
+	}
+
+	void Start()
+	{
+		if (pthread_create(&mThread, 0, &AlignmentPrefetcher::Run, this) != 0)
+		{
+			throw std::runtime_error("Unable to start bam prefetch thread");
+		}
+		mStarted = true;
+	}
+
+	// Stop the background thread, the bam reader may not be used afterwards
+	void Stop()
+	{
+		if (!mStarted)
+		{
+			return;
+		}
+
+		pthread_mutex_lock(&mMutex);
+		mStopped = true;
+		pthread_cond_signal(&mNotFull);
+		pthread_mutex_unlock(&mMutex);
+
+		pthread_join(mThread, 0);
+		mStarted = false;
+	}
+
+	bool GetNextAlignment(BamTools::BamAlignment& alignment)
+	{
+		// Take the next batch from the queue once the current batch is consumed
+		if (mBatchIndex >= mBatch.size())
+		{
+			mBatch.clear();
+			mBatchIndex = 0;
+
+			pthread_mutex_lock(&mMutex);
+			while (mBatches.empty() && !mFinished)
+			{
+				pthread_cond_wait(&mNotEmpty, &mMutex);
+			}
+			if (!mBatches.empty())
+			{
+				mBatch.swap(mBatches.front());
+				mBatches.pop_front();
+				pthread_cond_signal(&mNotFull);
+			}
+			pthread_mutex_unlock(&mMutex);
+
+			if (mBatch.empty())
+			{
+				return false;
+			}
+		}
+
+		alignment = mBatch[mBatchIndex++];
+		return true;
+	}
+
+private:
+	static void* Run(void* prefetcher)
+	{
+		static_cast<AlignmentPrefetcher*>(prefetcher)->Prefetch();
+		return 0;
+	}
+
+	void Prefetch()
+	{
+		bool finished = false;
+		while (!finished)
+		{
+			std::vector<BamTools::BamAlignment> batch(mBatchSize);
+
+			size_t batchCount = 0;
+			while (batchCount < mBatchSize)
+			{
+				if (!mBamReader.GetNextAlignment(batch[batchCount]))
+				{
+					finished = true;
+					break;
+				}
+				batchCount++;
+			}
+			batch.resize(batchCount);
+
+			pthread_mutex_lock(&mMutex);
+			while (mBatches.size() >= mMaxBatches && !mStopped)
+			{
+				pthread_cond_wait(&mNotFull, &mMutex);
+			}
+			if (mStopped)
+			{
+				pthread_mutex_unlock(&mMutex);
+				return;
+			}
+			if (!batch.empty())
+			{
+				mBatches.push_back(std::vector<BamTools::BamAlignment>());
+				mBatches.back().swap(batch);
+			}
+			mFinished = finished;
+			pthread_cond_signal(&mNotEmpty);
+			pthread_mutex_unlock(&mMutex);
+		}
+	}
+
+	BamTools::BamReader& mBamReader;
+	size_t mBatchSize;
+	size_t mMaxBatches;
+
+	std::vector<BamTools::BamAlignment> mBatch;
+	size_t mBatchIndex;
+
+	std::deque<std::vector<BamTools::BamAlignment> > mBatches;
+	bool mFinished;
+	bool mStopped;
+
+	bool mStarted;
+	pthread_t mThread;
+	pthread_mutex_t mMutex;
+	pthread_cond_t mNotEmpty;
+	pthread_cond_t mNotFull;
+};
+
+#endif
@@ -5,8 +5,8 @@
 #include <fstream>
 #include <iostream>
 #include <string>
-#include <map>
 #include <set>
+#include <map>
 #include <sstream>
 #include <limits>
 #include <stdexcept>
@@ -59,62 +59,142 @@ inline bool IsReadValidConcordant(const BamAlignment& alignment, double maxSoftC
 	        !alignment.IsFailedQC());
 }
 
+inline string GetAlternateChromosome(const string& chromosome)
+{
+	if (chromosome.substr(0, 3) == "chr")
+	{
+		return chromosome.substr(3);
+	}
+	else
+	{
+		return "chr" + chromosome;
+	}
+}
+
+inline bool IsSNPIndexFilename(const string& snpFilename)
+{
+	const string suffix = ".bin";
+	return (snpFilename.size() > suffix.size() &&
+	        snpFilename.compare(snpFilename.size() - suffix.size(), suffix.size(), suffix) == 0);
+}
+
 AlleleReader::AlleleReader(const string& bamFilename,
                            const string& snpFilename,
                            const string& chromosome,
                            int maxFragmentLength,
                            int maxSoftClipped,
-                           bool checkProperPair)
-	: mChromosome(chromosome),
+                           bool checkProperPair,
+                           int regionStart,
+                           int regionEnd,
+                           int maxBufferedReads,
+                           bool snpTargeted,
+                           int threads,
+                           int prefetchAlignments)
+	: mPrefetcher(0),
+	  mChromosome(chromosome),
+	  mAllChromosomes(chromosome.empty()),
+	  mCountSegments(false),
+	  mFilterDuplicates(false),
+	  mMapQualThreshold(0),
 	  mMaxFragmentLength(maxFragmentLength),
 	  mMaxSoftClipped(maxSoftClipped),
+	  mCheckProperPair(checkProperPair),
+	  mRegionStart(regionStart),
+	  mRegionEnd(regionEnd),
+	  mMaxBufferedReads(maxBufferedReads),
+	  mSNPTargeted(snpTargeted),
+	  mPurgeThreshold(maxBufferedReads),
+	  mNumDiscardedReads(0),
 	  mRefID(-1),
 	  mNextFragmentID(0),
-	  mCheckProperPair(checkProperPair)
+	  mHasNextAlignment(false)
 {
 	if (!mBamReader.Open(bamFilename))
 	{
 		throw invalid_argument("Unable to open bam file " + bamFilename);
 	}
+
+	// Reference names are read on this thread while the prefetch thread reads
+	// alignments, and are copied as the bam reader is not thread safe
+	mReferenceData = mBamReader.GetReferenceData();
 	
-	if (!mBamReader.LocateIndex())
+	// Read all chromosomes sequentially if no chromosome is specified
+	if (mAllChromosomes)
 	{
-		throw invalid_argument("Unable to find index for bam file " + bamFilename);
-	}
+		if (IsSNPIndexFilename(snpFilename))
+		{
+			throw invalid_argument("Per chromosome snp index " + snpFilename + " requires a chromosome");
+		}
 
-	// Alternate chromosome, ucsc or ensembl
-	if (mChromosome.substr(0, 3) == "chr")
-	{
-		mAlternateChromosome = mChromosome.substr(3);
+		if (!snpFilename.empty())
+		{
+			ReadSNPs(snpFilename);
+		}
 	}
 	else
 	{
-		mAlternateChromosome = "chr" + mChromosome;
-	}
+		if (!mBamReader.LocateIndex())
+		{
+			throw invalid_argument("Unable to find index for bam file " + bamFilename);
+		}
 
-	// Querty bam for either chromosome
-	mRefID = mBamReader.GetReferenceID(mChromosome);
+		// Alternate chromosome, ucsc or ensembl
+		mAlternateChromosome = GetAlternateChromosome(mChromosome);
 
-	if (mRefID < 0)
-	{
-		mRefID = mBamReader.GetReferenceID(mAlternateChromosome);
+		// Querty bam for either chromosome
+		mRefID = mBamReader.GetReferenceID(mChromosome);
 
 		if (mRefID < 0)
 		{
-			throw out_of_range("Unable to find chromosome " + mChromosome + " or " + mAlternateChromosome);
+			mRefID = mBamReader.GetReferenceID(mAlternateChromosome);
+
+			if (mRefID < 0)
+			{
+				throw out_of_range("Unable to find chromosome " + mChromosome + " or " + mAlternateChromosome);
+			}
 		}
-	}
 
-	// Set region in bam
-	mBamReader.SetRegion(BamRegion(mRefID, 0, mRefID+1, 1));
+		// Set region in bam, either the full chromosome or a sub-region extended
+		// by the maximum fragment length to capture mates of fragments starting
+		// within the sub-region
+		if (mRegionEnd < 0)
+		{
+			mBamReader.SetRegion(BamRegion(mRefID, 0, mRefID+1, 1));
+		}
+		else
+		{
+			mBamReader.SetRegion(BamRegion(mRefID, mRegionStart, mRefID, mRegionEnd + mMaxFragmentLength));
+		}
 
-	if (!snpFilename.empty())
-	{
-		ReadSNPs(snpFilename);
+		if (IsSNPIndexFilename(snpFilename))
+		{
+			ReadSNPIndex(snpFilename);
+		}
+		else if (!snpFilename.empty())
+		{
+			ReadSNPs(snpFilename);
+		}
 	}
 	
 	mPileupEngine.AddVisitor(dynamic_cast<PileupVisitor*>(this));
 	mPileupEngine.AddVisitor(dynamic_cast<DiscardAlignmentVisitor*>(this));
+
+	// Decompress and decode the bam on a separate thread if additional threads
+	// are available, leaving pairing and allele extraction on this thread, thus
+	// at most 2 threads are used.
+	// Two batches are queued, while one is filled and one consumed, holding
+	// at most prefetchAlignments alignments.
+	if (threads > 1)
+	{
+		int prefetchBatchSize = max(prefetchAlignments / 4, 1);
+		mPrefetcher = new AlignmentPrefetcher(mBamReader, prefetchBatchSize, 2);
+		mPrefetcher->Start();
+	}
+}
+
+AlleleReader::~AlleleReader()
+{
+	delete mPrefetcher;
 }
 
 void AlleleReader::ReadSNPs(const string& snpFilename)
@@ -141,7 +221,7 @@ void AlleleReader::ReadSNPs(const string& snpFilename)
 
 		lineStream >> chromosome >> position >> ref >> alt;
 
-		if (chromosome != mChromosome && chromosome != mAlternateChromosome)
+		if (!mAllChromosomes && chromosome != mChromosome && chromosome != mAlternateChromosome)
 		{
 			continue;
 		}
@@ -164,11 +244,73 @@ void AlleleReader::ReadSNPs(const string& snpFilename)
 		snp.ref = ref[0];
 		snp.alt = alt[0];
 		
-		mSNPs.push_back(snp);
+		if (mAllChromosomes)
+		{
+			mGenomeSNPs[chromosome].push_back(snp);
+		}
+		else
+		{
+			mSNPs.push_back(snp);
+		}
 	}
 	
 	// Sorting required for streaming
 	sort(mSNPs.begin(), mSNPs.end());
+	for (map<string,vector<SNPInfo> >::iterator snpsIter = mGenomeSNPs.begin(); snpsIter != mGenomeSNPs.end(); snpsIter++)
+	{
+		sort(snpsIter->second.begin(), snpsIter->second.end());
+	}
+
+	// Initialize iterators for sequential access
+	mSNPIter = mSNPs.begin();
+}
+
+void AlleleReader::ReadSNPIndex(const string& snpIndexFilename)
+{
+	// Read the chromosome's snp index in a single block
+	ifstream snpIndexFile(snpIndexFilename.c_str(), ios::binary | ios::ate);
+	if (!snpIndexFile.good())
+	{
+		throw ios_base::failure("Error: Unable to open " + snpIndexFilename);
+	}
+
+	streamsize fileSize = snpIndexFile.tellg();
+	if (fileSize % SNPIndexRecordSize != 0)
+	{
+		throw invalid_argument("Error: Truncated snp index " + snpIndexFilename);
+	}
+
+	vector<char> buffer(fileSize);
+	snpIndexFile.seekg(0, ios::beg);
+	if (fileSize > 0 && !snpIndexFile.read(&buffer[0], fileSize))
+	{
+		throw ios_base::failure("Error: Unable to read " + snpIndexFilename);
+	}
+
+	// clear SNPs table
+	mSNPs.clear();
+	mSNPs.resize(fileSize / SNPIndexRecordSize);
+
+	for (size_t idx = 0; idx < mSNPs.size(); idx++)
+	{
+		const char* record = &buffer[idx * SNPIndexRecordSize];
+
+		// Little endian 1-based position
+		const unsigned char* positionBytes = reinterpret_cast<const unsigned char*>(record);
+		int position = (int)(positionBytes[0] | (positionBytes[1] << 8) | (positionBytes[2] << 16) | ((unsigned int)positionBytes[3] << 24));
+
+		// Convert to 0-based position
+		mSNPs[idx].position = position - 1;
+
+		mSNPs[idx].ref = record[4];
+		mSNPs[idx].alt = record[5];
+	}
+
+	// Index is sorted on creation, check rather than sort
+	if (!is_sorted(mSNPs.begin(), mSNPs.end()))
+	{
+		throw invalid_argument("Error: Unsorted snp index " + snpIndexFilename);
+	}
 
 	// Initialize iterators for sequential access
 	mSNPIter = mSNPs.begin();
@@ -176,15 +318,25 @@ void AlleleReader::ReadSNPs(const string& snpFilename)
 
 bool AlleleReader::ReadAlignments(int maxAlignments)
 {
-	mFragmentData.clear();
-	mAlleleData.clear();
+	mFragmentData.Clear();
+	mAlleleData.Clear();
 
 	bool finishedGetAlignments = false;
+	bool finishedChromosome = false;
 	for (int idx = 0; idx < maxAlignments; idx++)
 	{
-		// Get next alignment if one is available
+		// Get next alignment if one is available, starting with an alignment
+		// held over from the end of the previous batch
 		BamAlignment alignment;
-		finishedGetAlignments = !mBamReader.GetNextAlignment(alignment);
+		if (mHasNextAlignment)
+		{
+			alignment = mNextAlignment;
+			mHasNextAlignment = false;
+		}
+		else
+		{
+			finishedGetAlignments = !GetNextAlignment(alignment);
+		}
 
 		// Break out if finished getting alignments
 		if (finishedGetAlignments)
@@ -192,12 +344,41 @@ bool AlleleReader::ReadAlignments(int maxAlignments)
 			break;
 		}
 
+		// Chromosome transitions when reading all chromosomes, each batch
+		// contains data from a single chromosome
+		if (mAllChromosomes && alignment.RefID != mRefID)
+		{
+			// Unmapped reads are sorted to the end of the bam
+			if (alignment.RefID < 0)
+			{
+				finishedGetAlignments = true;
+				break;
+			}
+
+			if (mRefID >= 0)
+			{
+				mNextAlignment = alignment;
+				mHasNextAlignment = true;
+				finishedChromosome = true;
+				break;
+			}
+
+			StartChromosome(alignment.RefID);
+		}
+
 		// Classify reads pairs as discordant and ignore
 		if (IsReadPairDiscordant(alignment, mMaxFragmentLength, mCheckProperPair))
 		{
 			continue;
 		}
 		
+		// Ignore fragments starting outside the region, they are extracted
+		// by the reader responsible for the neighbouring region
+		if (!IsFragmentInRegion(alignment))
+		{
+			continue;
+		}
+
 		// Classify remaining reads as valid concordant reads
 		bool valid = IsReadValidConcordant(alignment, mMaxSoftClipped);
 		
@@ -207,28 +388,28 @@ bool AlleleReader::ReadAlignments(int maxAlignments)
 			mReadQueue.push_back(alignment);
 		}
 		
+		int readEnd = GetReadEnd(alignment);
+		int otherReadEnd = OtherReadEnd(readEnd);
+
 		// Pair up reads and classify as concordant, give passing reads an index
-		map<string,BamAlignment>::iterator otherEndIter = mReadBuffer[GetOtherReadEnd(alignment)].find(alignment.Name);
-		if (otherEndIter != mReadBuffer[GetOtherReadEnd(alignment)].end())
+		PendingRead* otherEnd = mReadBuffer[otherReadEnd].Find(alignment.Name);
+		if (otherEnd != 0)
 		{
-			BamAlignment& alignment1 = alignment;
-			BamAlignment& alignment2 = otherEndIter->second;
-			
 			bool valid1 = valid;
-			bool valid2 = IsReadValidConcordant(alignment2, mMaxSoftClipped);
+			bool valid2 = otherEnd->valid;
 			bool validPair = valid1 && valid2;
 			
 			if (validPair)
 			{
 				// Calculate start and end of fragment alignment
-				int fragmentStart = min(alignment1.Position, alignment2.Position);
-				int fragmentEnd = fragmentStart + abs(alignment1.InsertSize);
+				int fragmentStart = min(alignment.Position, otherEnd->position);
+				int fragmentEnd = fragmentStart + abs(alignment.InsertSize);
 
 				// Set as duplicate if either is duplicate
-				int isDuplicate = (int)(alignment1.IsDuplicate() || alignment2.IsDuplicate());
+				int isDuplicate = (int)(alignment.IsDuplicate() || otherEnd->isDuplicate);
 
 				// Fragment mapping quality as minimum of read mapping qualities
-				int mappingQuality = min(alignment1.MapQuality, alignment2.MapQuality);
+				int mappingQuality = min((int)alignment.MapQuality, otherEnd->mappingQuality);
 
 				// Integer ID for the fragment based on order in which they appear in the BAM
 				int fragmentID = mNextFragmentID;
@@ -239,28 +420,34 @@ bool AlleleReader::ReadAlignments(int maxAlignments)
 				mNextFragmentID++;
 
 				// Store fragment id for snp stage
-				mFragmentID[0].insert(make_pair(alignment.Name, fragmentID));
-				mFragmentID[1].insert(make_pair(alignment.Name, fragmentID));
+				mFragmentID[0].Insert(alignment.Name, fragmentID);
+				mFragmentID[1].Insert(alignment.Name, fragmentID);
 
 				// Save out read alignment info
-				mFragmentData.push_back(FragmentData(fragmentID, fragmentStart, fragmentEnd, mappingQuality, isDuplicate));
+				AddFragment(alignment.Name, fragmentID, fragmentStart, fragmentEnd, mappingQuality, isDuplicate);
 			}
 			
 			// Set status for alignments in the queue
 			if (valid1)
 			{
-				mReadStatus[GetReadEnd(alignment1)].insert(make_pair(alignment1.Name, validPair));
+				mReadStatus[readEnd].Insert(alignment.Name, validPair);
 			}
 			if (valid2)
 			{
-				mReadStatus[GetReadEnd(alignment2)].insert(make_pair(alignment2.Name, validPair));
+				mReadStatus[otherReadEnd].Insert(alignment.Name, validPair);
 			}
 			
-			mReadBuffer[GetOtherReadEnd(alignment)].erase(otherEndIter);
+			mReadBuffer[otherReadEnd].Erase(alignment.Name);
 		}
 		else
 		{
-			mReadBuffer[GetReadEnd(alignment)].insert(make_pair(alignment.Name, alignment));
+			mReadBuffer[readEnd].Insert(alignment.Name, PendingRead(alignment, valid));
+
+			// Bound memory used by reads awaiting their mates
+			if (mReadBuffer[0].Size() + mReadBuffer[1].Size() > mPurgeThreshold)
+			{
+				PurgeBufferedReads(alignment.Position);
+			}
 		}
 		
 		// Process concordant reads from the queue
@@ -268,24 +455,32 @@ bool AlleleReader::ReadAlignments(int maxAlignments)
 		{
 			BamAlignment& nextAlignment = mReadQueue.front();
 			
-			map<string,bool>::iterator readStatusIter = mReadStatus[GetReadEnd(nextAlignment)].find(nextAlignment.Name);
+			bool* readStatus = mReadStatus[GetReadEnd(nextAlignment)].Find(nextAlignment.Name);
 			
 			// Check for existance of read pair status
-			if (readStatusIter != mReadStatus[GetReadEnd(nextAlignment)].end())
+			if (readStatus != 0)
 			{
-				// Add valid reads to the pileup
-				if (readStatusIter->second)
+				// Extract alleles from valid reads
+				if (*readStatus)
 				{
-					mPileupEngine.AddAlignment(nextAlignment);
+					ProcessPairedAlignment(nextAlignment);
 				}
 				
 				// Remove read status
-				mReadStatus[GetReadEnd(nextAlignment)].erase(readStatusIter);
+				mReadStatus[GetReadEnd(nextAlignment)].Erase(nextAlignment.Name);
 			}
 			// Check for an unmatched read stuck in the queue
 			else if (alignment.Position - nextAlignment.Position > 2.0 * mMaxFragmentLength)
 			{
 				cerr << "Warning: Could not match read " << nextAlignment.Name << endl;
+				DiscardQueuedRead(nextAlignment);
+			}
+			// Bound the queue, discarding the oldest read if its mate is
+			// further away than the queue can hold
+			else if (mReadQueue.size() > mMaxBufferedReads)
+			{
+				DiscardQueuedRead(nextAlignment);
+				mNumDiscardedReads++;
 			}
 			// Read pair status unavailable but read not yet considered stuck
 			else
@@ -299,41 +494,223 @@ bool AlleleReader::ReadAlignments(int maxAlignments)
 	}
 
 	// Cleanup after finished getting alignments
-	if (finishedGetAlignments)
+	if (finishedGetAlignments || finishedChromosome)
 	{
-		// Process remaining concordant reads from the queue
-		while (!mReadQueue.empty())
+		FinishChromosome();
+	}
+
+	// Finished once all alignments are read and the last batch returned
+	return !finishedGetAlignments || !mFragmentData.Empty() || !mAlleleData.Empty();
+}
+
+void AlleleReader::StartChromosome(int refID)
+{
+	mRefID = refID;
+	mChromosome = mReferenceData[refID].RefName;
+	mAlternateChromosome = GetAlternateChromosome(mChromosome);
+
+	// Fragment ids are unique per chromosome
+	mNextFragmentID = 0;
+
+	// Take this chromosome's snps, each chromosome is read once from a sorted bam
+	mSNPs.clear();
+	map<string,vector<SNPInfo> >::iterator snpsIter = mGenomeSNPs.find(mChromosome);
+	if (snpsIter == mGenomeSNPs.end())
+	{
+		snpsIter = mGenomeSNPs.find(mAlternateChromosome);
+	}
+	if (snpsIter != mGenomeSNPs.end())
+	{
+		mSNPs.swap(snpsIter->second);
+		mGenomeSNPs.erase(snpsIter);
+	}
+
+	mSNPIter = mSNPs.begin();
+}
+
+void AlleleReader::FinishChromosome()
+{
+	// Process remaining concordant reads from the queue
+	while (!mReadQueue.empty())
+	{
+		BamAlignment& nextAlignment = mReadQueue.front();
+		
+		bool* readStatus = mReadStatus[GetReadEnd(nextAlignment)].Find(nextAlignment.Name);
+		
+		// Check for existance of read pair status
+		if (readStatus != 0)
 		{
-			BamAlignment& nextAlignment = mReadQueue.front();
-			
-			map<string,bool>::iterator readStatusIter = mReadStatus[GetReadEnd(nextAlignment)].find(nextAlignment.Name);
-			
-			// Check for existance of read pair status
-			if (readStatusIter != mReadStatus[GetReadEnd(nextAlignment)].end())
+			// Extract alleles from valid reads
+			if (*readStatus)
 			{
-				// Add valid reads to the pileup
-				if (readStatusIter->second)
-				{
-					mPileupEngine.AddAlignment(nextAlignment);
-				}
-				
-				// Remove read status
-				mReadStatus[GetReadEnd(nextAlignment)].erase(readStatusIter);
-			}
-			// Check for an unmatched read stuck in the queue
-			else
-			{
-				cerr << "Warning: Could not match read " << nextAlignment.Name << endl;
+				ProcessPairedAlignment(nextAlignment);
 			}
 			
-			// Remove read from the queue
-			mReadQueue.pop_front();
+			// Remove read status
+			mReadStatus[GetReadEnd(nextAlignment)].Erase(nextAlignment.Name);
+		}
+		// Check for an unmatched read stuck in the queue
+		else
+		{
+			cerr << "Warning: Could not match read " << nextAlignment.Name << endl;
 		}
 		
+		// Remove read from the queue
+		mReadQueue.pop_front();
+	}
+	
+	if (!mSNPTargeted)
+	{
 		mPileupEngine.Flush();
 	}
 
-	return !mFragmentData.empty() || !mAlleleData.empty();
+	// Reset pairing state, reads not yet paired will not be paired
+	for (int readEnd = 0; readEnd < 2; readEnd++)
+	{
+		mReadBuffer[readEnd] = ReadHashMap<PendingRead>();
+		mReadStatus[readEnd] = ReadHashMap<bool>();
+		mFragmentID[readEnd] = ReadHashMap<int>();
+	}
+	mUncountedFragments = ReadHashMap<bool>();
+	mPurgeThreshold = mMaxBufferedReads;
+
+	// Next alignment starts a new chromosome
+	if (mAllChromosomes)
+	{
+		mRefID = -1;
+	}
+}
+
+const string& AlleleReader::GetChromosome() const
+{
+	return mChromosome;
+}
+
+size_t AlleleReader::GetTableMemory() const
+{
+	return mFragmentData.MemoryUsage() + mAlleleData.MemoryUsage();
+}
+
+size_t AlleleReader::GetNumDiscardedReads() const
+{
+	return mNumDiscardedReads;
+}
+
+bool AlleleReader::GetNextAlignment(BamAlignment& alignment)
+{
+	if (mPrefetcher != 0)
+	{
+		return mPrefetcher->GetNextAlignment(alignment);
+	}
+
+	return mBamReader.GetNextAlignment(alignment);
+}
+
+bool AlleleReader::IsFragmentInRegion(const BamAlignment& alignment) const
+{
+	// Fragments are assigned to the region containing their start, the
+	// minimum position of either read, for both reads of a concordant pair
+	int fragmentStart = min(alignment.Position, alignment.MatePosition);
+
+	if (fragmentStart < mRegionStart)
+	{
+		return false;
+	}
+
+	if (mRegionEnd >= 0 && fragmentStart >= mRegionEnd)
+	{
+		return false;
+	}
+
+	return true;
+}
+
+void AlleleReader::ProcessPairedAlignment(const BamAlignment& alignment)
+{
+	if (mSNPTargeted)
+	{
+		ExtractAlleles(alignment);
+	}
+	else
+	{
+		mPileupEngine.AddAlignment(alignment);
+	}
+}
+
+void AlleleReader::ExtractAlleles(const BamAlignment& alignment)
+{
+	const int* fragmentIDPtr = mFragmentID[GetReadEnd(alignment)].Find(alignment.Name);
+	if (fragmentIDPtr == 0)
+	{
+		return;
+	}
+
+	int fragmentID = *fragmentIDPtr;
+
+	// Find the first snp at or after the start of the alignment
+	SNPInfo alignmentStart;
+	alignmentStart.position = alignment.Position;
+	vector<SNPInfo>::const_iterator snpIter = lower_bound(mSNPs.begin(), mSNPs.end(), alignmentStart);
+
+	// Walk the cigar, labelling the aligned base at each snp as reference or alternate
+	int referencePosition = alignment.Position;
+	int queryPosition = 0;
+	for (vector<CigarOp>::const_iterator cigarOpIter = alignment.CigarData.begin(); cigarOpIter != alignment.CigarData.end(); cigarOpIter++)
+	{
+		if (snpIter == mSNPs.end())
+		{
+			break;
+		}
+
+		int length = (int)cigarOpIter->Length;
+
+		switch (cigarOpIter->Type)
+		{
+			case 'M':
+			case '=':
+			case 'X':
+				for (; snpIter != mSNPs.end() && snpIter->position < referencePosition + length; snpIter++)
+				{
+					char base = toupper(alignment.QueryBases.at(queryPosition + snpIter->position - referencePosition));
+
+					int isAlt = 0;
+					if (base == snpIter->alt)
+					{
+						isAlt = 1;
+					}
+					else if (base != snpIter->ref)
+					{
+						continue;
+					}
+
+					AddAllele(alignment.Name, fragmentID, snpIter - mSNPs.begin(), isAlt);
+				}
+				referencePosition += length;
+				queryPosition += length;
+				break;
+
+			case 'D':
+			case 'N':
+				// Skip snps within deletions and skipped regions
+				referencePosition += length;
+				while (snpIter != mSNPs.end() && snpIter->position < referencePosition)
+				{
+					snpIter++;
+				}
+				break;
+
+			case 'I':
+			case 'S':
+				queryPosition += length;
+				break;
+
+			default:
+				break;
+		}
+	}
+
+	// Fragment id no longer required for this read end
+	ReleaseFragmentID(alignment);
 }
 
 void AlleleReader::Visit(const PileupPosition& pileupData)
@@ -381,18 +758,177 @@ void AlleleReader::Visit(const PileupPosition& pileupData)
 			continue;
 		}
 		
-		int fragmentID = mFragmentID[GetReadEnd(alignment)][alignment.Name];
-		
-		// Output 1-based positions
-		int position = mSNPIter->position + 1;
+		const int* fragmentID = mFragmentID[GetReadEnd(alignment)].Find(alignment.Name);
+		if (fragmentID == 0)
+		{
+			continue;
+		}
 		
 		// Save out snp info
-		mAlleleData.push_back(AlleleData(fragmentID, position, isAlt));
+		AddAllele(alignment.Name, *fragmentID, mSNPIter - mSNPs.begin(), isAlt);
 	}
 }
 
 void AlleleReader::Visit(const BamAlignment& alignment)
 {
-	mFragmentID[GetReadEnd(alignment)].erase(alignment.Name);
+	ReleaseFragmentID(alignment);
+}
+
+void AlleleReader::CountSegments(const vector<int>& segmentStarts,
+                                 const vector<int>& segmentEnds,
+                                 const vector<int>& samplePositions,
+                                 bool filterDuplicates,
+                                 int mapQualThreshold)
+{
+	if (mAllChromosomes)
+	{
+		throw invalid_argument("Counting segments requires a chromosome");
+	}
+
+	if (segmentStarts.size() != segmentEnds.size())
+	{
+		throw invalid_argument("Segment starts and ends differ in length");
+	}
+
+	mCountSegments = true;
+	mFilterDuplicates = filterDuplicates;
+	mMapQualThreshold = mapQualThreshold;
+
+	mSegmentStarts = segmentStarts;
+	mSegmentEnds = segmentEnds;
+	mSamplePositions = samplePositions;
+
+	mSegmentCounts = SegmentCounts();
+	mSegmentCounts.readCount.resize(mSegmentStarts.size(), 0);
+	mSegmentCounts.sampleReadCount.resize(mSamplePositions.size(), 0);
+	mSegmentCounts.snpRefCount.resize(mSNPs.size(), 0);
+	mSegmentCounts.snpAltCount.resize(mSNPs.size(), 0);
+
+	// Output 1-based positions
+	for (vector<SNPInfo>::const_iterator snpIter = mSNPs.begin(); snpIter != mSNPs.end(); snpIter++)
+	{
+		mSegmentCounts.snpPosition.push_back(snpIter->position + 1);
+	}
+}
+
+int AlleleReader::FindContainingSegment(int start, int end) const
+{
+	// Last segment starting at or before the fragment start
+	int segmentIdx = (int)(upper_bound(mSegmentStarts.begin(), mSegmentStarts.end(), start) - mSegmentStarts.begin()) - 1;
+
+	// First segment ending at or after the fragment end
+	int segmentEndIdx = (int)(lower_bound(mSegmentEnds.begin(), mSegmentEnds.end(), end) - mSegmentEnds.begin());
+
+	if (segmentIdx != segmentEndIdx)
+	{
+		return -1;
+	}
+
+	return segmentIdx;
 }
 
+void AlleleReader::AddFragment(const string& name, int fragmentID, int fragmentStart, int fragmentEnd, int mappingQuality, int isDuplicate)
+{
+	if (!mCountSegments)
+	{
+		mFragmentData.Append(fragmentID, fragmentStart, fragmentEnd, mappingQuality, isDuplicate);
+		return;
+	}
+
+	if ((mFilterDuplicates && isDuplicate) || mappingQuality < mMapQualThreshold)
+	{
+		return;
+	}
+
+	int64_t length = fragmentEnd - fragmentStart;
+	mSegmentCounts.fragmentCount++;
+	mSegmentCounts.fragmentLengthSum += length;
+	mSegmentCounts.fragmentLengthSumSquares += length * length;
+
+	vector<int>::const_iterator sampleIter = lower_bound(mSamplePositions.begin(), mSamplePositions.end(), fragmentStart);
+	if (sampleIter != mSamplePositions.end() && *sampleIter == fragmentStart)
+	{
+		mSegmentCounts.sampleReadCount[sampleIter - mSamplePositions.begin()]++;
+	}
+
+	int segmentIdx = FindContainingSegment(fragmentStart, fragmentEnd);
+	if (segmentIdx < 0)
+	{
+		return;
+	}
+
+	// Reads starting at the end of the previous segment are not counted,
+	// consistent with remixt.segalg.contained_counts
+	if (segmentIdx == 0 || mSegmentEnds[segmentIdx - 1] < fragmentStart)
+	{
+		mSegmentCounts.readCount[segmentIdx]++;
+	}
+
+	// Count the first allele of fragments contained within a segment, the
+	// first extracted as for remixt.analysis.haplotype.read_first_hap_alleles
+	mUncountedFragments.Insert(name, true);
+}
+
+void AlleleReader::AddAllele(const string& name, int fragmentID, int snpIndex, int isAlt)
+{
+	if (!mCountSegments)
+	{
+		// Output 1-based positions
+		mAlleleData.Append(fragmentID, mSNPs[snpIndex].position + 1, isAlt);
+		return;
+	}
+
+	if (mUncountedFragments.Erase(name))
+	{
+		if (isAlt)
+		{
+			mSegmentCounts.snpAltCount[snpIndex]++;
+		}
+		else
+		{
+			mSegmentCounts.snpRefCount[snpIndex]++;
+		}
+	}
+}
+
+void AlleleReader::ReleaseFragmentID(const BamAlignment& alignment)
+{
+	int readEnd = GetReadEnd(alignment);
+
+	mFragmentID[readEnd].Erase(alignment.Name);
+
+	// Fragments without alleles are complete once both reads are released
+	if (mCountSegments && mFragmentID[OtherReadEnd(readEnd)].Find(alignment.Name) == 0)
+	{
+		mUncountedFragments.Erase(alignment.Name);
+	}
+}
+
+void AlleleReader::DiscardQueuedRead(const BamAlignment& alignment)
+{
+	// Read will not be paired if its mate is seen later
+	mReadBuffer[GetReadEnd(alignment)].Erase(alignment.Name);
+}
+
+void AlleleReader::PurgeBufferedReads(int position)
+{
+	// Remove reads whose mates should have been seen, they will never be paired
+	for (int readEnd = 0; readEnd < 2; readEnd++)
+	{
+		vector<pair<string,PendingRead> > entries;
+		mReadBuffer[readEnd].GetEntries(entries);
+
+		for (vector<pair<string,PendingRead> >::const_iterator entryIter = entries.begin(); entryIter != entries.end(); entryIter++)
+		{
+			if (entryIter->second.matePosition < position)
+			{
+				mReadBuffer[readEnd].Erase(entryIter->first);
+			}
+		}
+	}
+
+	// Remaining reads have mates within the maximum fragment length, delay
+	// the next purge until the buffer has doubled to bound the cost of purging
+	size_t numBuffered = mReadBuffer[0].Size() + mReadBuffer[1].Size();
+	mPurgeThreshold = max(mMaxBufferedReads, 2 * numBuffered);
+}
@@ -3,50 +3,122 @@
 
 #include <string>
 #include <deque>
+#include <vector>
 #include <map>
+#include <stdint.h>
 
 #include "external/bamtools/src/api/BamReader.h"
 #include "external/bamtools/src/utils/bamtools_pileup_engine.h"
 
+#include "ReadHashMap.h"
+#include "AlignmentPrefetcher.h"
 
-struct FragmentData
+
+// Fragment table stored as one array per column, allowing the arrays
+// to be handed to numpy without copying
+struct FragmentTable
 {
-	FragmentData(
+	void Append(
 		int fragmentID,
 		int fragmentStart,
 		int fragmentEnd,
 		int mappingQuality,
 		int isDuplicate
-	):
-			fragmentID(fragmentID),
-			fragmentStart(fragmentStart),
-			fragmentEnd(fragmentEnd),
-			mappingQuality(mappingQuality),
-			isDuplicate(isDuplicate)
-	{}
+	)
+	{
+		this->fragmentID.push_back(fragmentID);
+		this->fragmentStart.push_back(fragmentStart);
+		this->fragmentEnd.push_back(fragmentEnd);
+		this->mappingQuality.push_back(mappingQuality);
+		this->isDuplicate.push_back(isDuplicate);
+	}
 
-	int fragmentID;
-	int fragmentStart;
-	int fragmentEnd;
-	int mappingQuality;
-	int isDuplicate;
+	void Clear()
+	{
+		fragmentID.clear();
+		fragmentStart.clear();
+		fragmentEnd.clear();
+		mappingQuality.clear();
+		isDuplicate.clear();
+	}
+
+	bool Empty() const
+	{
+		return fragmentID.empty();
+	}
+
+	// Bytes allocated, including unused capacity handed to numpy with the arrays
+	size_t MemoryUsage() const
+	{
+		return (fragmentID.capacity() + fragmentStart.capacity() + fragmentEnd.capacity() +
+		        mappingQuality.capacity() + isDuplicate.capacity()) * sizeof(int);
+	}
+
+	std::vector<int> fragmentID;
+	std::vector<int> fragmentStart;
+	std::vector<int> fragmentEnd;
+	std::vector<int> mappingQuality;
+	std::vector<int> isDuplicate;
 };
 
-struct AlleleData
+// Allele table stored as one array per column
+struct AlleleTable
 {
-	AlleleData(
+	void Append(
 		int fragmentID,
 		int position,
 		int isAlt
-	):
-		fragmentID(fragmentID),
-		position(position),
-		isAlt(isAlt)
-	{}
+	)
+	{
+		this->fragmentID.push_back(fragmentID);
+		this->position.push_back(position);
+		this->isAlt.push_back(isAlt);
+	}
 
-	int fragmentID;
-	int position;
-	int isAlt;
+	void Clear()
+	{
+		fragmentID.clear();
+		position.clear();
+		isAlt.clear();
+	}
+
+	bool Empty() const
+	{
+		return fragmentID.empty();
+	}
+
+	// Bytes allocated, including unused capacity handed to numpy with the arrays
+	size_t MemoryUsage() const
+	{
+		return (fragmentID.capacity() + position.capacity() + isAlt.capacity()) * sizeof(int);
+	}
+
+	std::vector<int> fragmentID;
+	std::vector<int> position;
+	std::vector<int> isAlt;
+};
+
+// Counts accumulated in place of the fragment and allele tables when
+// counting reads in segments during extraction
+struct SegmentCounts
+{
+	SegmentCounts() : fragmentCount(0), fragmentLengthSum(0), fragmentLengthSumSquares(0) {}
+
+	// Reads contained in each segment
+	std::vector<int> readCount;
+
+	// Reads starting at each sampled position
+	std::vector<int> sampleReadCount;
+
+	// Reads with their first allele at each snp, for the reference and alternate allele
+	std::vector<int> snpPosition;
+	std::vector<int> snpRefCount;
+	std::vector<int> snpAltCount;
+
+	// Moments of the fragment length distribution
+	int64_t fragmentCount;
+	int64_t fragmentLengthSum;
+	int64_t fragmentLengthSumSquares;
 };
 
 struct SNPInfo
@@ -61,6 +133,30 @@ struct SNPInfo
 	}
 };
 
+// Read awaiting its mate, with the information required for pairing
+struct PendingRead
+{
+	PendingRead() {}
+
+	PendingRead(const BamTools::BamAlignment& alignment, bool valid)
+		: position(alignment.Position),
+		  matePosition(alignment.MatePosition),
+		  mappingQuality(alignment.MapQuality),
+		  isDuplicate(alignment.IsDuplicate()),
+		  valid(valid)
+	{}
+
+	int position;
+	int matePosition;
+	int mappingQuality;
+	bool isDuplicate;
+	bool valid;
+};
+
+// Binary snp index record, a per chromosome file of packed records sorted
+// by position, with 1-based positions as in the snp positions TSV
+const int SNPIndexRecordSize = 6;
+
 struct AlleleReader : BamTools::PileupVisitor, BamTools::DiscardAlignmentVisitor
 {
 	AlleleReader(const std::string& bamFilename,
@@ -68,35 +164,108 @@ struct AlleleReader : BamTools::PileupVisitor, BamTools::DiscardAlignmentVisitor
 	             const std::string& chromosome,
 	             int maxFragmentLength,
 	             int maxSoftClipped,
-	             bool checkProperPair);
+	             bool checkProperPair,
+	             int regionStart,
+	             int regionEnd,
+	             int maxBufferedReads,
+	             bool snpTargeted,
+	             int threads,
+	             int prefetchAlignments);
+
+	~AlleleReader();
 
 	void ReadSNPs(const std::string& snpFilename);
 
+	void ReadSNPIndex(const std::string& snpIndexFilename);
+
+	void CountSegments(const std::vector<int>& segmentStarts,
+	                   const std::vector<int>& segmentEnds,
+	                   const std::vector<int>& samplePositions,
+	                   bool filterDuplicates,
+	                   int mapQualThreshold);
+
+	// Read up to maxAlignments alignments into the fragment and allele tables,
+	// returns false once all alignments have been read and returned.  Batches
+	// may be empty before the end, for instance if all reads are discordant.
 	bool ReadAlignments(int maxAlignments);
 
+	bool GetNextAlignment(BamTools::BamAlignment& alignment);
+
+	const std::string& GetChromosome() const;
+
+	size_t GetTableMemory() const;
+
+	// Number of reads discarded as their mate was further away than the
+	// maximum buffered reads
+	size_t GetNumDiscardedReads() const;
+
+	void StartChromosome(int refID);
+
+	void FinishChromosome();
+
+	bool IsFragmentInRegion(const BamTools::BamAlignment& alignment) const;
+
+	int FindContainingSegment(int start, int end) const;
+
+	void AddFragment(const std::string& name, int fragmentID, int fragmentStart, int fragmentEnd, int mappingQuality, int isDuplicate);
+
+	void AddAllele(const std::string& name, int fragmentID, int snpIndex, int isAlt);
+
+	void ReleaseFragmentID(const BamTools::BamAlignment& alignment);
+
+	void ProcessPairedAlignment(const BamTools::BamAlignment& alignment);
+
+	void ExtractAlleles(const BamTools::BamAlignment& alignment);
+
+	void DiscardQueuedRead(const BamTools::BamAlignment& alignment);
+
+	void PurgeBufferedReads(int position);
+
 	void Visit(const BamTools::PileupPosition& pileupData);
 	
 	void Visit(const BamTools::BamAlignment& alignment);
 	
 	BamTools::BamReader mBamReader;
-	const std::string& mChromosome;
+	BamTools::RefVector mReferenceData;
+	AlignmentPrefetcher* mPrefetcher;
+	std::string mChromosome;
+	bool mAllChromosomes;
 	std::string mAlternateChromosome;
 
-	std::vector<FragmentData> mFragmentData;
-	std::vector<AlleleData> mAlleleData;
+	FragmentTable mFragmentData;
+	AlleleTable mAlleleData;
+
+	bool mCountSegments;
+	bool mFilterDuplicates;
+	int mMapQualThreshold;
+	std::vector<int> mSegmentStarts;
+	std::vector<int> mSegmentEnds;
+	std::vector<int> mSamplePositions;
+	SegmentCounts mSegmentCounts;
+	ReadHashMap<bool> mUncountedFragments;
 	
 	int mMaxFragmentLength;
 	int mMaxSoftClipped;
 	bool mCheckProperPair;
+	int mRegionStart;
+	int mRegionEnd;
+	size_t mMaxBufferedReads;
+	bool mSNPTargeted;
 	
 	std::deque<BamTools::BamAlignment> mReadQueue;
-	std::map<std::string,BamTools::BamAlignment> mReadBuffer[2];
-	std::map<std::string,bool> mReadStatus[2];
-	std::map<std::string,int> mFragmentID[2];
+	ReadHashMap<PendingRead> mReadBuffer[2];
+	ReadHashMap<bool> mReadStatus[2];
+	ReadHashMap<int> mFragmentID[2];
+	size_t mPurgeThreshold;
+	size_t mNumDiscardedReads;
 	
 	int mRefID;
 	int mNextFragmentID;
+
+	BamTools::BamAlignment mNextAlignment;
+	bool mHasNextAlignment;
 	
+	std::map<std::string,std::vector<SNPInfo> > mGenomeSNPs;
 	std::vector<SNPInfo> mSNPs;
 	std::vector<SNPInfo>::const_iterator mSNPIter;
 
@@ -0,0 +1,174 @@
+#ifndef READHASHMAP_H_
+#define READHASHMAP_H_
+
+#include <string>
+#include <vector>
+#include <algorithm>
+#include <stdint.h>
+
+
+// 64-bit FNV-1a hash of a read name, 0 is reserved for empty slots
+inline uint64_t HashReadName(const std::string& name)
+{
+	uint64_t hash = 14695981039346656037ULL;
+	for (std::string::const_iterator charIter = name.begin(); charIter != name.end(); charIter++)
+	{
+		hash ^= (unsigned char)(*charIter);
+		hash *= 1099511628211ULL;
+	}
+	return (hash == 0) ? 1 : hash;
+}
+
+// Open addressing hash map keyed by read name, with linear probing and
+// backward shift deletion.  Slots store the name hash to skip most name
+// comparisons, and the name to distinguish reads with colliding hashes.
+// Names are kept as a collision, though rare, would silently pair reads of
+// different fragments.  Compared to a std::map, memory is saved by avoiding
+// a tree node allocation per read, and the number of names held is bounded
+// by the maximum buffered reads of the reader.
+template <typename TValue>
+class ReadHashMap
+{
+public:
+	ReadHashMap() : mSize(0), mMask(15)
+	{
+		mSlots.resize(mMask + 1);
+	}
+
+	size_t Size() const
+	{
+		return mSize;
+	}
+
+	TValue* Find(const std::string& name)
+	{
+		uint64_t hash = HashReadName(name);
+		for (size_t idx = Home(hash); mSlots[idx].hash != 0; idx = (idx + 1) & mMask)
+		{
+			if (mSlots[idx].hash == hash && mSlots[idx].name == name)
+			{
+				return &mSlots[idx].value;
+			}
+		}
+		return 0;
+	}
+
+	// Insert a value, keeping the existing value if the name is present
+	void Insert(const std::string& name, const TValue& value)
+	{
+		InsertHashed(HashReadName(name), name, value);
+	}
+
+	bool Erase(const std::string& name)
+	{
+		uint64_t hash = HashReadName(name);
+		size_t idx = Home(hash);
+		for (; mSlots[idx].hash != hash || mSlots[idx].name != name; idx = (idx + 1) & mMask)
+		{
+			if (mSlots[idx].hash == 0)
+			{
+				return false;
+			}
+		}
+
+		// Shift subsequent entries of the probe sequence back into the gap
+		size_t next = idx;
+		while (true)
+		{
+			mSlots[idx].hash = 0;
+			mSlots[idx].name.clear();
+
+			while (true)
+			{
+				next = (next + 1) & mMask;
+
+				if (mSlots[next].hash == 0)
+				{
+					mSize--;
+					return true;
+				}
+
+				// Entry can fill the gap if its home is not cyclically within (idx, next]
+				size_t home = Home(mSlots[next].hash);
+				if (((next - home) & mMask) >= ((next - idx) & mMask))
+				{
+					break;
+				}
+			}
+
+			std::swap(mSlots[idx], mSlots[next]);
+			idx = next;
+		}
+	}
+
+	void GetEntries(std::vector<std::pair<std::string,TValue> >& entries) const
+	{
+		for (typename std::vector<Slot>::const_iterator slotIter = mSlots.begin(); slotIter != mSlots.end(); slotIter++)
+		{
+			if (slotIter->hash != 0)
+			{
+				entries.push_back(std::make_pair(slotIter->name, slotIter->value));
+			}
+		}
+	}
+
+private:
+	struct Slot
+	{
+		Slot() : hash(0), value() {}
+
+		uint64_t hash;
+		std::string name;
+		TValue value;
+	};
+
+	size_t Home(uint64_t hash) const
+	{
+		// Fibonacci hashing to spread the low bits
+		return (size_t)((hash * 11400714819323198485ULL) >> 32) & mMask;
+	}
+
+	void InsertHashed(uint64_t hash, const std::string& name, const TValue& value)
+	{
+		if (2 * (mSize + 1) > mSlots.size())
+		{
+			Grow();
+		}
+
+		size_t idx = Home(hash);
+		for (; mSlots[idx].hash != 0; idx = (idx + 1) & mMask)
+		{
+			if (mSlots[idx].hash == hash && mSlots[idx].name == name)
+			{
+				return;
+			}
+		}
+
+		mSlots[idx].hash = hash;
+		mSlots[idx].name = name;
+		mSlots[idx].value = value;
+		mSize++;
+	}
+
+	void Grow()
+	{
+		std::vector<Slot> slots((mMask + 1) * 2);
+		mSlots.swap(slots);
+		mMask = mSlots.size() - 1;
+		mSize = 0;
+
+		for (typename std::vector<Slot>::const_iterator slotIter = slots.begin(); slotIter != slots.end(); slotIter++)
+		{
+			if (slotIter->hash != 0)
+			{
+				InsertHashed(slotIter->hash, slotIter->name, slotIter->value);
+			}
+		}
+	}
+
+	std::vector<Slot> mSlots;
+	size_t mSize;
+	size_t mMask;
+};
+
+#endif